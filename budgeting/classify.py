@@ -14,11 +14,18 @@ Options:
 from docopt import docopt
 import numpy as np
 from sklearn import linear_model
+from sklearn.exceptions import ConvergenceWarning
+import warnings
 import pickle
+from scipy.sparse import csr_matrix
 
 #print(device)
 #random.seed(77)
 
+#The cheap fitness classifiers run few epochs on purpose. The filter is set once here, not around
+#each fit: warnings.catch_warnings() swaps process-wide state and fits run in threads.
+warnings.filterwarnings('ignore', category=ConvergenceWarning)
+
 
 def get_single_classes(classes):
     classes = list(classes.values())
@@ -37,23 +44,71 @@ def make_output(classes,class_ids):
     return [class_ids[c] for c in classes]
 
 
-def train_model(m_train,classes_train,m_val,classes_val,C,num_iter):
-    lm = linear_model.LogisticRegression(multi_class='ovr', solver='liblinear',
-                                         max_iter=num_iter, C=C, verbose=0)
-    lm.fit(m_train, classes_train)
+#Classifiers that can be used as fitness function. liblinear is the reference;
+#the others are cheaper approximations, sgd and perceptron can be warm-started.
+FITNESS_CLASSIFIERS = ['liblinear', 'sgd', 'perceptron', 'ridge']
+WARM_START_CLASSIFIERS = ['sgd', 'perceptron']
+
+
+#Seeded, so that fitting doesn't draw from the global random state used by the GA
+#(fitness evaluations run in threads, in no fixed order).
+def make_classifier(classifier, C, num_iter, num_docs):
+    if classifier == 'liblinear':
+        return linear_model.LogisticRegression(multi_class='ovr', solver='liblinear',
+                                               max_iter=num_iter, C=C, verbose=0, random_state=0)
+    if classifier == 'sgd': #linear SVM, same regularisation strength as C
+        return linear_model.SGDClassifier(loss='hinge', alpha=1 / (C * num_docs),
+                                          max_iter=min(num_iter, 20), tol=1e-3, random_state=0)
+    if classifier == 'perceptron': #averaged perceptron
+        return linear_model.SGDClassifier(loss='perceptron', alpha=1 / (C * num_docs), learning_rate='optimal',
+                                          average=True, max_iter=min(num_iter, 10), tol=1e-3, random_state=0)
+    if classifier == 'ridge': #one-vs-rest least squares on the binary hashes, solved by lsqr on the sparse matrix
+        return linear_model.RidgeClassifier(alpha=num_docs / C, solver='lsqr')
+    raise ValueError(f"Unknown classifier {classifier}, should be one of {FITNESS_CLASSIFIERS}")
+
+
+def train_model(m_train,classes_train,m_val,classes_val,C,num_iter,classifier='liblinear',init=None):
+    """Fit the classifier on the train hashes and return its accuracy on the validation hashes.
+    init is an optional (coef, intercept) pair to warm-start sgd and perceptron from, e.g. the
+    coefficients of a parent fly (see warm_start_coefs)."""
+    lm = make_classifier(classifier, C, num_iter, m_train.shape[0])
+    if classifier in WARM_START_CLASSIFIERS and init is not None and init[0].shape[1] == m_train.shape[1]:
+        lm.fit(m_train, classes_train, coef_init=init[0], intercept_init=init[1])
+    else:
+        lm.fit(m_train, classes_train)
     score = lm.score(m_val,classes_val)
     # print(lm.predict(m_val))
     # print(score)
     return score, lm
 
 
+def warm_start_coefs(lm, classifier):
+    """Coefficients to keep with a fly so that its children can be warm-started (None if the classifier can't)."""
+    if classifier not in WARM_START_CLASSIFIERS:
+        return None
+    return lm.coef_.astype(np.float32), lm.intercept_.astype(np.float32)
+
+
+def update_warm_start(coefs, changed_rows, kc_size, max_changed=0.5):
+    """Adapt stored coefficients to a mutated projection: the weights of rewired KCs are reset,
+    new KCs start at zero. Warm-starting is abandoned if too many KCs changed."""
+    if coefs is None or len(set(changed_rows)) > max_changed * kc_size:
+        return None
+    coef, intercept = coefs
+    coef = coef.copy()
+    coef[:, list(set(changed_rows))] = 0
+    if kc_size > coef.shape[1]: #grown projection
+        coef = np.hstack([coef, np.zeros((coef.shape[0], kc_size - coef.shape[1]), dtype=coef.dtype)])
+    return coef, intercept
+
+
 def prepare_data(tr_file):
     dev_file = tr_file.replace("train","val")
     # print("Reading dataset...")
-    m_train = pickle.load(open(tr_file,'rb')).todense()
+    m_train = csr_matrix(pickle.load(open(tr_file,'rb')))
     #print(m_train)
     #m_train = preprocessing.normalize(m_train, norm='l1')
-    m_val = pickle.load(open(dev_file,'rb')).todense()
+    m_val = csr_matrix(pickle.load(open(dev_file,'rb')))
     #print(m_val)
     #m_val = preprocessing.normalize(m_val, norm='l1')
 
@@ -1,48 +1,79 @@
 """Genetic Algorithm for fruit-fly projection
 Usage:
-  evolve_on_budget.py [--dataset=<wos|wiki|20news>]
+  evolve_on_budget.py --config=<file> [--dataset=<wos|wiki|20news>] [--classifier=<name>] [--islands=<n>] [--migration=<n>] [--steady_state] [--select_once] [--checkpoint=<dir> [--checkpoint_every=<n>] [--resume]]
   evolve_on_budget.py (-h | --help)
   evolve_on_budget.py --version
 
 Options:
+  --config=<file>                 JSON file with the budgets, the grid of GA settings and the resources of the grid runner (see grid_config.json).
   --dataset=<wos|wiki|news>       Name of dataset to be tested. If flag is unused, all datasets are tested.
+  --classifier=<name>             Fitness classifier: liblinear, sgd, perceptron or ridge. sgd and perceptron are warm-started from the parent fly [default: liblinear].
   -h --help                       Show this screen.
   --version                       Show version.
+  --islands=<n>                   Number of sub-populations evolved in parallel processes [default: 1].
+  --migration=<n>                 With islands, number of generations between migrations of the best flies [default: 5].
+  --steady_state                  Breed and evaluate one child at a time as soon as a thread is free, instead of generation by generation.
+  --select_once                   Select the parents once per generation rather than for every pair (faster on large populations).
+  --checkpoint=<dir>              Save the full state of the GA as it evolves, in one file (.npz) per grid configuration in this directory.
+  --checkpoint_every=<n>          Number of generations between checkpoints [default: 1].
+  --resume                        Continue each grid configuration from its checkpoint, if it exists.
 """
 
 import os
+import json
 import pickle
 import numpy as np
 import joblib
 import multiprocessing
 import sentencepiece as spm
 from sklearn.feature_extraction.text import CountVectorizer
-from scipy.sparse import hstack, vstack, lil_matrix, coo_matrix
+from scipy.sparse import coo_matrix
 from docopt import docopt
 import time
 from datetime import datetime
 from copy import deepcopy
 
 from hyperparam_search import read_n_encode_dataset
-from classify import train_model
+from classify import train_model, warm_start_coefs, update_warm_start
 from hash import read_vocab
-from utils import hash_dataset_, append_as_json, get_stats
+from utils import hash_dataset_, append_as_json, get_stats, select_parents, MetricsSink
+from parallel_ga import run_islands, steady_state
+from checkpoint import Checkpointer, load_checkpoint
+from genome import Genome
+from timer import ComputeMeter
+from grid_runner import run_grid
 import itertools
 
 class Fly:
     def __init__(self):
         self.kc_size = np.random.randint(low=MIN_KC, high=MAX_KC)
         self.wta = np.random.uniform(low=MIN_WTA, high=MAX_WTA)
-        weight_mat = np.zeros((self.kc_size, PN_SIZE))
-        for i in range(self.kc_size):
-            num_proj = np.random.randint(low=MIN_PROJ, high=MAX_PROJ)
-            for j in np.random.randint(PN_SIZE, size=num_proj):
-                weight_mat[i, j] = 1
-        self.projections = lil_matrix(weight_mat)
+        self.genome, self.projections = Genome.random(self.kc_size, PN_SIZE, MIN_PROJ, MAX_PROJ)
         self.val_scores = [0, 0, 0]
+        self.coefs = [None, None, None] #classifier weights per dataset, to warm-start children
         self.kc_score = 1 / np.log10(int(self.kc_size * self.wta / 100))
         self.is_evaluated = False
 
+    def __getstate__(self):
+        # pickled flies only carry their genome, the projection matrix is regenerated from it
+        state = dict(vars(self))
+        del state['projections']
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        if 'genome' not in state:  #saved before flies had a genome: the matrix becomes its root
+            self.genome = Genome.snapshot(self.projections)
+            del self.projections  #regenerated as CSR
+        if not hasattr(self, 'projections'):
+            self.projections = self.genome.projections()
+
+    def __deepcopy__(self, memo):
+        # copies made while breeding keep their matrix (the genome itself is shared)
+        fly = Fly.__new__(Fly)
+        vars(fly).update(deepcopy(vars(self), memo))
+        return fly
+
     def get_fitness(self):
         if not self.is_evaluated:
             return 0
@@ -62,9 +93,10 @@ class Fly:
                                        percent_hash=self.wta, top_words=TOP_WORDS)
             hash_val = hash_dataset_(dataset_mat=val_set_list[i], weight_mat=self.projections,
                                      percent_hash=self.wta, top_words=TOP_WORDS)
-            val_score, _ = train_model(m_train=hash_train, classes_train=train_label_list[i],
-                                       m_val=hash_val, classes_val=val_label_list[i],
-                                       C=C, num_iter=NUM_ITER)
+            val_score, lm = train_model(m_train=hash_train, classes_train=train_label_list[i],
+                                        m_val=hash_val, classes_val=val_label_list[i],
+                                        C=C, num_iter=NUM_ITER, classifier=FITNESS_CLASSIFIER, init=self.coefs[i])
+            self.coefs[i] = warm_start_coefs(lm, FITNESS_CLASSIFIER)
             val_score_list.append(val_score)
         self.val_scores = val_score_list
         self.is_evaluated = True
@@ -81,6 +113,13 @@ def init_pop(pop_size: int):
     return population
 
 
+def evaluate_measured(fly: Fly):
+    """Evaluate a fly, charging the CPU and wall time it takes to the compute meter of the run."""
+    with compute.measure() as cost:
+        result = fly.evaluate()
+    return result, cost
+
+
 def eval_pop(population: list):
     """
     Calculate the fitness of every chromosome
@@ -88,46 +127,14 @@ def eval_pop(population: list):
     """
     def _eval_individual(fly: Fly):
         if not fly.is_evaluated:
-            stats = fly.evaluate()
-            print("FLY STATS:",stats)
+            stats, cost = evaluate_measured(fly)
+            print("FLY STATS:",stats,"COMPUTE:",cost)
         else:
             pass
     joblib.Parallel(n_jobs=max_thread, prefer="threads")(
         joblib.delayed(_eval_individual)(fly) for fly in population)
 
 
-def select_elite_tournament(fitness_list: list, elite: int, select_percent: float):
-    """
-    Tournament + elitism selection.
-    Return the index of genes that has been selected.
-    """
-    selected = []
-    num_select = round(select_percent * len(fitness_list)) - 2
-    if num_select < 2:
-        num_select = 2  # mother, father
-
-    #fitness2idx = {k: v for v, k in enumerate(fitness_list)} #This is problemative with duplicate values
-    elite_chroms = elite
-    if num_select < elite_chroms:
-        elite_chroms = num_select
-    elites = sorted(fitness_list, reverse=True)[:elite_chroms]
-    for eli in elites:
-        idx = [index for index, value in enumerate(fitness_list) if value == eli]
-        #selected.add(fitness2idx[eli])
-        selected.extend(idx)
-    selected = set(selected)
-
-    while len(selected) < num_select:
-        first_cand, second_cand = np.random.choice(range(len(fitness_list)), 2)
-        if fitness_list[first_cand] > fitness_list[second_cand]:
-            if first_cand not in selected:
-                selected.add(first_cand)
-        else:
-            if second_cand not in selected:
-                selected.add(second_cand)
-    return list(selected)
-
-
 def crossover(parent1: Fly, parent2: Fly):
     """
     Crossover two flies
@@ -141,24 +148,25 @@ def crossover(parent1: Fly, parent2: Fly):
     child2 = deepcopy(parent2)
     child1.is_evaluated = False
     child2.is_evaluated = False
+    # KCs are resampled and rewired, so the children's classifiers start from scratch
+    child1.coefs = [None] * len(parent1.coefs)
+    child2.coefs = [None] * len(parent2.coefs)
 
 
     # first, crossover projection matrices
     # truncate
     if parent1.kc_size > parent2.kc_size:
-        random_indices = np.random.choice(parent1.kc_size, size=int(parent2.kc_size), replace=False)
-        child1.projections = parent1.projections[random_indices, :]
+        child1.genome, child1.projections = parent1.genome.select(parent1.projections, int(parent2.kc_size))
         child1.kc_size = child1.projections.shape[0]
     else:
-        random_indices = np.random.choice(parent2.kc_size, size=int(parent1.kc_size), replace=False)
-        child2.projections = parent2.projections[random_indices, :]
+        child2.genome, child2.projections = parent2.genome.select(parent2.projections, int(parent1.kc_size))
         child2.kc_size = child2.projections.shape[0]
     # swap
     col_idx = int(child1.projections.shape[1]/2)
-    new_proj_1 = hstack([child1.projections[:, :col_idx], child2.projections[:, col_idx:]])
-    new_proj_2 = hstack([child1.projections[:, col_idx:], child2.projections[:, :col_idx]])
-    
-    child1.projections, child2.projections = lil_matrix(new_proj_1), lil_matrix(new_proj_2)
+    genome_1, new_proj_1 = child1.genome.cross(child1.projections, child2.genome, child2.projections, col_idx)
+    genome_2, new_proj_2 = child2.genome.cross(child2.projections, child1.genome, child1.projections, col_idx, swap=True)
+    child1.genome, child1.projections = genome_1, new_proj_1
+    child2.genome, child2.projections = genome_2, new_proj_2
 
     # then, crossover wta
     wta_low, wta_high = sorted([child1.wta, child2.wta])
@@ -186,25 +194,16 @@ def mutate(individual: Fly, mutate_prob_proj: float, mutate_scale_wta: float, gr
     mutated_indiv.is_evaluated = False
 
     # first, mutate the projection
-    row_mutate = np.random.choice(individual.kc_size, int(individual.kc_size * mutate_prob_proj))
-    for i in row_mutate:
-        new_row = np.zeros(PN_SIZE)
-        num_proj = np.random.randint(low=MIN_PROJ, high=MAX_PROJ)
-        new_row[np.random.randint(0, PN_SIZE, num_proj)] = 1
-        mutated_indiv.projections[i] = new_row
-        mutated_indiv.projections = lil_matrix(mutated_indiv.projections)
+    mutated_indiv.genome, mutated_indiv.projections, row_mutate = individual.genome.mutate(
+        individual.projections, int(individual.kc_size * mutate_prob_proj), MIN_PROJ, MAX_PROJ)
         
     # add a few new rows
     if grow:
         num_new_row = np.random.randint(low=5, high=10)
-        new_mat = np.zeros((num_new_row, PN_SIZE))
-        for i in range(num_new_row):
-            num_proj = np.random.randint(low=MIN_PROJ, high=MAX_PROJ)
-            for j in np.random.randint(PN_SIZE, size=num_proj):
-                new_mat[i, j] = 1
-        # concat the old part with the new part
-        mutated_indiv.projections = vstack([mutated_indiv.projections, lil_matrix(new_mat)])
-        mutated_indiv.projections = lil_matrix(mutated_indiv.projections)
+        mutated_indiv.genome, mutated_indiv.projections = mutated_indiv.genome.grow(
+            mutated_indiv.projections, num_new_row, MIN_PROJ, MAX_PROJ)
+
+    mutated_indiv.coefs = [update_warm_start(c, row_mutate, mutated_indiv.projections.shape[0]) for c in individual.coefs]
 
     # then, mutate the wta
     new_wta = np.random.normal(loc=individual.wta, scale=mutate_scale_wta)
@@ -217,17 +216,11 @@ def mutate(individual: Fly, mutate_prob_proj: float, mutate_scale_wta: float, gr
     return mutated_indiv
 
 def evolve(population: list, elite: int, select_percent: float,
-        crossover_prob: float, mutate_prob_proj: float, mutate_scale_wta: float, grow: bool):
+        crossover_prob: float, mutate_prob_proj: float, mutate_scale_wta: float, grow: bool, select_once: bool = False):
     """
     Create next generation by selecting, crossing-over and mutating.
     """
-    def _select_crossover_mutate():
-        # select
-        selected = select_elite_tournament(fitness_list, elite, select_percent)
-        #print("SELECTED INDIVIDUALS:",selected)
-        mother_choice = np.random.choice(selected)
-        selected.remove(mother_choice)
-        father_choice = np.random.choice(selected)
+    def _crossover_mutate(mother_choice, father_choice):
         mother = population[mother_choice]
         father = population[father_choice]
         
@@ -250,11 +243,13 @@ def evolve(population: list, elite: int, select_percent: float,
         #print("CROSSOVER - MOTHER:",mother_choice, mother.kc_size, "FATHER:",father_choice, father.kc_size, "MUTATION - CHILDREN KC SIZES",child1.kc_size,child2.kc_size)
         return child1, child2
 
-    fitness_list = [individual.get_fitness() for individual in population]
+    fitness_list = np.array([individual.get_fitness() for individual in population])
     print("FITNESS LIST:",fitness_list)
 
-    children_list = joblib.Parallel(n_jobs=max_thread, prefer="threads")(
-        joblib.delayed(_select_crossover_mutate)() for _ in range(len(population) // 2))
+    parents = select_parents(fitness_list, elite, select_percent, len(population) // 2, once=select_once)
+
+    # breed sequentially: the random draws then come in a fixed order, so that runs resumed from a checkpoint are reproducible
+    children_list = [_crossover_mutate(mother_choice, father_choice) for mother_choice, father_choice in parents]
 
     new_population = []
     for pair in children_list:
@@ -266,27 +261,111 @@ def evolve(population: list, elite: int, select_percent: float,
 
 
 def genetic_alg(pop_size: int, crossover_prob: float, elite: int, select_percent: float,
-        mutate_prob_proj: float, mutate_scale_wta: float, grow: bool):
+        mutate_prob_proj: float, mutate_scale_wta: float, grow: bool, islands: int = 1, migration_interval: int = 5, steady: bool = False, select_once: bool = False,
+        checkpoint: str = None, checkpoint_every: int = 1, resume: bool = False, stop_fn=None,
+        log_name: str = None, stats_lock=None):
     """
     Genetic Algorithms, main function.
+    stop_fn(generation, best_fitness), if given, can end the generational GA early.
+    log_name is appended to the name of the log, to tell apart runs started in the same
+    second. stats_lock, if given, is held while the best flies are updated (see
+    get_stats), e.g. when several runs share ./models/evolution.
     """
-    # create log
-    log_file = './models/evolution/' + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + '.json'
-    best_fly_file = './models/evolution/' + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + '.fly'
-    append_as_json({'pop_size': pop_size, 'max_generation': MAX_GENERATION, 'crossover_prob': crossover_prob,
-                    'select_percent': select_percent, 'mutate_prob_proj': mutate_prob_proj,
-                    'mutate_scale_wta': mutate_scale_wta}, log_file)
-    append_as_json({'min_wta': MIN_WTA, 'max_wta': MAX_WTA,
-                    'min_kc': MIN_KC, 'max_kc': MAX_KC, 'min_proj': MIN_PROJ, 'max_proj': MAX_PROJ,
-                    'TOP_WORDS': TOP_WORDS, 'C': C, 'NUM_ITER': NUM_ITER}, log_file)
-
-    # generate the first random population
-    print(f'generate the first generation of {pop_size} individuals')
-    start_time = time.time()
-    population = init_pop(pop_size)
-    print('time to generate the first generation: {}'.format(time.time() - start_time))
+    global max_thread  # shared between islands, see below
+    if checkpoint and (steady or islands > 1):
+        raise ValueError('Checkpoints are only supported by the generational GA')
+    resume = resume and os.path.exists(checkpoint)
+    if resume:
+        last_gen, population, other_flies, extra = load_checkpoint(checkpoint, Fly)
+        log_file, total_improvement, last_fitness = extra['log_file'], extra['total_improvement'], extra['last_fitness']
+        overall_best_fly = other_flies['best'][0]
+        compute.restore({k: extra.get('compute_' + k, 0) for k in ('cpu', 'wall', 'evaluations', 'elapsed')})  #0 in checkpoints older than the meter
+        print(f'resuming from {checkpoint}, after generation {last_gen}')
+    else:
+        last_gen = -1
+        # create log
+        log_file = './models/evolution/' + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + (f' {log_name}' if log_name else '') + '.json'
+        append_as_json({'pop_size': pop_size, 'max_generation': MAX_GENERATION, 'crossover_prob': crossover_prob,
+                        'select_percent': select_percent, 'mutate_prob_proj': mutate_prob_proj,
+                        'mutate_scale_wta': mutate_scale_wta}, log_file)
+        append_as_json({'min_wta': MIN_WTA, 'max_wta': MAX_WTA,
+                        'min_kc': MIN_KC, 'max_kc': MAX_KC, 'min_proj': MIN_PROJ, 'max_proj': MAX_PROJ,
+                        'TOP_WORDS': TOP_WORDS, 'C': C, 'NUM_ITER': NUM_ITER}, log_file)
+
+    metrics = MetricsSink(log_file)  # one handle, flushed in the background
+
+    def _get_stats(population):
+        if stats_lock is None:
+            return get_stats(population)
+        with stats_lock:
+            return get_stats(population)
+
+    if steady:
+        def _breed(mother, father):
+            child = crossover(mother, father)[0] if np.random.random() < crossover_prob else mother
+            child = mutate(child, mutate_prob_proj, mutate_scale_wta, grow)
+            child.kc_size = child.projections.shape[0]
+            return child
+
+        last_log = [time.time()]
+        def _log(population, step):
+            stats = _get_stats(population)
+            stats.update(compute.totals())
+            stats['gen'] = step
+            stats['time'] = time.time() - last_log[0]
+            last_log[0] = time.time()
+            metrics.append(stats)
+            print(stats)
+
+        print(f'steady-state evolution of {pop_size} individuals')
+        population = init_pop(pop_size)
+        eval_pop(population)
+        _log(population, 0)
+        population = steady_state(population, num_children=pop_size * (MAX_GENERATION - 1), breed_fn=_breed,
+                                  evaluate_fn=evaluate_measured, log_fn=_log, num_workers=max_thread,
+                                  stop_fn=compute.exhausted)
+        metrics.close()
+        return max(population, key=lambda fly: fly.get_fitness())
+
+    if islands > 1:
+        last_log = {}
+        def _log(population, g, island):
+            stats = _get_stats(population)
+            stats.update(compute.totals())
+            stats['gen'] = g
+            stats['island'] = island
+            stats['time'] = time.time() - last_log.get(island, start_time)
+            last_log[island] = time.time()
+            metrics.append(stats)
+            print(stats)
+
+        all_threads = max_thread
+        max_thread = max(1, all_threads // islands)  # share the threads between islands
+        print(f'evolving {islands} islands of {pop_size // islands} individuals')
+        compute.share(multiprocessing.get_context('fork'))  # one budget for all the islands
+        start_time = time.time()
+        best_flies = run_islands(num_islands=islands, pop_size=pop_size, num_generations=MAX_GENERATION,
+                                 init_fn=init_pop, eval_fn=eval_pop, log_fn=_log,
+                                 migration_interval=migration_interval, stop_fn=compute.exhausted,
+                                 evolve_fn=lambda population: evolve(population, elite, select_percent, crossover_prob,
+                                                                     mutate_prob_proj, mutate_scale_wta, grow, select_once))
+        max_thread = all_threads
+        if compute.exhausted():
+            print('compute budget exhausted', compute.totals())
+        metrics.close()
+        return best_flies[0]
+
+    if not resume:
+        # generate the first random population
+        print(f'generate the first generation of {pop_size} individuals')
+        start_time = time.time()
+        population = init_pop(pop_size)
+        print('time to generate the first generation: {}'.format(time.time() - start_time))
+        overall_best_fly = None
+        total_improvement = []
+        last_fitness = 0
     fitness_list = [individual.get_fitness() for individual in population]
-    overall_best_fly = None
+    checkpointer = Checkpointer(checkpoint) if checkpoint else None
 
     def _return_best_fly():
         best_fly = population[0]
@@ -296,15 +375,13 @@ def genetic_alg(pop_size: int, crossover_prob: float, elite: int, select_percent
         return best_fly, best_fly.get_fitness()
 
     print('evolving')
-    total_improvement = []
-    last_fitness = 0
-    for g in range(MAX_GENERATION):
+    for g in range(last_gen + 1, MAX_GENERATION):
         print("\n\nGENERATION",g)
         start_time = time.time()
         # new generation, including selection, crossover, mutation
         if g > 0:  # do not process this step in the 1st generation, since every fitness = 0
             population = evolve(population, elite, select_percent,
-                                crossover_prob, mutate_prob_proj, mutate_scale_wta, grow)
+                                crossover_prob, mutate_prob_proj, mutate_scale_wta, grow, select_once)
 
         # evaluate the population
         eval_pop(population)
@@ -318,32 +395,90 @@ def genetic_alg(pop_size: int, crossover_prob: float, elite: int, select_percent
         improvement_fitness = avg_fitness - last_fitness
         last_fitness = avg_fitness
         total_improvement.append(improvement_fitness)
-        stats = get_stats(population)
+        stats = _get_stats(population)
+        stats.update(compute.totals())
         stats['gen'] = g
         stats['time'] = time.time() - start_time
 
-        append_as_json(stats, log_file)
+        metrics.append(stats)
         print(stats)
         best_fly, best_fitness = _return_best_fly()
         print("CURRENT BEST FLY:",best_fitness,best_fly.kc_size,best_fly.wta)
         if overall_best_fly == None or overall_best_fly.get_fitness() < best_fitness:
             print("UPDATING OVERALL BEST FLY:",best_fitness,best_fly.kc_size,best_fly.wta)
             overall_best_fly = best_fly
+        if checkpointer and ((g + 1) % checkpoint_every == 0 or g == MAX_GENERATION - 1 or compute.exhausted()):
+            metrics.flush()  # the log must not lag behind the checkpoint
+            checkpointer.save(population, g, other_flies={'best': [overall_best_fly]}, log_file=log_file,
+                              total_improvement=total_improvement, last_fitness=last_fitness,
+                              **{'compute_' + k: v for k, v in compute.totals().items()})
+        if stop_fn is not None and stop_fn(g, overall_best_fly.get_fitness()):
+            print("STOPPING AT GENERATION", g, "- DOMINATED BY OTHER CONFIGURATIONS")
+            break
+        if compute.exhausted():
+            print('compute budget exhausted after generation', g, compute.totals())
+            break
+    if checkpointer:
+        checkpointer.wait()
+    metrics.close()
     print("sum improvement:", sum(total_improvement))
     return overall_best_fly
 
 
+def config_cost(config: dict):
+    """Sort key putting the cheapest grid configurations first: hashing and training
+    time grow with the number of words kept per document, and with the KC layer."""
+    return config['TOP_WORDS'], config['GROW']
+
+
+def run_config(index: int, config: dict, stop_fn=None, lock=None):
+    """
+    Run the GA for one configuration of the grid (in a process of the grid runner).
+    Return the stats of its best fly, and how many generations it ran.
+    """
+    global TOP_WORDS, compute
+    TOP_WORDS = config['TOP_WORDS']
+    compute = ComputeMeter(cpu_budget=CPU_BUDGET, wall_budget=WALL_BUDGET, per_thread=True) #one budget per configuration
+    generations = []
+    def _stop(g, fitness):
+        generations.append(g)
+        return stop_fn is not None and stop_fn(g, fitness)
+
+    print('\n\npop_size:',POP_SIZE, 'max_generation:', MAX_GENERATION, 'crossover_prob:', config['CROSSOVER_PROB'], 'elite:', config['ELITE'],
+            'select_percent:', config['PERCENT_SELECTED'], 'mutate_prob_proj:', config['MUTATE_PROJ_PROB'], 'growth:', config['GROW'], 'top_words:',TOP_WORDS,
+            'mutate_scale_wta:', MUTATE_WTA_SCALE, 'MIN_KC:', MIN_KC, 'MAX_KC:', MAX_KC)
+    overall_best_fly = genetic_alg(pop_size=POP_SIZE, crossover_prob=config['CROSSOVER_PROB'], elite=config['ELITE'], select_percent=config['PERCENT_SELECTED'],
+            mutate_prob_proj=config['MUTATE_PROJ_PROB'], mutate_scale_wta=MUTATE_WTA_SCALE, grow=config['GROW'],
+            islands=int(args['--islands']), migration_interval=int(args['--migration']),
+            steady=args['--steady_state'], select_once=args['--select_once'], checkpoint=args['--checkpoint'] and os.path.join(args['--checkpoint'], f'grid{index}.npz'),
+            checkpoint_every=int(args['--checkpoint_every']), resume=args['--resume'], stop_fn=_stop,
+            log_name=f'grid{index}', stats_lock=lock)
+    print('\n\nRESULTS FOR PARAMS: pop_size:',POP_SIZE, 'max_generation:', MAX_GENERATION, 'crossover_prob:', config['CROSSOVER_PROB'], 'elite:', config['ELITE'],
+            'select_percent:', config['PERCENT_SELECTED'], 'mutate_prob_proj:', config['MUTATE_PROJ_PROB'], 'growth:', config['GROW'], 'top_words:',TOP_WORDS,
+            'mutate_scale_wta:', MUTATE_WTA_SCALE, 'best_fly_fitness:', overall_best_fly.get_fitness(),
+            'best_fly_kc_size:', overall_best_fly.kc_size, 'best_fly_wta:', overall_best_fly.wta)
+    return {'best_fly_fitness': float(overall_best_fly.get_fitness()), 'best_fly_kc_size': int(overall_best_fly.kc_size),
+            'best_fly_wta': float(overall_best_fly.wta), 'generations': generations[-1] + 1 if generations else MAX_GENERATION,
+            'stopped': bool(generations) and generations[-1] + 1 < MAX_GENERATION, **compute.totals()}
+
+
 if __name__ == '__main__':
     args = docopt(__doc__, version='Genetic Algorithm of the fruit-fly projection, with budgeting, ver 0.1')
 
     if not os.path.isdir('./models/evolution'):
         os.makedirs('./models/evolution')
     
-    BUDGET_HS_SIZE = int(input("Please enter the max hash size for your model: "))
-    print(BUDGET_HS_SIZE)
+    with open(args['--config']) as f:
+        config = json.load(f)
+
+    BUDGET_HS_SIZE = config['budget_hs_size']
+    print("max hash size:", BUDGET_HS_SIZE)
 
-    BUDGET_ITERS = int(input("Please enter the max number of models to train: "))
-    print(BUDGET_ITERS)
+    BUDGET_ITERS = config['budget_iters']
+    print("max number of models to train:", BUDGET_ITERS)
+
+    CPU_BUDGET, WALL_BUDGET = config.get('cpu_budget'), config.get('wall_budget')
+    print("max CPU-seconds and seconds per configuration:", CPU_BUDGET, WALL_BUDGET)
 
     sp = spm.SentencePieceProcessor()
     
@@ -360,7 +495,7 @@ if __name__ == '__main__':
         vocab, reverse_vocab, logprobs = read_vocab("../spm/spmcc.vocab")
 
     #Hyperparameters for GA
-    POP_SIZE = 50
+    POP_SIZE = config.get('pop_size', 50)
     MAX_GENERATION = int(BUDGET_ITERS / POP_SIZE)
     GROW = False
     ELITE = 6
@@ -387,9 +522,12 @@ if __name__ == '__main__':
     #Hyperparameters for classifier, kept fixed
     C = 100
     NUM_ITER = 50
+    FITNESS_CLASSIFIER = args['--classifier']
     
-    #Hyperparameters for parallel processing
-    max_thread = int(multiprocessing.cpu_count() * 0.2)
+    #Hyperparameters for parallel processing: the grid runs as many configurations
+    #at a time as fit in the core budget, each with max_thread threads
+    NUM_CORES = config.get('cores', multiprocessing.cpu_count())
+    max_thread = config.get('threads_per_run', max(1, int(multiprocessing.cpu_count() * 0.2)))
 
     generation_fitnesses = []
 
@@ -409,16 +547,15 @@ if __name__ == '__main__':
         train_set_list[2], train_label_list[2] = read_n_encode_dataset('../datasets/20news-bydate/20news-bydate-train.sp', vectorizer, logprobs)
         val_set_list[2], val_label_list[2] = read_n_encode_dataset('../datasets/20news-bydate/20news-bydate-val.sp', vectorizer, logprobs)
 
-    param_grid = {'GROW': [True,False], 'CROSSOVER_PROB' : [0.5,0.7,0.9], 'ELITE' : [2,4,6,8], 'PERCENT_SELECTED' : [0.1, 0.3], 'MUTATE_PROJ_PROB' : [0.05, 0.1, 0.2], 'TOP_WORDS' : [50,100,150,200]}
-    grid = list(itertools.product(*param_grid.values()))
-
-    for params in grid:
-        GROW, CROSSOVER_PROB, ELITE, PERCENT_SELECTED, MUTATE_PROJ_PROB, TOP_WORDS = params
-        print('\n\npop_size:',POP_SIZE, 'max_generation:', MAX_GENERATION, 'crossover_prob:', CROSSOVER_PROB, 'elite:', ELITE,  
-                'select_percent:', PERCENT_SELECTED, 'mutate_prob_proj:', MUTATE_PROJ_PROB, 'growth:', GROW, 'top_words:',TOP_WORDS, 
-                'mutate_scale_wta:', MUTATE_WTA_SCALE, 'MIN_KC:', MIN_KC, 'MAX_KC:', MAX_KC) 
-        overall_best_fly = genetic_alg(pop_size=POP_SIZE, crossover_prob=CROSSOVER_PROB, elite=ELITE, select_percent=PERCENT_SELECTED, mutate_prob_proj=MUTATE_PROJ_PROB, mutate_scale_wta=MUTATE_WTA_SCALE, grow=GROW)
-        print('\n\nRESULTS FOR PARAMS: pop_size:',POP_SIZE, 'max_generation:', MAX_GENERATION, 'crossover_prob:', CROSSOVER_PROB, 'elite:', ELITE, 
-                'select_percent:', PERCENT_SELECTED, 'mutate_prob_proj:', MUTATE_PROJ_PROB, 'growth:', GROW, 'top_words:',TOP_WORDS, 
-                'mutate_scale_wta:', MUTATE_WTA_SCALE, 'best_fly_fitness:', overall_best_fly.get_fitness(), 
-                'best_fly_kc_size:', overall_best_fly.kc_size, 'best_fly_wta:', overall_best_fly.wta)
+    param_grid = config['grid']
+    fixed = {'dataset': DATASET, 'classifier': FITNESS_CLASSIFIER, 'budget_hs_size': BUDGET_HS_SIZE,
+             'budget_iters': BUDGET_ITERS, 'cpu_budget': CPU_BUDGET, 'wall_budget': WALL_BUDGET, 'pop_size': POP_SIZE}  # part of the key of each result
+    grid = [dict(zip(param_grid, values), **fixed) for values in itertools.product(*param_grid.values())]
+
+    if args['--checkpoint'] and not os.path.isdir(args['--checkpoint']):
+        os.makedirs(args['--checkpoint'])
+
+    early_stop = config.get('early_stop', {})
+    run_grid(grid, run_config, config.get('results', './models/evolution/grid_results.json'),
+             num_workers=max(1, NUM_CORES // max_thread), cost_fn=config_cost,
+             min_generations=early_stop.get('min_generations'), margin=early_stop.get('margin', 0.05))
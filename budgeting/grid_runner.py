@@ -0,0 +1,79 @@
+"""Run a grid of GA configurations in parallel processes, within a fixed
+number of cores. Finished configurations are recorded in a JSON-lines results
+log, so that an interrupted grid can be restarted without redoing them.
+"""
+
+import json
+import multiprocessing
+from os.path import exists
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils import append_as_json
+
+
+def _key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def read_results(results_file):
+    """Results already recorded in results_file, by configuration."""
+    results = {}
+    if exists(results_file):
+        with open(results_file) as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    results[_key(result['config'])] = result
+    return results
+
+
+class DominanceStop:
+    """
+    Early stopping shared between runs: after each generation, a run reports the
+    best fitness it has reached so far, and is told to stop if, after at least
+    min_generations, it is more than margin (relative) below the best fitness any
+    run had reached at the same generation.
+    """
+    def __init__(self, leaders, lock, min_generations=5, margin=0.05):
+        self.leaders = leaders #generation -> best fitness, shared through a manager
+        self.lock = lock
+        self.min_generations = min_generations
+        self.margin = margin
+
+    def __call__(self, generation, fitness):
+        with self.lock:
+            leader = max(self.leaders.get(generation, fitness), fitness)
+            self.leaders[generation] = leader
+        return generation + 1 >= self.min_generations and fitness < (1 - self.margin) * leader
+
+
+def run_grid(configs: list, run_fn, results_file: str, num_workers: int, cost_fn=None,
+             min_generations: int = None, margin: float = 0.05):
+    """
+    Call run_fn(index, config, stop_fn, lock) for every configuration that is not in
+    results_file yet, in at most num_workers forked processes at a time, cheapest
+    first according to cost_fn(config). run_fn returns a dictionary of results,
+    appended to results_file together with its configuration as soon as the run
+    ends. stop_fn(generation, fitness) is a DominanceStop if min_generations is
+    set, None otherwise. lock is shared by all the runs, to be held when they update
+    files they have in common (e.g. the best flies). Return the results of all
+    configurations, old and new.
+    """
+    results = read_results(results_file)
+    todo = [(i, config) for i, config in enumerate(configs) if _key(config) not in results]
+    if cost_fn is not None:
+        todo.sort(key=lambda c: cost_fn(c[1]))
+    print(f'{len(configs) - len(todo)} configurations already done, {len(todo)} to run on {num_workers} workers')
+
+    ctx = multiprocessing.get_context('fork') #runs inherit the datasets loaded by the script
+    with ctx.Manager() as manager:
+        lock = manager.Lock()
+        stop_fn = DominanceStop(manager.dict(), lock, min_generations, margin) if min_generations else None
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx) as executor:
+            #the executor starts tasks in submission order, i.e. cheapest first
+            futures = {executor.submit(run_fn, i, config, stop_fn, lock): config for i, config in todo}
+            for future in as_completed(futures):
+                result = dict(config=futures[future], **future.result())
+                append_as_json(result, results_file)
+                results[_key(result['config'])] = result
+    return list(results.values())
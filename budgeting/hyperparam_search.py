@@ -1,6 +1,6 @@
 """Hyper-parameter search by Bayesian optimization
 Usage:
-  hyperparam_search.py --train_path=<filename> [--continue_log=<filename>]
+  hyperparam_search.py --train_path=<filename> [--continue_log=<filename>] [--cpu_budget=<s>] [--wall_budget=<s>]
   hyperparam_search.py (-h | --help)
   hyperparam_search.py --version
 Options:
@@ -8,6 +8,8 @@ Options:
   --version                       Show version.
   --train_path=<filename>         Name of file to train (processed by sentencepeice)
   [--continue_log=<filename>]     Name of the json log file that we want the Bayesian optimization continues
+  --cpu_budget=<s>                Stop once evaluations have used this many CPU-seconds.
+  --wall_budget=<s>               Stop once the search has lasted this many seconds.
 """
 
 
@@ -24,9 +26,12 @@ from docopt import docopt
 from sklearn.feature_extraction.text import CountVectorizer
 from scipy.sparse import csr_matrix
 
-from mkprojections import create_projections
+from mkprojections import save_projections
+from projections import permutation_projections
 from hash import read_vocab, hash_dataset
 from classify import train_model
+from timer import ComputeMeter
+from utils import append_as_json
 
 from bayes_opt import BayesianOptimization
 from bayes_opt.logger import JSONLogger
@@ -39,8 +44,11 @@ def generate_projs(PN_size, KC_size, proj_size, dataset_name):
     if not os.path.isdir(d):
         os.mkdir(d)
     trial = len(os.listdir(d))
-    model_file = create_projections(PN_size, KC_size, proj_size, d, trial)
-    return model_file
+    # the projections are saved for later runs, and used in memory in this one
+    model_file = os.path.join(d, "spmcc_" + str(trial) + ".projs.npz")
+    projections = permutation_projections(KC_size, PN_size, proj_size)
+    save_projections(model_file, projections)
+    return model_file, projections
 
 
 def read_n_encode_dataset(path, vectorizer, logprobs):
@@ -70,11 +78,11 @@ def read_n_encode_dataset(path, vectorizer, logprobs):
 
 def fruitfly_pipeline(top_word, KC_size, proj_size, percent_hash,
                       C, num_iter, num_trial):
-    def _hash_n_train(model_file):
+    def _hash_n_train(projections):
         # print('hashing dataset')
-        hash_train = hash_dataset(dataset_mat=train_set, projection_path=model_file,
+        hash_train = hash_dataset(dataset_mat=train_set, projection_path=projections,
                                   percent_hash=percent_hash, top_words=top_word)
-        hash_val = hash_dataset(dataset_mat=val_set, projection_path=model_file,
+        hash_val = hash_dataset(dataset_mat=val_set, projection_path=projections,
                                 percent_hash=percent_hash, top_words=top_word)
         # print('training and evaluating')
         val_score, model = train_model(m_train=hash_train, classes_train=train_label,
@@ -83,12 +91,13 @@ def fruitfly_pipeline(top_word, KC_size, proj_size, percent_hash,
         return val_score, model
 
     print('creating projections')
-    model_files = [generate_projs(PN_size, KC_size, proj_size, dataset_name) for _ in range(num_trial)]
+    model_files, projection_list = zip(*[generate_projs(PN_size, KC_size, proj_size, dataset_name)
+                                         for _ in range(num_trial)])
 
     print('training')
     score_list, model_list = [], []
     score_model_list = joblib.Parallel(n_jobs=max_thread, prefer="threads")(
-        joblib.delayed(_hash_n_train)(model_file) for model_file in model_files)
+        joblib.delayed(_hash_n_train)(projections) for projections in projection_list)
     score_list += [i[0] for i in score_model_list]
     model_list += [i[1] for i in score_model_list]
 
@@ -132,8 +141,14 @@ def optimize_fruitfly(continue_log):
             num_iter = 2000  # 50 wos wiki, 2000 20news
         print(f'--- KC_size {KC_size}, proj_size {proj_size}, '
               f'top_word {topword}, wta {percent_hash}, C {C} ---')
-        return fruitfly_pipeline(topword, KC_size, proj_size, percent_hash,
-                                 C, num_iter, num_trial)
+        with compute.measure() as cost:
+            score = fruitfly_pipeline(topword, KC_size, proj_size, percent_hash,
+                                      C, num_iter, num_trial)
+        print('compute:', cost)
+        append_as_json({'target': score, 'params': {'topword': topword, 'KC_size': KC_size, 'proj_size': proj_size,
+                                                    'percent_hash': percent_hash, 'C': C},
+                        'eval_cpu': cost['cpu'], 'eval_wall': cost['wall'], **compute.totals()}, compute_log_path)
+        return score
 
     optimizer = BayesianOptimization(
         f=_classify,
@@ -147,10 +162,17 @@ def optimize_fruitfly(continue_log):
         load_logs(optimizer, logs=[continue_log])
         print("Optimizer is now aware of {} points.".format(len(optimizer.space)))
     tmp_log_path = f'./log/logs_{dataset_name}_{now}.json'
+    compute_log_path = f'./log/compute_{dataset_name}_{now}.json'
     logger = JSONLogger(path=tmp_log_path)
     optimizer.subscribe(Events.OPTIMIZATION_STEP, logger)
 
-    optimizer.maximize(n_iter=200)
+    # one step at a time, to stop as soon as the compute budget is spent
+    optimizer.maximize(init_points=5, n_iter=0)
+    for _ in range(200):
+        if compute.exhausted():
+            print('compute budget exhausted:', compute.totals())
+            break
+        optimizer.maximize(init_points=0, n_iter=1)
     print("Final result:", optimizer.max)
     with open(main_log_path, 'a') as f_main:
         with open(tmp_log_path) as f_tmp:
@@ -183,6 +205,9 @@ if __name__ == '__main__':
     val_set, val_label = read_n_encode_dataset(train_path.replace('train', 'val'), vectorizer, logprobs)
     max_val_score = -1
     max_thread = int(multiprocessing.cpu_count() * 0.7)
+    # evaluations run one at a time, so the CPU time of the whole process is theirs
+    compute = ComputeMeter(cpu_budget=args['--cpu_budget'] and float(args['--cpu_budget']),
+                           wall_budget=args['--wall_budget'] and float(args['--wall_budget']))
 
     # search
     optimize_fruitfly(continue_log)
@@ -0,0 +1,140 @@
+"""Parallel drivers for the genetic algorithm of the evolve scripts.
+The scripts pass in their own GA components (population initialisation,
+evaluation, breeding), so the drivers don't depend on a particular Fly class.
+"""
+
+import queue
+import multiprocessing
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def _with_matrix(fly):
+    # flies are sent between processes with all their attributes: pickling them would
+    # leave their matrix out, and the receiving island would have to replay their genome
+    return type(fly), dict(vars(fly))
+
+
+def _from_state(packed):
+    fly_class, state = packed
+    fly = fly_class.__new__(fly_class)
+    vars(fly).update(state)
+    return fly
+
+
+def _island(island, num_generations, pop_size, init_fn, evolve_fn, eval_fn, log_fn, lock,
+            migration_interval, num_migrants, inbox, outbox, results, seed, stop_fn):
+    np.random.seed(seed) #forked islands would otherwise share the parent's random state
+    population = init_fn(pop_size)
+    upstream_done = False #the previous island on the ring has finished
+    for g in range(num_generations):
+        if g > 0:
+            population = evolve_fn(population)
+        eval_fn(population)
+
+        if migration_interval and (g + 1) % migration_interval == 0:
+            fitness = np.array([fly.get_fitness() for fly in population])
+            outbox.put([_with_matrix(population[i]) for i in np.argsort(-fitness)[:num_migrants]])
+            # take in whatever migrants have arrived, without waiting for slower islands
+            try:
+                while not upstream_done:
+                    packed = inbox.get_nowait()
+                    if packed is None:
+                        upstream_done = True
+                        break
+                    migrants = [_from_state(m) for m in packed]
+                    fitness = np.array([fly.get_fitness() for fly in population])
+                    for i, fly in zip(np.argsort(fitness)[:len(migrants)], migrants):
+                        population[i] = fly
+            except queue.Empty:
+                pass
+
+        with lock: #logs and best flies are shared between islands
+            log_fn(population, g, island)
+        if stop_fn is not None and stop_fn():
+            break
+
+    fitness = np.array([fly.get_fitness() for fly in population])
+    results.put((island, _with_matrix(population[int(np.argmax(fitness))])))
+    # migrants are too large to be written to the pipe at once: an island only exits
+    # once its neighbour is done, so that no island is left with half a message to read
+    outbox.put(None)
+    while not upstream_done:
+        upstream_done = inbox.get() is None
+
+
+def run_islands(num_islands: int, pop_size: int, num_generations: int, init_fn, evolve_fn, eval_fn, log_fn,
+                migration_interval: int = 5, num_migrants: int = 2, stop_fn=None):
+    """
+    Island-model GA: the population is split into num_islands sub-populations evolving
+    in separate processes, with selection local to each island. Every migration_interval
+    generations, each island sends copies of its num_migrants best flies to the next island
+    on a ring, and replaces its worst flies with the migrants it has received so far.
+    init_fn(size) returns a population, evolve_fn(population) the next generation,
+    eval_fn(population) evaluates it in place and log_fn(population, generation, island)
+    records stats. If stop_fn() becomes true (e.g. a compute budget shared by the islands
+    is spent), each island stops after its current generation. Return the best fly of
+    each island, best first.
+    """
+    ctx = multiprocessing.get_context('fork') #islands inherit the datasets loaded by the script
+    island_size = max(2, (pop_size // num_islands) // 2 * 2) #breeding produces pairs
+    queues = [ctx.Queue() for _ in range(num_islands)]
+    results = ctx.Queue()
+    lock = ctx.Lock()
+    seeds = np.random.randint(2**31, size=num_islands)
+    processes = [ctx.Process(target=_island,
+                             args=(i, num_generations, island_size, init_fn, evolve_fn, eval_fn, log_fn, lock,
+                                   migration_interval, num_migrants, queues[i], queues[(i + 1) % num_islands],
+                                   results, seeds[i], stop_fn))
+                 for i in range(num_islands)]
+    for p in processes:
+        p.start()
+    best_flies = [results.get() for _ in processes] #collect before joining, so that no island blocks on a full pipe
+    for p in processes:
+        p.join()
+    best_flies = [_from_state(fly) for _, fly in sorted(best_flies, key=lambda r: r[0])]
+    return sorted(best_flies, key=lambda fly: fly.get_fitness(), reverse=True)
+
+
+def tournament(fitness, size=2):
+    """Index of the fittest of size randomly drawn individuals."""
+    candidates = np.random.randint(len(fitness), size=size)
+    return candidates[np.argmax(fitness[candidates])]
+
+
+def steady_state(population: list, num_children: int, breed_fn, evaluate_fn, log_fn, num_workers: int,
+                 tournament_size: int = 2, stop_fn=None):
+    """
+    Steady-state GA without generation barriers: whenever a worker is free, a child is bred
+    by breed_fn(mother, father) from two tournament winners of the current population and
+    evaluated with evaluate_fn(child); when it finishes, it replaces the worst member.
+    The population must already be evaluated. log_fn(population, step) is called every
+    len(population) children, i.e. at the same pace as a generational GA.
+    If stop_fn() becomes true (e.g. a compute budget is spent), no more children are
+    bred, and the function returns once those being evaluated are done.
+    """
+    fitness = np.array([fly.get_fitness() for fly in population])
+    born, finished = 0, 0
+    pending = {}
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        while finished < num_children:
+            stop = stop_fn is not None and stop_fn()
+            while not stop and len(pending) < num_workers and born < num_children:
+                mother = population[tournament(fitness, tournament_size)]
+                father = population[tournament(fitness, tournament_size)]
+                child = breed_fn(mother, father)
+                pending[executor.submit(evaluate_fn, child)] = child
+                born += 1
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result() #raise errors from the worker
+                child = pending.pop(future)
+                worst = np.argmin(fitness)
+                population[worst] = child
+                fitness[worst] = child.get_fitness()
+                finished += 1
+                if finished % len(population) == 0:
+                    log_fn(population, finished // len(population))
+    return population
@@ -1,6 +1,9 @@
 # timer.py
 
 import time
+import resource
+import threading
+from contextlib import contextmanager
 
 class TimerError(Exception):
     """A custom exception used to report errors in use of Timer class"""
@@ -24,3 +27,77 @@ class Timer:
         elapsed_time = time.perf_counter() - self._start_time
         self._start_time = None
         print(f"Elapsed time: {elapsed_time:0.4f} seconds")
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ComputeMeter:
+    """Account for the compute used by fitness evaluations (CPU-seconds,
+    wall-seconds, peak RSS), and tell when a compute budget is spent.
+    Evaluations running in parallel threads must be measured with
+    per_thread=True, so that each is charged for its own thread's CPU time only.
+    Evaluations in forked processes (e.g. islands) add up only after share()."""
+    def __init__(self, cpu_budget=None, wall_budget=None, per_thread=False):
+        self.cpu_budget = cpu_budget
+        self.wall_budget = wall_budget
+        self._clock = time.thread_time if per_thread else time.process_time
+        self._lock = threading.Lock()
+        self._start_time = time.perf_counter()
+        self._counts = [0.0, 0.0, 0]  #cpu, wall, evaluations
+        self.elapsed_before = 0.0
+
+    cpu = property(lambda self: self._counts[0])
+    wall = property(lambda self: self._counts[1])
+    evaluations = property(lambda self: int(self._counts[2]))
+
+    def share(self, ctx):
+        """Keep the counts in shared memory, so that the processes forked from now on
+        (with the multiprocessing context ctx) are all charged to the same budget."""
+        counts = ctx.Array('d', self._counts)
+        self._counts, self._lock = counts, counts.get_lock()
+
+    def _charge(self, cost):
+        with self._lock:
+            self._counts[0] += cost['cpu']
+            self._counts[1] += cost['wall']
+            self._counts[2] += 1
+
+    @contextmanager
+    def measure(self):
+        """Measure the body of the with block as one evaluation. The yielded
+        dictionary is filled with its cpu, wall and peak_rss_mb on exit."""
+        cost = {}
+        cpu, wall = self._clock(), time.perf_counter()
+        try:
+            yield cost
+        finally:
+            cost['cpu'] = self._clock() - cpu
+            cost['wall'] = time.perf_counter() - wall
+            cost['peak_rss_mb'] = peak_rss_mb()
+            self._charge(cost)
+
+    def add(self, cost):
+        """Charge an evaluation measured elsewhere, e.g. in a worker process."""
+        self._charge(cost)
+
+    def elapsed(self):
+        """Wall-clock time of the whole run, including the runs it was resumed from."""
+        return self.elapsed_before + time.perf_counter() - self._start_time
+
+    def exhausted(self):
+        return (self.cpu_budget is not None and self.cpu >= self.cpu_budget) or \
+               (self.wall_budget is not None and self.elapsed() >= self.wall_budget)
+
+    def totals(self):
+        """Cumulative compute, e.g. to log with the stats of a generation."""
+        return {'cpu': self.cpu, 'wall': self.wall, 'elapsed': self.elapsed(),
+                'evaluations': self.evaluations, 'peak_rss_mb': peak_rss_mb()}
+
+    def restore(self, totals):
+        """Continue counting from the totals of an interrupted run."""
+        with self._lock:
+            self._counts[:] = [totals['cpu'], totals['wall'], totals['evaluations']]
+        self.elapsed_before = totals['elapsed']
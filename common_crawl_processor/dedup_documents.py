@@ -0,0 +1,155 @@
+"""Common Crawl processor - remove near-duplicate documents (boilerplate, mirrored pages) from the filtered corpus, before hashing
+
+Usage:
+  dedup_documents.py --folder=<foldername> [--threshold=<f>] [--bands=<n>] [--rows=<n>] [--window=<n>] [--keep_duplicates=<boolean>]
+  dedup_documents.py (-h | --help)
+  dedup_documents.py --version
+
+Options:
+  -h --help                     Show this screen.
+  --version                     Show version.
+  --folder=<foldername>         Only the name of the folder where the zipped kept_*.txt files are located (output of filter_documents.py)
+  --threshold=<f>               Estimated Jaccard similarity above which two documents are duplicates [default: 0.8]
+  --bands=<n>                   Number of LSH bands [default: 16]
+  --rows=<n>                    Number of MinHash values per band [default: 8]
+  --window=<n>                  Number of recent documents kept in the LSH buckets, to bound memory [default: 200000]
+  --keep_duplicates=<boolean>   True if you want to keep the duplicates in a separate file, clustered with the document they duplicate [default: False]
+"""
+
+import glob
+import gzip
+import os
+import re
+import zlib
+import numpy as np
+from collections import OrderedDict
+from docopt import docopt
+import utils
+
+PRIME = (1 << 31) - 1
+
+
+class MinHashLSH:
+    """MinHash signatures of word shingles, banded into LSH buckets.
+    Only the last `window` documents stay in the buckets."""
+    def __init__(self, bands, rows, threshold, window, shingle_size=5, seed=0):
+        self.bands = bands
+        self.rows = rows
+        self.threshold = threshold
+        self.window = window
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, PRIME, size=bands * rows).astype(np.uint64)
+        self.b = rng.randint(0, PRIME, size=bands * rows).astype(np.uint64)
+        self.buckets = {}
+        self.signatures = OrderedDict()
+
+    def signature(self, doc):
+        words = doc.lower().split()
+        n = max(1, len(words) - self.shingle_size + 1)
+        shingles = set(' '.join(words[i:i+self.shingle_size]) for i in range(n))
+        x = np.array([zlib.crc32(s.encode('utf-8')) for s in shingles], dtype=np.uint64) % PRIME
+        return ((np.outer(x, self.a) + self.b) % PRIME).min(axis=0)
+
+    def band_keys(self, sig):
+        return [(i, sig[i*self.rows:(i+1)*self.rows].tobytes()) for i in range(self.bands)]
+
+    def query(self, sig):
+        """Return the id of a document in the window that sig duplicates, or None."""
+        for key in self.band_keys(sig):
+            for cand in self.buckets.get(key, []):
+                if np.mean(self.signatures[cand] == sig) >= self.threshold:
+                    return cand
+        return None
+
+    def insert(self, doc_id, sig):
+        self.signatures[doc_id] = sig
+        for key in self.band_keys(sig):
+            self.buckets.setdefault(key, []).append(doc_id)
+        if len(self.signatures) > self.window:
+            old_id, old_sig = self.signatures.popitem(last=False)
+            for key in self.band_keys(old_sig):
+                self.buckets[key].remove(old_id)
+                if not self.buckets[key]:
+                    del self.buckets[key]
+
+
+def read_docs(f_globs):
+    for f_gz in f_globs:
+        with gzip.open(f_gz,'rt') as f:
+            header = None
+            doc = ""
+            for line in f:
+                line = line.rstrip('\n')
+                if line.startswith("<doc"):
+                    header = line
+                    doc = ""
+                    continue
+                if line.startswith("</doc>"):
+                    yield header, doc
+                    continue
+                doc = line if doc == "" else doc+" "+line
+
+
+class RollingWriter:
+    """Appends documents to ./corpus/<name>_n.txt, keeping the file open. Once a file
+    reaches the size limit of utils.append_txt_check_len, it is compressed and the next
+    documents go to <name>_n+1.txt."""
+    def __init__(self, name, max_size=524288000):
+        self.name = name
+        self.max_size = max_size
+        self.num = 0
+        self.output_file = None
+
+    def write(self, header, doc):
+        if self.output_file is None:
+            self.output_file = open(f'./corpus/{self.name}_{self.num}.txt', 'a', encoding='utf-8')
+        self.output_file.write(header+"\n"+doc+"\n"+"</doc>"+"\n")
+        if self.output_file.tell() >= self.max_size:
+            self.close()
+            self.num += 1
+
+    def close(self):
+        if self.output_file is not None:
+            self.output_file.close()
+            utils.compress_file(self.output_file.name)
+            self.output_file = None
+
+
+def deduplicate(folder, lsh, keep_duplicates):
+    dedup = RollingWriter('dedup')
+    dup = RollingWriter('duplicates')
+    n_doc = 0
+    n_dup = 0
+    try:
+        for header, doc in read_docs(sorted(glob.glob(folder+"kept_*.gz"))):
+            url = re.search("url=([^ ]*)", header)
+            doc_id = url.group(1) if url else str(n_doc)
+            sig = lsh.signature(doc)
+            dup_of = lsh.query(sig)
+            if dup_of is None:
+                lsh.insert(doc_id, sig)
+                dedup.write(header, doc)
+            else:
+                n_dup+=1
+                if keep_duplicates == 'True':
+                    dup.write(header.replace("<doc ", "<doc dup_of="+dup_of+" ", 1), doc)
+            n_doc+=1
+            if n_doc%1000==0:
+                print(f"{n_doc} documents checked and {n_dup} near-duplicates removed so far...")
+    finally:  #also on Ctrl+C, so that the last files are compressed too
+        dedup.close()
+        dup.close()
+    print(f"{n_doc} documents checked and {n_dup} near-duplicates removed.")
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='Common Crawl Processor')
+
+    folder = "./"+args['--folder']+"/"
+    lsh = MinHashLSH(bands=int(args['--bands']), rows=int(args['--rows']),
+                     threshold=float(args['--threshold']), window=int(args['--window']))
+    if not os.path.isdir("corpus"):
+        os.makedirs("corpus")
+
+    deduplicate(folder, lsh, args['--keep_duplicates'])
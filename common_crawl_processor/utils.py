@@ -5,13 +5,13 @@ import gzip
 import shutil
 
 def write_as_json(dic, f):
-  output_file = open(f, 'w', encoding='utf-8')
-  json.dump(dic, output_file) 
+  with open(f, 'w', encoding='utf-8') as output_file:
+    json.dump(dic, output_file)
 
 def append_as_json(dic, f):
-  output_file = open(f, 'a', encoding='utf-8')
-  json.dump(dic, output_file) 
-  output_file.write("\n")
+  with open(f, 'a', encoding='utf-8') as output_file:
+    json.dump(dic, output_file)
+    output_file.write("\n")
 
 def compress_file(file_path):
   with open(file_path, 'rb') as f_in:
@@ -11,11 +11,14 @@ Options:
   --num_iter=<n>     Number of iterations
 """
 
+import os
 from docopt import docopt
 import numpy as np
 from sklearn import linear_model
 import pickle
+from scipy.sparse import csr_matrix
 from sklearn.multioutput import MultiOutputClassifier
+from joblib import parallel_backend
 
 #print(device)
 #random.seed(77)
@@ -38,15 +41,23 @@ def make_output(classes,class_ids):
     return [class_ids[c] for c in classes]
 
 
-def train_model(m_train,classes_train,m_val,classes_val,C,num_iter):
-    if isinstance(classes_train, np.ndarray):
-        lm = MultiOutputClassifier(linear_model.LogisticRegression())
+def train_model(m_train,classes_train,m_val,classes_val,C,num_iter,n_jobs=None):
+    #Hashes are kept sparse: the solvers take CSR input directly
+    m_train = csr_matrix(m_train)
+    m_val = csr_matrix(m_val)
+    if isinstance(classes_train, np.ndarray) and classes_train.ndim == 2:
+        #One binary model per label, trained in threads (the solvers release the GIL,
+        #and threads share the hashes instead of copying them to worker processes)
+        if n_jobs is None:
+            n_jobs = min(classes_train.shape[1], os.cpu_count() or 1)
+        lm = MultiOutputClassifier(linear_model.LogisticRegression(), n_jobs=n_jobs)
     else:
         lm = linear_model.LogisticRegression(multi_class='ovr', solver='liblinear',
                                              max_iter=num_iter, C=C, verbose=0)
     # print(classes_train.shape, np.argwhere(classes_train.sum(axis=0) == 0))
-    lm.fit(m_train, classes_train)
-    score = lm.score(m_val, classes_val)
+    with parallel_backend('threading', n_jobs=n_jobs):
+        lm.fit(m_train, classes_train)
+        score = lm.score(m_val, classes_val)
     # print(lm.predict(m_val))
     # print(score)
     return score, lm
@@ -55,10 +66,10 @@ def train_model(m_train,classes_train,m_val,classes_val,C,num_iter):
 def prepare_data(tr_file):
     dev_file = tr_file.replace("train","val")
     # print("Reading dataset...")
-    m_train = pickle.load(open(tr_file,'rb')).todense()
+    m_train = csr_matrix(pickle.load(open(tr_file,'rb')))
     #print(m_train)
     #m_train = preprocessing.normalize(m_train, norm='l1')
-    m_val = pickle.load(open(dev_file,'rb')).todense()
+    m_val = csr_matrix(pickle.load(open(dev_file,'rb')))
     #print(m_val)
     #m_val = preprocessing.normalize(m_val, norm='l1')
 
@@ -1,26 +1,135 @@
 import numpy as np
-from sklearn.metrics import pairwise_distances
-
-def compute_nearest_neighbours(vecs,labels,i,num_nns):
-    i_sim = np.array(vecs[i])
-    i_label = labels[i]
-    ranking = np.argsort(-i_sim)
-    neighbours = [labels[n] for n in ranking][1:num_nns+1] #don't count first neighbour which is itself
-    n_sum=0
-    for n in neighbours:
-        for lab in n:
-            if lab in i_label:
-                n_sum+=1
-                break
-    score = n_sum / num_nns
-    # print(i,i_label,neighbours,score)
-    return score,neighbours
-
-def prec_at_k(m=None,classes=None,k=None,metric="cosine"):
-    vecs = 1-pairwise_distances(m.todense(), metric=metric)
-    scores = []
-    for i in range(vecs.shape[0]):
-        score, neighbours = compute_nearest_neighbours(vecs,classes,i,k)
-        scores.append(score)
-    return np.mean(scores)
+from scipy.sparse import csr_matrix, issparse
+from sklearn.preprocessing import normalize
+from scipy.stats import norm
 
+
+def label_matrix(classes):
+    """Encode the (multi-)labels of each document as a sparse binary matrix,
+    so that two documents share a label iff their rows have a common non-zero."""
+    if isinstance(classes, np.ndarray) and classes.ndim == 2: #output of MultiLabelBinarizer
+        return csr_matrix(classes > 0, dtype=np.float32)
+    label_ids = {}
+    rows, cols = [], []
+    for i, labels in enumerate(classes):
+        if isinstance(labels, str) or not hasattr(labels, '__iter__'):
+            labels = [labels]
+        for lab in labels:
+            rows.append(i)
+            cols.append(label_ids.setdefault(lab, len(label_ids)))
+    return csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(classes), len(label_ids)))
+
+
+def _prepare(m, metric, n_bits):
+    """Return the matrix used in similarity products, and its row norms
+    (number of set bits for hamming, L2 norm of the bits for packed cosine)."""
+    if n_bits is not None: #packed bits (np.packbits), unpacked block by block
+        pop = np.concatenate([np.unpackbits(m[c:c+4096], axis=1, count=n_bits).sum(axis=1)
+                              for c in range(0, m.shape[0], 4096)])
+        return m, (np.sqrt(pop) if metric == "cosine" else pop).astype(np.float32)
+    if metric == "cosine":
+        if not issparse(m):
+            m = np.asarray(m, dtype=np.float32)
+        return normalize(m), None
+    m = csr_matrix(m > 0, dtype=np.float32) if issparse(m) else (np.asarray(m) > 0).astype(np.float32)
+    return m, np.asarray(m.sum(axis=1)).ravel()
+
+
+def _similarity_block(m, norms, q, metric, n_bits, chunk_size=4096):
+    """Similarities between the documents in q and all documents."""
+    if n_bits is not None:
+        Q = np.unpackbits(m[q], axis=1, count=n_bits).astype(np.float32)
+        dots = np.hstack([Q.dot(np.unpackbits(m[c:c+chunk_size], axis=1, count=n_bits).astype(np.float32).T)
+                          for c in range(0, m.shape[0], chunk_size)])
+        n_cols = n_bits
+    else:
+        dots = m[q].dot(m.T)
+        dots = dots.toarray() if issparse(dots) else np.asarray(dots)
+        n_cols = m.shape[1]
+    if metric == "cosine":
+        if n_bits is None: #rows already normalised
+            return dots
+        return dots / np.maximum(norms[q][:, None] * norms[None, :], 1)
+    return 1 - (norms[q][:, None] + norms[None, :] - 2 * dots) / n_cols
+
+
+def nearest_neighbours(m, k, metric="cosine", queries=None, block_size=512, n_bits=None):
+    """Yield, block by block, the query ids and the ids of their k nearest
+    neighbours sorted from most to least similar (the query itself excluded).
+    m can be dense, sparse, or packed bits (uint8 rows from np.packbits, with n_bits set)."""
+    m, norms = _prepare(m, metric, n_bits)
+    queries = np.arange(m.shape[0]) if queries is None else np.asarray(queries)
+    for b in range(0, len(queries), block_size):
+        q = queries[b:b+block_size]
+        sims = _similarity_block(m, norms, q, metric, n_bits)
+        sims[np.arange(len(q)), q] = -np.inf #don't count the document itself
+        nns = np.argpartition(-sims, k-1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(sims, nns, axis=1), axis=1, kind='stable')
+        yield q, np.take_along_axis(nns, order, axis=1)
+
+
+def prec_at_k_scores(m=None, classes=None, ks=None, metric="cosine", queries=None, block_size=512, n_bits=None):
+    """Per-query precision at k, for every k in ks, from a single neighbour ranking.
+    Returns a dictionary k -> array of scores (one per query)."""
+    ks = [ks] if np.isscalar(ks) else list(ks)
+    labels = label_matrix(classes)
+    scores = {k: [] for k in ks}
+    for q, nns in nearest_neighbours(m, max(ks), metric, queries, block_size, n_bits):
+        shared = labels[q].dot(labels.T).toarray() > 0
+        hits = np.cumsum(np.take_along_axis(shared, nns, axis=1), axis=1)
+        for k in ks:
+            scores[k].append(hits[:, k-1] / k)
+    return {k: np.concatenate(s) for k, s in scores.items()}
+
+
+def prec_at_k(m=None, classes=None, k=None, metric="cosine", block_size=512, n_bits=None):
+    """Mean precision at k. If k is a list, return a dictionary k -> score."""
+    scores = prec_at_k_scores(m, classes, k, metric, block_size=block_size, n_bits=n_bits)
+    if np.isscalar(k):
+        return np.mean(scores[k])
+    return {i: np.mean(s) for i, s in scores.items()}
+
+
+def kc_use_sorted(m):
+    """Give sorted list from most to least used KCs in the hashes of m."""
+    kc_hash_use = np.asarray((m > 0).sum(axis=0)).ravel()
+    return np.argsort(kc_hash_use, kind='stable')[::-1]
+
+
+def stratified_order(classes, random_state=None):
+    """Random order of the documents such that any prefix is (approximately)
+    stratified on the first label of each document."""
+    rng = np.random.RandomState(random_state)
+    if isinstance(classes, np.ndarray) and classes.ndim == 2:
+        strata = np.argmax(classes, axis=1)
+    else:
+        strata = [labels if isinstance(labels, str) or not hasattr(labels, '__iter__') else labels[0] for labels in classes]
+    _, strata = np.unique(np.asarray(strata, dtype=str), return_inverse=True)
+    position = np.zeros(len(strata))
+    for s in np.unique(strata):
+        idx = np.where(strata == s)[0]
+        position[rng.permutation(idx)] = (np.arange(len(idx)) + rng.uniform(size=len(idx))) / len(idx)
+    return np.argsort(position, kind='stable')
+
+
+def sampled_prec_at_k(m=None, classes=None, k=None, metric="cosine", incumbent=None, n_start=500, growth=2,
+                      confidence=0.95, random_state=None, n_bits=None):
+    """Estimate precision at k from a stratified sample of query documents, each
+    scored against all documents. The sample grows (by a factor of growth) only
+    while the confidence interval still contains the incumbent score, i.e. when
+    the candidate cannot yet be told apart from the best one so far.
+    Returns the mean, the half-width of the confidence interval and the sample size."""
+    order = stratified_order(classes, random_state)
+    n_docs = len(order)
+    z = norm.ppf(0.5 + confidence / 2)
+    scores = np.array([])
+    n = min(n_start, n_docs)
+    while True:
+        new_scores = prec_at_k_scores(m, classes, k, metric, queries=order[len(scores):n], n_bits=n_bits)[k]
+        scores = np.concatenate([scores, new_scores])
+        mean = np.mean(scores)
+        # finite population correction, the interval vanishes when all documents are scored
+        half_width = z * np.std(scores, ddof=1) / np.sqrt(n) * np.sqrt((n_docs - n) / max(1, n_docs - 1)) if n > 1 else np.inf
+        if n == n_docs or incumbent is None or abs(mean - incumbent) > half_width:
+            return mean, half_width, n
+        n = min(n_docs, n * growth)
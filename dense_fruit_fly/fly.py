@@ -4,11 +4,14 @@
 import random
 import numpy as np
 from scipy.sparse import csr_matrix
-from scipy.sparse import hstack, vstack, lil_matrix, coo_matrix
+from scipy.sparse import hstack, vstack, coo_matrix
 
 from classify import train_model
 from sklearn.metrics import pairwise_distances
 from utils import read_vocab, hash_dataset_
+from projections import random_projections, permutation_projections, stored_projections
+from eval import prec_at_k, kc_use_sorted
+from pruning import KCActivations, prune_kcs
 
 class Fly:
     def __init__(self, pn_size=None, kc_size=None, wta=None, proj_size=None, init_method=None, eval_method=None, proj_store=None, hyperparameters=None):
@@ -20,11 +23,10 @@ class Fly:
         self.eval_method = eval_method
         self.hyperparameters = hyperparameters
         if self.init_method == "random":
-            weight_mat, self.shuffled_idx = self.create_projections(self.proj_size)
+            self.projections, self.shuffled_idx = self.create_projections(self.proj_size)
         else:
-            weight_mat, self.shuffled_idx = self.projection_store(proj_store)
+            self.projections, self.shuffled_idx = self.projection_store(proj_store)
 
-        self.projections = lil_matrix(weight_mat)
         self.val_score = 0
         self.is_evaluated = False
         self.kc_use_sorted = None
@@ -32,38 +34,17 @@ class Fly:
         #print("INIT",self.kc_size,self.proj_size,self.wta,self.get_coverage())
 
     def create_projections(self, proj_size):
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
-        idx = list(range(self.pn_size))
-        random.shuffle(idx)
-        used_idx = idx.copy()
-        c = 0
-
-        while c < self.kc_size:
-            for i in range(0,len(idx),proj_size):
-                p = idx[i:i+proj_size]
-                for j in p:
-                    weight_mat[c][j] = 1
-                c+=1
-                if c >= self.kc_size:
-                    break
-            random.shuffle(idx) #reshuffle if needed -- if all KCs are not filled
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        projections = permutation_projections(self.kc_size, self.pn_size, proj_size)
+        return projections, projections.indices
 
     def grow(self, num_new_rows):
-        new_mat = np.zeros((num_new_rows, self.pn_size))
-        for i in range(num_new_rows):
-            if self.init_method == "random":
-                for j in np.random.randint(self.pn_size, size=self.proj_size):
-                    new_mat[i, j] = 1
-            else:
-                random.shuffle(self.proj_store)
-                p = self.proj_store[0]
-                for j in p:
-                    new_mat[i][j] = 1
+        if self.init_method == "random":
+            new_mat = random_projections(num_new_rows, self.pn_size, self.proj_size)
+        else:
+            new_mat = stored_projections(num_new_rows, self.pn_size,
+                                         [random.choice(self.proj_store) for _ in range(num_new_rows)])
         # concat the old part with the new part
-        self.projections = vstack([self.projections, lil_matrix(new_mat)])
-        self.projections = lil_matrix(self.projections)
+        self.projections = vstack([self.projections, new_mat], format='csr')
         self.kc_size+=num_new_rows
         return self.kc_size
  
@@ -75,7 +56,7 @@ class Fly:
         print("ORIGINAL VAL SCORE:",orig_score)
         for i in range(10):
             kcs = self.kc_use_sorted[-init_pruning_num:] #replace least used kcs
-            self.projections = lil_matrix(np.delete(self.projections.todense(),[kcs],axis=0))
+            self.projections = self.projections[np.setdiff1d(np.arange(self.kc_size), kcs)]
             self.kc_size = self.kc_size - init_pruning_num
             self.grow(init_pruning_num)
             current_pruned_score, kc_in_use_sorted, kc_in_hash_sorted = self.evaluate(train_set,val_set,train_label,val_label)
@@ -98,53 +79,38 @@ class Fly:
 
 
 
-    def prune(self,train_set,val_set,train_label,val_label):
-        orig_score = self.val_score
-        last_pruned_score = self.val_score
-        current_pruned_score = self.val_score
-       
-        i = 0
-        while i < self.kc_size:
-            saved_projections = self.projections.copy()
-            self.projections = lil_matrix(np.delete(self.projections.todense(),[i],axis=0))
-            current_pruned_score, kc_in_use_sorted, kc_in_hash_sorted = self.evaluate(train_set,val_set,train_label,val_label)
-            if current_pruned_score < orig_score - 0.005: #if score has decreased too much
-                self.projections = saved_projections #revert to old projections
-                self.val_score = last_pruned_score #revert to previous score
-                print("Keeping dim... Size remains",self.kc_size," (Low score:",current_pruned_score,")")
-                i+=1
-            else: #else update fly
-                if current_pruned_score >= last_pruned_score: #score may have increased from pruning
-                    last_pruned_score = current_pruned_score
-                self.kc_size-=1
-                self.val_score = current_pruned_score
-                print("Pruned... New size",self.kc_size,"with score",current_pruned_score)
+    def prune(self,train_set,val_set,train_label,val_label,tolerance=0.005,batch_size=None,check_every=1):
+        """Remove KCs, in batches of batch_size (5% of the KCs by default), as long as the
+        score stays within tolerance of the original one (see pruning.py). The WTA is
+        rescaled so that hashes keep as many winners as in the full fly."""
+        activations = [KCActivations(val_set, self.projections, self.wta)]
+        if self.eval_method == "classification":
+            activations.append(KCActivations(train_set, self.projections, self.wta))
+
+        def _evaluate(hashes):
+            if self.eval_method == "classification":
+                score, _ = train_model(m_train=hashes[1], classes_train=train_label,
+                                       m_val=hashes[0], classes_val=val_label,
+                                       C=self.hyperparameters['C'], num_iter=self.hyperparameters['num_iter'])
+                return score
+            return prec_at_k(m=hashes[0], classes=val_label, k=self.hyperparameters['num_nns'], metric="hamming")
+
+        if batch_size is None:
+            batch_size = max(1, int(5 * self.kc_size / 100))
+        keep, self.val_score = prune_kcs(activations, _evaluate, self.val_score if self.is_evaluated else None,
+                                         tolerance, batch_size, check_every)
+        self.projections = csr_matrix(self.projections)[keep]
+        self.kc_size = len(keep)
+        self.wta = 100 * (activations[0].k + 0.5) / self.kc_size
+        self.is_evaluated = True
         print("Pruned fly. Score:",self.val_score,"KC size:",self.kc_size)
         return self.val_score, self.kc_size
 
-    def projection_store(self,proj_store):
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
+    def projection_store(self, proj_store):
         self.proj_store = proj_store.copy()
-        proj_size = len(self.proj_store[0])
         random.shuffle(self.proj_store)
-        sidx = [pn for p in self.proj_store for pn in p]
-        idx = list(range(self.pn_size))
-        not_in_store_idx = list(set(idx) - set(sidx))
-        #print(len(not_in_store_idx),'IDs not in store')
-        used_idx = sidx.copy()
-        c = 0
-        
-        while c < self.kc_size:
-            for i in range(len(self.proj_store)):
-                p = self.proj_store[i]
-                for j in p:
-                    weight_mat[c][j] = 1
-                c+=1
-                if c >= self.kc_size:
-                    break
-            random.shuffle(idx) #add random if needed -- if all KCs are not filled
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        projections = stored_projections(self.kc_size, self.pn_size, self.proj_store)
+        return projections, projections.indices
 
     def get_coverage(self):
         ps = self.projections.toarray()
@@ -182,34 +148,9 @@ class Fly:
         #print("KC USE:",np.sort(self.kc_use)[::-1][:20])
         return self.val_score, self.kc_use_sorted, self.kc_in_hash_sorted
 
-    def compute_nearest_neighbours(self, hammings,labels,i,num_nns):
-        i_sim = np.array(hammings[i])
-        i_label = labels[i]
-        ranking = np.argsort(-i_sim)
-        neighbours = [labels[n] for n in ranking][1:num_nns+1] #don't count first neighbour which is itself
-        n_sum=0
-        for enu, n in enumerate(neighbours):
-            for lab in n:
-                if lab in i_label:
-                    n_sum+=1
-                    # print(enu, lab, i_label)
-                    break
-        score = n_sum / num_nns
-        # print(i,i_label,neighbours,score)
-        return score,neighbours
-
     def prec_at_k(self,m_val=None,classes_val=None,k=None):
-        hammings = 1-pairwise_distances(m_val.todense(), metric="hamming")
-        kc_hash_use = np.zeros(m_val.shape[1])
-        scores = []
-        for i in range(hammings.shape[0]):
-            score, neighbours = self.compute_nearest_neighbours(hammings,classes_val,i,k)
-            for idx in m_val[i].indices:
-                kc_hash_use[idx]+=1
-            scores.append(score)
-        kc_hash_use = kc_hash_use / sum(kc_hash_use)
-        kc_sorted_hash_use = np.argsort(kc_hash_use)[:-kc_hash_use.shape[0]-1:-1] #Give sorted list from most to least used KCs
-        return np.mean(scores), kc_sorted_hash_use
+        score = prec_at_k(m=m_val, classes=classes_val, k=k, metric="hamming")
+        return score, kc_use_sorted(m_val)
 
     def print_projections(self):
         words = ''
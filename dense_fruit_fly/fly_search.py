@@ -1,6 +1,6 @@
 """Hyper-parameter search by Bayesian optimization
 Usage:
-  fly_search.py --dataset=<str>
+  fly_search.py --dataset=<str> [--continue_log=<filename> | --asha [--min_fraction=<f>] [--eta=<n>]] [--batch=<n>] [--eval=<str>]
   fly_search.py (-h | --help)
   fly_search.py --version
 
@@ -8,6 +8,12 @@ Options:
   -h --help                    Show this screen.
   --version                    Show version.
   --dataset=<str>              Name of dataset, either wiki, 20news, or wos.
+  --continue_log=<filename>    Log of a previous search to start from (e.g. ./log/bayes_opt/logs_wos_fly_100.json).
+  --asha                       Successive halving over document subsamples instead of Bayesian optimization.
+  --min_fraction=<f>           Fraction of the data new configurations are evaluated on [default: 0.111].
+  --eta=<n>                    Only the top 1/eta of each fraction is evaluated on eta times more data [default: 3].
+  --batch=<n>                  Number of points evaluated in parallel [default: 1].
+  --eval=<str>                 Fitness of a fly, either similarity (prec@k) or classification [default: classification].
 """
 
 
@@ -25,20 +31,19 @@ from docopt import docopt
 from sklearn import preprocessing
 from sklearn.feature_extraction.text import CountVectorizer
 from scipy.sparse import csr_matrix
+from threadpoolctl import threadpool_limits
 from scipy.sparse import hstack, vstack, lil_matrix, coo_matrix
 from sklearn.preprocessing import MultiLabelBinarizer
 from sklearn.metrics import pairwise_distances
 from sklearn.decomposition import PCA
 
-from bayes_opt import BayesianOptimization
-from bayes_opt.logger import JSONLogger
-from bayes_opt.event import Events
-from bayes_opt.util import load_logs
-
 from codecarbon import OfflineEmissionsTracker
 
 from classify import train_model
 from utils import read_vocab, hash_dataset_, read_n_encode_dataset
+from genome import Genome
+from eval import prec_at_k, sampled_prec_at_k, kc_use_sorted
+from batch_bo import BatchBayesianOptimization, AsyncSuccessiveHalving, subsample
 # from fly import Fly
 
 
@@ -59,9 +64,8 @@ class FlyPCA:
         self.proj_size = proj_size
         self.eval_method = eval_method
         self.hyperparameters = hyperparameters
-        weight_mat, self.shuffled_idx = self.create_projections(proj_size=self.proj_size)
-        # weight_mat, self.shuffled_idx = self.create_projections_3(proj_size=self.proj_size, favor_order=std_rank)
-        self.projections = lil_matrix(weight_mat)
+        self.projections, self.shuffled_idx = self.create_projections(proj_size=self.proj_size)
+        # self.projections, self.shuffled_idx = self.create_projections_3(proj_size=self.proj_size, favor_order=std_rank)
         self.val_score_c = 0
         self.val_score_s = 0
         self.is_evaluated = False
@@ -74,23 +78,20 @@ class FlyPCA:
 
 
     def create_projections(self, proj_size):
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
-        idx = list(range(self.pn_size))
-        random.shuffle(idx)
-        used_idx = idx.copy()
-        c = 0
-
-        while c < self.kc_size:
-            for i in range(0, len(idx), proj_size):
-                p = idx[i:i + proj_size]
-                for j in p:
-                    weight_mat[c][j] = 1
-                c += 1
-                if c >= self.kc_size:
-                    break
-            random.shuffle(idx)  # reshuffle if needed -- if all KCs are not filled
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        self.genome, projections = Genome.permutation(self.kc_size, self.pn_size, proj_size)
+        return projections, projections.indices
+
+    def __getstate__(self):
+        # saved flies only carry their genome, the projections are regenerated from it
+        state = dict(vars(self))
+        del state['projections'], state['shuffled_idx']
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        if 'projections' not in state:
+            self.projections = self.genome.projections()
+            self.shuffled_idx = self.projections.indices
 
     def evaluate(self, train_set, val_set, train_label, val_label):
         # # dim reduction
@@ -99,21 +100,17 @@ class FlyPCA:
 
         hash_val, kc_use_val, kc_sorted_val = hash_dataset_(dataset_mat=val_set, weight_mat=self.projections,
                                                             percent_hash=self.wta)
-        # if self.eval_method == "classification":
-        # We only need the train set for classification, not similarity
-        hash_train, kc_use_train, kc_sorted_train = hash_dataset_(dataset_mat=train_set,
-                                                                  weight_mat=self.projections,
-                                                                  percent_hash=self.wta)
-
-        hash_train = hash_train.toarray()
-        hash_val = hash_val.toarray()
-        hash_train = (hash_train > 0).astype(np.int_)
         hash_val = (hash_val > 0).astype(np.int_)
 
         if self.eval_method == 'similarity':
-            self.val_score_s, _ = self.prec_at_k(m_val=hash_val, classes_val=val_label_prec,
+            self.val_score_s, _ = self.prec_at_k(m_val=hash_val, classes_val=val_label,
                                        k=self.hyperparameters['num_nns'])
         else:  # classification
+            # We only need the train set for classification, not similarity
+            hash_train, kc_use_train, kc_sorted_train = hash_dataset_(dataset_mat=train_set,
+                                                                      weight_mat=self.projections,
+                                                                      percent_hash=self.wta)
+            hash_train = (hash_train > 0).astype(np.int_)
             self.val_score_c, _ = train_model(m_train=hash_train, classes_train=train_label,
                                     m_val=hash_val, classes_val=val_label,
                                     C=self.hyperparameters['C'], num_iter=self.hyperparameters['num_iter'])
@@ -121,54 +118,36 @@ class FlyPCA:
         return self.val_score_c, self.val_score_s#, self.kc_use_sorted, self.kc_in_hash_sorted
         # return np.random.random(), np.random.random()
 
-    def compute_nearest_neighbours(self, hammings, labels, i, num_nns):
-        i_sim = np.array(hammings[i])
-        i_label = labels[i]
-        ranking = np.argsort(-i_sim)
-        neighbours = [labels[n] for n in ranking][1:num_nns + 1]  # don't count first neighbour which is itself
-        n_sum = 0
-        # print("neighbours: ", neighbours)
-        # print("i_label", i_label)
-        for n in neighbours:
-            for lab in n:
-                if lab in i_label:
-                    n_sum += 1
-                    break
-        score = n_sum / num_nns
-        return score, neighbours
-
     def prec_at_k(self, m_val=None, classes_val=None, k=None):
-        hammings = 1 - pairwise_distances(m_val, metric="hamming")
-        kc_hash_use = np.zeros(m_val.shape[1])
-        scores = []
-        for i in range(hammings.shape[0]):
-            score, neighbours = self.compute_nearest_neighbours(hammings, classes_val, i, k)
-            for idx in np.nonzero(m_val[i] == 0)[0]: #m_val[i].indices:
-                kc_hash_use[idx] += 1
-            scores.append(score)
-        kc_hash_use = kc_hash_use / sum(kc_hash_use)
-        kc_sorted_hash_use = np.argsort(kc_hash_use)[
-                             :-kc_hash_use.shape[0] - 1:-1]  # Give sorted list from most to least used KCs
-        return np.mean(scores), kc_sorted_hash_use
-
-
-def fruitfly_pipeline(kc_size, proj_size, wta, knn, num_trial, C, save):
+        if self.hyperparameters.get('sample', False):
+            #Cheap estimate during search: more queries are scored only when close to the incumbent
+            score, half_width, n = sampled_prec_at_k(m=m_val, classes=classes_val, k=k, metric="hamming",
+                                                     incumbent=self.hyperparameters['incumbent'])
+            print(f'prec@{k} estimate: {score:.4f} +/- {half_width:.4f} ({n} queries)')
+        else:
+            score = prec_at_k(m=m_val, classes=classes_val, k=k, metric="hamming")
+        return score, kc_use_sorted(m_val)
+
+
+def fruitfly_pipeline(kc_size, proj_size, wta, knn, num_trial, C, save, incumbent=None, fraction=1.0, sample=True):
 
     #Below parameters are needed to init the fruit fly, even if not used here
     init_method = 'random'
-    # eval_method = 'similarity'
-    eval_method = 'classification'
     proj_store = None
-    hyperparameters = {'C': C, 'num_iter': 200, 'num_nns': knn}
+    hyperparameters = {'C': C, 'num_iter': 200, 'num_nns': knn, 'sample': sample and not save, 'incumbent': incumbent}
 
     fly_list = [FlyPCA(pn_size=PN_SIZE, kc_size=kc_size, wta=wta, proj_size=proj_size,
                        eval_method=eval_method, hyperparameters=hyperparameters) for _ in range(num_trial)]
     print('evaluating...')
     scores = []
     best_fly_score = 0.0
+    #Low fidelity evaluations (successive halving) only see a subsample of the documents
+    train, train_y = subsample(train_set, train_label, fraction)
+    val, val_y = subsample(val_set, val_label, fraction)
 
-    with Parallel(n_jobs=max_thread, prefer="threads") as parallel:
-        delayed_funcs = [delayed(lambda x:x.evaluate(train_set,val_set,train_label,val_label))(fly) for fly in fly_list]
+    #one BLAS thread per fly, the flies are hashed in parallel
+    with Parallel(n_jobs=max_thread, prefer="threads") as parallel, threadpool_limits(limits=1, user_api='blas'):
+        delayed_funcs = [delayed(lambda x:x.evaluate(train,val,train_y,val_y))(fly) for fly in fly_list]
         scores = parallel(delayed_funcs)
 
     if eval_method == 'classification':
@@ -192,36 +171,55 @@ def fruitfly_pipeline(kc_size, proj_size, wta, knn, num_trial, C, save):
     return avg_score
 
 
-def optimize_fruitfly():
+def _evaluate(kc_size, wta, proj_size, C, knn, num_trial, incumbent=None, fraction=1.0, exact_full=False):
+    kc_size = round(kc_size)
+    proj_size = round(proj_size)
+    wta = round(wta)
+    print(f'--- kc_size {kc_size}, wta {wta}, proj_size {proj_size}, knn {knn}, C {C}, fraction {fraction:.3f} ')
+    score_list = fruitfly_pipeline(kc_size=kc_size, proj_size=proj_size, wta=wta, knn=knn, num_trial=num_trial,
+                                   C=C, save=False, incumbent=incumbent, fraction=fraction,
+                                   sample=not (exact_full and fraction >= 1))
+    return np.sum(score_list)
+
+
+def optimize_fruitfly(continue_log, batch, asha=None):
     knn = 100
     num_trial = 3
-    def _evaluate(kc_size, wta, proj_size, C):
-        kc_size = round(kc_size)
-        proj_size = round(proj_size)
-        wta = round(wta)
-        print(f'--- kc_size {kc_size}, wta {wta}, proj_size {proj_size}, knn {knn}, C {C} ')
-        score_list = fruitfly_pipeline(kc_size=kc_size, proj_size=proj_size, wta=wta,
-                                       knn=knn, num_trial=num_trial, C=C, save=False)
-        return np.sum(score_list)
-
-    optimizer = BayesianOptimization(
-        f=_evaluate,
-        pbounds={"kc_size": (500, 15000), "proj_size": (2, 10), "wta": (1, 100), "C": (1, 100)},
-        random_state=1234,
-        verbose=2
-    )
-
     tmp_log_path = f'./log/bayes_opt/logs_{dataset_name}_fly_{knn}.json'
-    logger = JSONLogger(path=tmp_log_path)
-    optimizer.subscribe(Events.OPTIMIZATION_STEP, logger)
+    if continue_log != tmp_log_path and os.path.exists(tmp_log_path):
+        os.remove(tmp_log_path)  # new search
+    pbounds = {"kc_size": (500, 15000), "proj_size": (2, 10), "wta": (1, 100), "C": (1, 100)}
+
+    if asha:
+        #scores on different subsamples are not comparable, so no incumbent, and the last rung
+        #(full data), which decides the result of the search, is scored exactly on all queries
+        optimizer = AsyncSuccessiveHalving(f=_evaluate, pbounds=pbounds, num_workers=batch,
+                                           history=tmp_log_path, random_state=1234, **asha)
+        search = lambda: optimizer.maximize(num_configs=250, extra_kwargs=lambda: {'knn': knn, 'num_trial': num_trial,
+                                                                                   'exact_full': True})
+    else:
+        optimizer = BatchBayesianOptimization(
+            f=_evaluate,
+            pbounds=pbounds,
+            num_workers=batch,
+            history=tmp_log_path,
+            warm_start=[continue_log] if continue_log else None,
+            random_state=1234
+        )
+        incumbent = lambda: {'knn': knn, 'num_trial': num_trial,
+                             'incumbent': optimizer.max['target'] if optimizer.res else None}
+        search = lambda: optimizer.maximize(init_points=50, n_iter=200, extra_kwargs=incumbent)
 
     tracker = OfflineEmissionsTracker(project_name='Fruitfly_BO_' + dataset_name,
                                       country_iso_code="ITA",
                                       measure_power_secs=60*5,
                                       output_dir='./log/emissions_tracker')
     tracker.start()
-    optimizer.maximize(init_points=50, n_iter=200)
+    search()
     tracker.stop()
+    if not optimizer.max:  #no evaluation came back (e.g. the search was stopped early)
+        print("No configuration was evaluated, no fly saved.")
+        return
     print("Final result:", optimizer.max['target'])
 
     # Saving a fly with the best params
@@ -237,6 +235,9 @@ def optimize_fruitfly():
 if __name__ == '__main__':
     args = docopt(__doc__, version='Hyper-parameter search by Bayesian optimization, ver 0.1')
     dataset = args["--dataset"]
+    eval_method = args["--eval"]
+    if eval_method not in ('similarity', 'classification'):
+        raise ValueError(f'--eval should be similarity or classification, not {eval_method}')
     power = 5
 
     if dataset == "wiki" or dataset == "enwiki":
@@ -297,13 +298,17 @@ if __name__ == '__main__':
         train_label = onehotencoder.fit_transform(train_label)  # .tolist()
         val_label = onehotencoder.fit_transform(val_label)  # .tolist()
 
-    scaler = preprocessing.Normalizer(norm='l2').fit(train_set.todense())
-    train_set = scaler.transform(train_set.todense())
-    val_set = scaler.transform(val_set.todense())
+    #Row normalisation on the sparse matrices: the fly hashes them on the sparse path
+    train_set = preprocessing.normalize(train_set, norm='l2')
+    val_set = preprocessing.normalize(val_set, norm='l2')
 
     PN_SIZE = train_set.shape[1]
 
-    max_thread = int(multiprocessing.cpu_count() * 0.12)
+    batch = int(args["--batch"])
+    max_thread = max(1, int(multiprocessing.cpu_count() * 0.12) // batch)
 
     # search
-    optimize_fruitfly()
+    asha = None
+    if args["--asha"]:
+        asha = {'min_fraction': float(args["--min_fraction"]), 'eta': int(args["--eta"])}
+    optimize_fruitfly(args["--continue_log"], batch, asha)
@@ -25,6 +25,7 @@ from docopt import docopt
 from sklearn import preprocessing
 from sklearn.feature_extraction.text import CountVectorizer
 from scipy.sparse import csr_matrix
+from threadpoolctl import threadpool_limits
 from scipy.sparse import hstack, vstack, lil_matrix, coo_matrix
 from sklearn.preprocessing import MultiLabelBinarizer
 from sklearn.metrics import pairwise_distances
@@ -39,6 +40,7 @@ from codecarbon import OfflineEmissionsTracker
 
 from classify import train_model
 from utils import read_vocab, hash_dataset_, read_n_encode_dataset
+from genome import Genome
 # from fly import Fly
 
 
@@ -59,9 +61,8 @@ class FlyPCA:
         self.proj_size = proj_size
         self.eval_method = eval_method
         self.hyperparameters = hyperparameters
-        weight_mat, self.shuffled_idx = self.create_projections(proj_size=self.proj_size)
-        # weight_mat, self.shuffled_idx = self.create_projections_3(proj_size=self.proj_size, favor_order=std_rank)
-        self.projections = lil_matrix(weight_mat)
+        self.projections, self.shuffled_idx = self.create_projections(proj_size=self.proj_size)
+        # self.projections, self.shuffled_idx = self.create_projections_3(proj_size=self.proj_size, favor_order=std_rank)
         self.val_score_c = 0
         self.val_score_s = 0
         self.is_evaluated = False
@@ -74,23 +75,20 @@ class FlyPCA:
 
 
     def create_projections(self, proj_size):
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
-        idx = list(range(self.pn_size))
-        random.shuffle(idx)
-        used_idx = idx.copy()
-        c = 0
-
-        while c < self.kc_size:
-            for i in range(0, len(idx), proj_size):
-                p = idx[i:i + proj_size]
-                for j in p:
-                    weight_mat[c][j] = 1
-                c += 1
-                if c >= self.kc_size:
-                    break
-            random.shuffle(idx)  # reshuffle if needed -- if all KCs are not filled
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        self.genome, projections = Genome.permutation(self.kc_size, self.pn_size, proj_size)
+        return projections, projections.indices
+
+    def __getstate__(self):
+        # saved flies only carry their genome, the projections are regenerated from it
+        state = dict(vars(self))
+        del state['projections'], state['shuffled_idx']
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        if 'projections' not in state:
+            self.projections = self.genome.projections()
+            self.shuffled_idx = self.projections.indices
 
 
     def evaluate(self, train_set, val_set, train_label, val_label):
@@ -196,7 +194,8 @@ def fruitfly_pipeline(kc_size, proj_size, wta, knn, num_trial, C, save):
     scores = []
     best_fly_score = 0.0
 
-    with Parallel(n_jobs=max_thread, prefer="threads") as parallel:
+    #one BLAS thread per fly, the flies are hashed in parallel
+    with Parallel(n_jobs=max_thread, prefer="threads") as parallel, threadpool_limits(limits=1, user_api='blas'):
         delayed_funcs = [delayed(lambda x:x.evaluate(train_set,val_set,train_label,val_label))(fly) for fly in fly_list]
         scores = parallel(delayed_funcs)
 
@@ -323,9 +322,9 @@ if __name__ == '__main__':
         train_label = onehotencoder.fit_transform(train_label)  # .tolist()
         val_label = onehotencoder.fit_transform(val_label)  # .tolist()
 
-    scaler = preprocessing.Normalizer(norm='l2').fit(train_set.todense())
-    train_set = scaler.transform(train_set.todense())
-    val_set = scaler.transform(val_set.todense())
+    #Row normalisation on the sparse matrices: the fly hashes them on the sparse path
+    train_set = preprocessing.normalize(train_set, norm='l2')
+    val_set = preprocessing.normalize(val_set, norm='l2')
 
     PN_SIZE = train_set.shape[1]
 
@@ -0,0 +1,113 @@
+"""Pruning of the KC layer of a fly from cached KC activations. The activations of
+the documents are computed once; removing KCs only recomputes the WTA of the
+documents in which one of them was a winner (in the others, the winners are the
+same without them), and the fitness of the fly is only re-evaluated at checkpoints,
+after one or several batches of KCs have been removed.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+from utils import dense_projection_blocks
+
+
+class KCActivations:
+    """
+    The KC activations of a dataset under a fly (documents x KCs, dense) and the WTA
+    winners of each document, kept up to date as KCs are removed. KCs keep their
+    numbering in the full fly, and every document keeps the number of winners it has
+    in the full fly (see wta_vectorized in utils.py).
+    """
+    def __init__(self, dataset_mat, projections, percent_hash):
+        if issparse(dataset_mat):
+            self.kc_mat = csr_matrix(dataset_mat).dot(csr_matrix(projections).T).toarray()
+        else:  #float32, as on the dense path of hash_dataset_
+            dataset_mat = np.asarray(dataset_mat, dtype=np.float32)
+            self.kc_mat = np.hstack([dataset_mat.dot(w) for w in dense_projection_blocks(projections)])
+        m, n = self.kc_mat.shape
+        self.k = int(percent_hash * n / 100)
+        self.alive = np.ones(n, dtype=bool)
+        self.winners = np.zeros((m, n), dtype=bool)
+        self._wta(np.arange(m))
+
+    def _wta(self, rows):
+        alive = np.flatnonzero(self.alive)
+        for i in range(0, len(rows), 2000):
+            part = self.kc_mat[rows[i: i+2000]][:, alive]
+            kth_vals = np.partition(part, -self.k, axis=1)[:, -self.k]
+            winners = np.zeros((part.shape[0], self.kc_mat.shape[1]), dtype=bool)
+            winners[:, alive] = part >= kth_vals[:, None]
+            self.winners[rows[i: i+2000]] = winners
+
+    def remove(self, kcs):
+        """Remove the KCs kcs, and return what restore needs to put them back."""
+        rows = np.flatnonzero(self.winners[:, kcs].any(axis=1))
+        undo = (kcs, rows, self.winners[rows])
+        self.alive[kcs] = False
+        self.winners[:, kcs] = False
+        self._wta(rows)
+        return undo
+
+    def restore(self, undo):
+        kcs, rows, winners = undo
+        self.alive[kcs] = True
+        self.winners[rows] = winners
+
+    def use(self):
+        """Number of documents each KC is a winner in (0 for removed KCs)."""
+        return self.winners.sum(axis=0)
+
+    def hashes(self):
+        """Hashes of the documents under the remaining KCs, as given by hash_dataset_."""
+        alive = np.flatnonzero(self.alive)
+        return csr_matrix(np.where(self.winners[:, alive], self.kc_mat[:, alive], 0))
+
+
+def prune_kcs(activations, evaluate, score=None, tolerance=0.005, batch_size=1, check_every=1):
+    """
+    Remove KCs from a fly as long as its fitness stays within tolerance of its
+    original score. activations is a list of KCActivations (e.g. for the val and
+    train sets), evaluate a function of the list of their hashes returning the
+    fitness, and score the fitness of the full fly (evaluated if None).
+
+    KCs that are never winners are removed first, without evaluation, as this
+    leaves the hashes unchanged. The others are removed in batches of batch_size,
+    least used first, and the fitness evaluated every check_every batches: if it
+    has dropped too much, the batches since the last evaluation are put back and
+    the batch size halved. Pruning stops when a batch of one KC fails.
+    Return the ids of the remaining KCs and the fitness of the pruned fly.
+    """
+    if score is None:
+        score = evaluate([a.hashes() for a in activations])
+    orig_score = last_score = score
+    min_size = max(a.k for a in activations)  #enough KCs left for the WTA
+    use = sum(a.use() for a in activations)
+    never = np.flatnonzero(use == 0)[:max(0, len(use) - min_size)]
+    for a in activations:
+        a.remove(never)
+    print("Removed", len(never), "KCs that are never winners")
+
+    undo, n_batches = [], 0
+    while batch_size >= 1:
+        alive = activations[0].alive
+        use = sum(a.use() for a in activations)
+        candidates = np.flatnonzero(alive)[np.argsort(use[alive], kind='stable')]
+        batch = candidates[:min(batch_size, len(candidates) - min_size)]
+        if len(batch) == 0:
+            break
+        undo.append([a.remove(batch) for a in activations])
+        n_batches += 1
+        if n_batches % check_every and len(candidates) - len(batch) > min_size:
+            continue
+        score = evaluate([a.hashes() for a in activations])
+        if score < orig_score - tolerance:  #score has decreased too much
+            for batch_undo in reversed(undo):
+                for a, u in zip(activations, batch_undo):
+                    a.restore(u)
+            print("Keeping", sum(len(u[0][0]) for u in undo), "KCs... (low score:", score, ")")
+            batch_size //= 2
+        else:
+            last_score = score
+            print("Pruned... New size", activations[0].alive.sum(), "with score", score)
+        undo, n_batches = [], 0
+    return np.flatnonzero(activations[0].alive), last_score
@@ -38,6 +38,7 @@ from codecarbon import OfflineEmissionsTracker
 
 from classify import train_model
 from utils import read_vocab, hash_dataset_, read_n_encode_dataset
+from genome import Genome
 # from fly import Fly
 
 
@@ -50,9 +51,8 @@ class FlyPCA:
         self.proj_size = proj_size
         self.eval_method = eval_method
         self.hyperparameters = hyperparameters
-        weight_mat, self.shuffled_idx = self.create_projections(proj_size=self.proj_size)
-        # weight_mat, self.shuffled_idx = self.create_projections_3(proj_size=self.proj_size, favor_order=std_rank)
-        self.projections = lil_matrix(weight_mat)
+        self.projections, self.shuffled_idx = self.create_projections(proj_size=self.proj_size)
+        # self.projections, self.shuffled_idx = self.create_projections_3(proj_size=self.proj_size, favor_order=std_rank)
         self.val_score_c = 0
         self.val_score_s = 0
         self.is_evaluated = False
@@ -65,23 +65,20 @@ class FlyPCA:
 
 
     def create_projections(self, proj_size):
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
-        idx = list(range(self.pn_size))
-        random.shuffle(idx)
-        used_idx = idx.copy()
-        c = 0
-
-        while c < self.kc_size:
-            for i in range(0, len(idx), proj_size):
-                p = idx[i:i + proj_size]
-                for j in p:
-                    weight_mat[c][j] = 1
-                c += 1
-                if c >= self.kc_size:
-                    break
-            random.shuffle(idx)  # reshuffle if needed -- if all KCs are not filled
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        self.genome, projections = Genome.permutation(self.kc_size, self.pn_size, proj_size)
+        return projections, projections.indices
+
+    def __getstate__(self):
+        # saved flies only carry their genome, the projections are regenerated from it
+        state = dict(vars(self))
+        del state['projections'], state['shuffled_idx']
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        if 'projections' not in state:
+            self.projections = self.genome.projections()
+            self.shuffled_idx = self.projections.indices
 
     def evaluate(self, train_set, val_set, train_label, val_label):
         # # dim reduction
@@ -19,12 +19,13 @@ import sentencepiece as spm
 from docopt import docopt
 from sklearn import preprocessing
 from sklearn.feature_extraction.text import CountVectorizer
-from scipy.sparse import lil_matrix
 from sklearn.preprocessing import MultiLabelBinarizer
 
 from classify import train_model
 from sklearn.metrics import pairwise_distances
 from utils import read_vocab, hash_dataset_, read_n_encode_dataset
+from projections import permutation_projections, stored_projections, achlioptas_projections
+from eval import prec_at_k, kc_use_sorted
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -40,23 +41,22 @@ class FlyTestInit:
         self.eval_method = eval_method
         self.hyperparameters = hyperparameters
         if self.init_method == "original":
-            weight_mat, self.shuffled_idx = self.create_projections(self.proj_size)
+            self.projections, self.shuffled_idx = self.create_projections(self.proj_size)
         elif self.init_method == "minus_1":
-            weight_mat, self.shuffled_idx = self.create_projections_0(self.proj_size)
+            self.projections, self.shuffled_idx = self.create_projections_0(self.proj_size)
         elif self.init_method == "ach":
-            weight_mat, self.shuffled_idx = self.create_projections_1()
+            self.projections, self.shuffled_idx = self.create_projections_1()
         elif self.init_method == "ach_3":
-            weight_mat, self.shuffled_idx = self.create_projections_2(scale=3)
+            self.projections, self.shuffled_idx = self.create_projections_2(scale=3)
         elif self.init_method == "ach_kc":
-            weight_mat, self.shuffled_idx = self.create_projections_2(scale=self.kc_size)
+            self.projections, self.shuffled_idx = self.create_projections_2(scale=self.kc_size)
         elif self.init_method == "ach_sqrt_pn":
-            weight_mat, self.shuffled_idx = self.create_projections_2(scale=np.sqrt(self.pn_size))
+            self.projections, self.shuffled_idx = self.create_projections_2(scale=np.sqrt(self.pn_size))
         elif self.init_method == "favor_order":
-            weight_mat, self.shuffled_idx = self.create_projections_3(proj_size=self.proj_size, favor_order=std_rank)
+            self.projections, self.shuffled_idx = self.create_projections_3(proj_size=self.proj_size, favor_order=std_rank)
         else:
-            weight_mat, self.shuffled_idx = self.projection_store(proj_store)
+            self.projections, self.shuffled_idx = self.projection_store(proj_store)
 
-        self.projections = lil_matrix(weight_mat)
         self.val_score_c = 0
         self.val_score_s = 0
         self.is_evaluated = False
@@ -66,96 +66,30 @@ class FlyTestInit:
 
 
     def create_projections(self, proj_size):
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
-        idx = list(range(self.pn_size))
-        random.shuffle(idx)
-        used_idx = idx.copy()
-        c = 0
-
-        while c < self.kc_size:
-            for i in range(0, len(idx), proj_size):
-                p = idx[i:i + proj_size]
-                for j in p:
-                    weight_mat[c][j] = 1
-                c += 1
-                if c >= self.kc_size:
-                    break
-            random.shuffle(idx)  # reshuffle if needed -- if all KCs are not filled
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        projections = permutation_projections(self.kc_size, self.pn_size, proj_size)
+        return projections, projections.indices
 
     def create_projections_0(self, proj_size):  # introduce -1
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
-        idx = list(range(self.pn_size))
-        random.shuffle(idx)
-        used_idx = idx.copy()
-        c = 0
-
-        while c < self.kc_size:
-            for i in range(0, len(idx), proj_size):
-                p = idx[i:i + proj_size]
-                for j in p:
-                    weight_mat[c][j] = 1 if np.random.random() < 0.5 else -1
-                c += 1
-                if c >= self.kc_size:
-                    break
-            random.shuffle(idx)  # reshuffle if needed -- if all KCs are not filled
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        projections = permutation_projections(self.kc_size, self.pn_size, proj_size, signed=True)
+        return projections, projections.indices
 
     def create_projections_1(self):  # Achlioptas without scale
-        weight_mat = np.random.choice([-1, 0, 1], size=(self.kc_size, self.pn_size), p=[1/6, 2/3, 1/6])
-        return weight_mat, None
+        return achlioptas_projections(self.kc_size, self.pn_size, scale=3), None
 
     def create_projections_2(self, scale):  # Achlioptas with scale
-        proportion = [1/(2*scale), 1 - 1/scale, 1/(2*scale)]
-        weight_mat = np.random.choice([-1, 0, 1], size=(self.kc_size, self.pn_size), p=proportion)
-        weight_mat = weight_mat * np.sqrt(scale/self.kc_size)
-        return weight_mat, None
+        return achlioptas_projections(self.kc_size, self.pn_size, scale=scale, rescale=True), None
 
     def create_projections_3(self, proj_size, favor_order):  # favor high variance dimensions
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
-        idx = list(np.random.permutation(favor_order[0:1000])) + list(np.random.permutation(favor_order[1000:]))
-        used_idx = idx.copy()
-        c = 0
-
-        while c < self.kc_size:
-            for i in range(0, len(idx), proj_size):
-                p = idx[i:i + proj_size]
-                for j in p:
-                    weight_mat[c][j] = 1 if np.random.random() < 0.5 else -1
-                c += 1
-                if c >= self.kc_size:
-                    break
-            # reshuffle if needed -- if all KCs are not filled
-            idx = list(np.random.permutation(favor_order[0:1000])) + list(np.random.permutation(favor_order[1000:]))
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        projections = permutation_projections(self.kc_size, self.pn_size, proj_size, signed=True,
+                                              blocks=[favor_order[0:1000], favor_order[1000:]])
+        return projections, projections.indices
 
 
     def projection_store(self, proj_store):
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
         self.proj_store = proj_store.copy()
-        proj_size = len(self.proj_store[0])
         random.shuffle(self.proj_store)
-        sidx = [pn for p in self.proj_store for pn in p]
-        idx = list(range(self.pn_size))
-        not_in_store_idx = list(set(idx) - set(sidx))
-        # print(len(not_in_store_idx),'IDs not in store')
-        used_idx = sidx.copy()
-        c = 0
-
-        while c < self.kc_size:
-            for i in range(len(self.proj_store)):
-                p = self.proj_store[i]
-                for j in p:
-                    weight_mat[c][j] = 1
-                c += 1
-                if c >= self.kc_size:
-                    break
-            random.shuffle(idx)  # add random if needed -- if all KCs are not filled
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        projections = stored_projections(self.kc_size, self.pn_size, self.proj_store)
+        return projections, projections.indices
 
     def get_coverage(self):
         ps = self.projections.toarray()
@@ -195,35 +129,9 @@ class FlyTestInit:
         # print("KC USE:",np.sort(self.kc_use)[::-1][:20])
         return self.val_score_c, self.val_score_s#, self.kc_use_sorted, self.kc_in_hash_sorted
 
-    def compute_nearest_neighbours(self, hammings, labels, i, num_nns):
-        i_sim = np.array(hammings[i])
-        i_label = labels[i]
-        ranking = np.argsort(-i_sim)
-        neighbours = [labels[n] for n in ranking][1:num_nns + 1]  # don't count first neighbour which is itself
-        n_sum = 0
-        # print("neighbours: ", neighbours)
-        # print("i_label", i_label)
-        for n in neighbours:
-            for lab in n:
-                if lab in i_label:
-                    n_sum += 1
-                    break
-        score = n_sum / num_nns
-        return score, neighbours
-
     def prec_at_k(self, m_val=None, classes_val=None, k=None):
-        hammings = 1 - pairwise_distances(m_val.todense(), metric="hamming")
-        kc_hash_use = np.zeros(m_val.shape[1])
-        scores = []
-        for i in range(hammings.shape[0]):
-            score, neighbours = self.compute_nearest_neighbours(hammings, classes_val, i, k)
-            for idx in m_val[i].indices:
-                kc_hash_use[idx] += 1
-            scores.append(score)
-        kc_hash_use = kc_hash_use / sum(kc_hash_use)
-        kc_sorted_hash_use = np.argsort(kc_hash_use)[
-                             :-kc_hash_use.shape[0] - 1:-1]  # Give sorted list from most to least used KCs
-        return np.mean(scores), kc_sorted_hash_use
+        score = prec_at_k(m=m_val, classes=classes_val, k=k, metric="hamming")
+        return score, kc_use_sorted(m_val)
 
     def print_projections(self):
         words = ''
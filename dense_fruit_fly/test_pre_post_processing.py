@@ -19,7 +19,6 @@ import sentencepiece as spm
 from docopt import docopt
 from sklearn import preprocessing
 from sklearn.feature_extraction.text import CountVectorizer
-from scipy.sparse import lil_matrix
 from sklearn.preprocessing import MultiLabelBinarizer
 from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
@@ -29,6 +28,7 @@ from scipy.stats import entropy
 from classify import train_model
 from sklearn.metrics import pairwise_distances
 from utils import read_vocab, hash_dataset_, read_n_encode_dataset
+from projections import permutation_projections
 from vectorizer import vectorize_scale
 import warnings
 warnings.filterwarnings("ignore")
@@ -85,9 +85,8 @@ class FlyTestPostProcessing:
         self.proj_size = proj_size
         self.eval_method = eval_method
         self.hyperparameters = hyperparameters
-        weight_mat, self.shuffled_idx = self.create_projections(proj_size=self.proj_size)
-        # weight_mat, self.shuffled_idx = self.create_projections_3(proj_size=self.proj_size, favor_order=std_rank)
-        self.projections = lil_matrix(weight_mat)
+        self.projections, self.shuffled_idx = self.create_projections(proj_size=self.proj_size)
+        # self.projections, self.shuffled_idx = self.create_projections_3(proj_size=self.proj_size, favor_order=std_rank)
         self.val_score_c = 0
         self.val_score_s = 0
         self.is_evaluated = False
@@ -100,42 +99,13 @@ class FlyTestPostProcessing:
 
 
     def create_projections(self, proj_size):
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
-        idx = list(range(self.pn_size))
-        random.shuffle(idx)
-        used_idx = idx.copy()
-        c = 0
-
-        while c < self.kc_size:
-            for i in range(0, len(idx), proj_size):
-                p = idx[i:i + proj_size]
-                for j in p:
-                    weight_mat[c][j] = 1
-                c += 1
-                if c >= self.kc_size:
-                    break
-            random.shuffle(idx)  # reshuffle if needed -- if all KCs are not filled
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        projections = permutation_projections(self.kc_size, self.pn_size, proj_size)
+        return projections, projections.indices
 
     def create_projections_3(self, proj_size, favor_order):  # favor high variance dimensions
-        weight_mat = np.zeros((self.kc_size, self.pn_size))
-        idx = list(np.random.permutation(favor_order[0:1000])) + list(np.random.permutation(favor_order[1000:]))
-        used_idx = idx.copy()
-        c = 0
-
-        while c < self.kc_size:
-            for i in range(0, len(idx), proj_size):
-                p = idx[i:i + proj_size]
-                for j in p:
-                    weight_mat[c][j] = 1 if np.random.random() < 0.5 else -1
-                c += 1
-                if c >= self.kc_size:
-                    break
-            # reshuffle if needed -- if all KCs are not filled
-            idx = list(np.random.permutation(favor_order[0:1000])) + list(np.random.permutation(favor_order[1000:]))
-            used_idx.extend(idx)
-        return weight_mat, used_idx[:self.kc_size * proj_size]
+        projections = permutation_projections(self.kc_size, self.pn_size, proj_size, signed=True,
+                                              blocks=[favor_order[0:1000], favor_order[1000:]])
+        return projections, projections.indices
 
 
     def evaluate(self, train_set, val_set, train_label, val_label):
@@ -144,8 +114,7 @@ class FlyTestPostProcessing:
             train_set, val_set = dim_reduction(X_train=train_set, X_val=val_set,
                                                n_dim=1000, method='pca')
             self.pn_size = 1000
-            weight_mat, self.shuffled_idx = self.create_projections(proj_size=self.proj_size)
-            self.projections = lil_matrix(weight_mat)
+            self.projections, self.shuffled_idx = self.create_projections(proj_size=self.proj_size)
 
         hash_val, kc_use_val, kc_sorted_val = hash_dataset_(dataset_mat=val_set, weight_mat=self.projections,
                                                             percent_hash=self.wta)
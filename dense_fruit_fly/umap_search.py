@@ -1,6 +1,6 @@
 """Analysis of PN space
 Usage:
-  umap_search.py --dataset=<str> 
+  umap_search.py --dataset=<str> [--continue_log=<filename>] [--batch=<n>]
   umap_search.py (-h | --help)
   umap_search.py --version
 
@@ -8,9 +8,12 @@ Options:
   -h --help                       Show this screen.
   --version                       Show version.
   --train_path=<str>              Name of file the dataset, either wiki, 20news, or wos  (processed by sentencepiece)
+  --continue_log=<filename>       Log of a previous search to start from (e.g. ./log/logs_wos_umap_100.json).
+  --batch=<n>                     Number of points evaluated in parallel [default: 1].
 """
 
 
+import os
 import umap
 import joblib
 import sentencepiece as spm
@@ -18,27 +21,24 @@ import numpy as np
 from datetime import datetime
 from docopt import docopt
 from sklearn.feature_extraction.text import CountVectorizer
-from sklearn import preprocessing
 
 from scipy.sparse import csr_matrix
 from scipy.sparse import hstack, vstack, lil_matrix, coo_matrix
-from utils import read_vocab, hash_dataset_, read_n_encode_dataset
-from eval import prec_at_k
-from bayes_opt import BayesianOptimization
-from bayes_opt.logger import JSONLogger
-from bayes_opt.event import Events
-from bayes_opt.util import load_logs
-
-
-def evaluate(logprob_power=5, umap_nns=10, umap_min_dist=0.0, umap_components=16, knn=100, save=False):
-    train_set, train_label = read_n_encode_dataset(train_path, vectorizer, logprobs, logprob_power)
-    val_set, val_label = read_n_encode_dataset(train_path.replace('train', 'val'), vectorizer, logprobs, logprob_power)
-    scaler = preprocessing.MinMaxScaler().fit(train_set.todense())
-    train_set = scaler.transform(train_set.todense())
-    val_set = scaler.transform(val_set.todense())
-    umap_model = umap.UMAP(n_neighbors=umap_nns, min_dist=umap_min_dist, n_components=umap_components, metric='hellinger', random_state=32).fit(train_set)
-    #train_set = umap_model.transform(train_set)
-    val_set = umap_model.transform(val_set)
+from utils import read_vocab, hash_dataset_, read_n_count_dataset, weight_counts, SparseMinMaxScaler, transform_in_chunks
+from eval import prec_at_k, sampled_prec_at_k
+from batch_bo import BatchBayesianOptimization
+
+
+def evaluate(logprob_power=5, umap_nns=10, umap_min_dist=0.0, umap_components=16, knn=100, save=False, incumbent=None):
+    #Weighting and scaling on the sparse counts, only UMAP gets dense rows
+    train_set = weight_counts(train_counts, logprobs, logprob_power)
+    val_set = weight_counts(val_counts, logprobs, logprob_power)
+    scaler = SparseMinMaxScaler().fit(train_set)
+    train_set = scaler.transform(train_set)
+    val_set = scaler.transform(val_set)
+    umap_model = umap.UMAP(n_neighbors=umap_nns, min_dist=umap_min_dist, n_components=umap_components, metric='hellinger', random_state=32).fit(scaler.densify(train_set))
+    #train_set = transform_in_chunks(umap_model, train_set, scaler.densify)
+    val_set = transform_in_chunks(umap_model, val_set, scaler.densify)
     val_set = np.nan_to_num(val_set)
 
     #print("Prec at k, train:")
@@ -46,8 +46,13 @@ def evaluate(logprob_power=5, umap_nns=10, umap_min_dist=0.0, umap_components=16
     #print(score)
     
     print("Prec at k, val:")
-    score = prec_at_k(m=csr_matrix(val_set),classes=val_label,k=knn,metric="cosine")
-    print(score)
+    if save:
+        score = prec_at_k(m=csr_matrix(val_set),classes=val_label,k=knn,metric="cosine")
+        print(score)
+    else:
+        #Sampled estimate during search, refined only if too close to the incumbent to tell apart
+        score, half_width, n = sampled_prec_at_k(m=val_set,classes=val_label,k=knn,metric="cosine",incumbent=incumbent)
+        print(score, "+/-", half_width, f"({n} queries)")
     
     if save:
         filename = './models/umap/'+dataset+'.umap'
@@ -55,27 +60,30 @@ def evaluate(logprob_power=5, umap_nns=10, umap_min_dist=0.0, umap_components=16
     return score
 
 
-def optimize(knn):
-    def _evaluate(logprob_power, umap_nns, umap_min_dist, umap_components):
-        logprob_power = round(logprob_power)
-        umap_nns = round(umap_nns)
-        umap_components = round(umap_components)
-        print(f'--- power {logprob_power}, umap_nns {umap_nns}, umap_min_dist {umap_min_dist}, umap_components {umap_components}')
-        return evaluate(logprob_power, umap_nns, umap_min_dist, umap_components, knn, False)
+def _evaluate(logprob_power, umap_nns, umap_min_dist, umap_components, knn, incumbent=None):
+    logprob_power = round(logprob_power)
+    umap_nns = round(umap_nns)
+    umap_components = round(umap_components)
+    print(f'--- power {logprob_power}, umap_nns {umap_nns}, umap_min_dist {umap_min_dist}, umap_components {umap_components}')
+    return evaluate(logprob_power, umap_nns, umap_min_dist, umap_components, knn, False, incumbent)
+
+
+def optimize(knn, continue_log, batch):
+    tmp_log_path = f'./log/logs_{dataset_name}_umap_{knn}.json'
+    if continue_log != tmp_log_path and os.path.exists(tmp_log_path):
+        os.remove(tmp_log_path) #new search
 
-    optimizer = BayesianOptimization(
+    optimizer = BatchBayesianOptimization(
         f=_evaluate,
         pbounds={"logprob_power": (3, 7), "umap_nns": (5,200), "umap_min_dist": (0.0,0.2), "umap_components": (2,32) },
         #pbounds={"logprob_power": (6, 7), "umap_nns": (17,18), "umap_min_dist": (0.18,0.2), "umap_components": (16,17) },
-        #random_state=1234,
-        verbose=2
+        num_workers=batch,
+        history=tmp_log_path,
+        warm_start=[continue_log] if continue_log else None
     )
+    incumbent = lambda: {'knn': knn, 'incumbent': optimizer.max['target'] if optimizer.res else None}
 
-    tmp_log_path = f'./log/logs_{dataset_name}_umap_{knn}.json'
-    logger = JSONLogger(path=tmp_log_path)
-    optimizer.subscribe(Events.OPTIMIZATION_STEP, logger)
-
-    optimizer.maximize(init_points=2, n_iter=3)
+    optimizer.maximize(init_points=2, n_iter=3, extra_kwargs=incumbent)
     print("Final result:", optimizer.max['target'])
     params = optimizer.max['params']
     print(params)
@@ -113,6 +121,9 @@ if __name__ == '__main__':
     sp.load(spm_model)
     vocab, reverse_vocab, logprobs = read_vocab(spm_vocab)
     vectorizer = CountVectorizer(vocabulary=vocab, lowercase=True, token_pattern='[^ ]+')
+    #Documents are counted once, each evaluation only reweights the counts
+    train_counts, train_label = read_n_count_dataset(train_path, vectorizer)
+    val_counts, val_label = read_n_count_dataset(train_path.replace('train', 'val'), vectorizer)
     
     knn=100 #The k for precision at k
-    optimize(knn)
+    optimize(knn, args["--continue_log"], int(args["--batch"]))
@@ -2,8 +2,9 @@ import re
 import json
 import pickle
 import numpy as np
-from scipy.sparse import csr_matrix, vstack
+from scipy.sparse import csr_matrix, vstack, issparse
 from sklearn.metrics import pairwise_distances
+from threadpoolctl import threadpool_limits
 from os.path import exists
 
 
@@ -62,7 +63,8 @@ def wta_vectorized(feature_mat, k):
     return feature_mat
 
 
-def read_n_encode_dataset(path, vectorizer, logprobs, power):
+def read_n_count_dataset(path, vectorizer):
+    """Word piece counts (CSR) and labels of the documents of a dataset."""
     # read
     doc_list, label_list = [], []
     doc = ""
@@ -80,24 +82,60 @@ def read_n_encode_dataset(path, vectorizer, logprobs, power):
             else:
                 doc += l + ' '
 
-    # encode
-    logprobs = np.array([logprob ** power for logprob in logprobs])
+    # count
     X = vectorizer.fit_transform(doc_list)
-    X = csr_matrix(X)
-    X = X.multiply(logprobs)
+    return csr_matrix(X), label_list
+
+
+def weight_counts(X, logprobs, power):
+    """Counts weighted by the log probabilities of the word pieces, to the given power."""
+    logprobs = np.array([logprob ** power for logprob in logprobs])
+    return csr_matrix(X.multiply(logprobs))
+
+
+def read_n_encode_dataset(path, vectorizer, logprobs, power):
+    X, label_list = read_n_count_dataset(path, vectorizer)
+    return weight_counts(X, logprobs, power), label_list
+
 
-    return X, label_list
+class SparseMinMaxScaler:
+    """
+    sklearn's MinMaxScaler for CSR matrices of nonnegative features. Scaling is a
+    multiplication of the columns, which keeps the matrix sparse; the shift (-min *
+    scale) is 0 for every feature that is 0 in some training document, and is only
+    added to the rows made dense by densify (see transform_in_chunks).
+    """
+    def fit(self, X):
+        data_min = X.min(axis=0).toarray().ravel()
+        data_range = X.max(axis=0).toarray().ravel() - data_min
+        data_range[data_range == 0] = 1
+        self.scale_ = 1 / data_range
+        self.min_ = -data_min * self.scale_
+        return self
+
+    def transform(self, X):
+        return csr_matrix(csr_matrix(X).multiply(self.scale_))
+
+    def densify(self, X):
+        return X.toarray() + self.min_
+
+
+def transform_in_chunks(reducer, X, densify=None, chunk_size=20000):
+    """reducer.transform on a CSR matrix, made dense (with densify, if given) one chunk
+    of rows at a time."""
+    densify = densify or (lambda m: m.toarray())
+    return np.vstack([reducer.transform(densify(X[i: i+chunk_size])) for i in range(0, X.shape[0], chunk_size)])
 
 
 def write_as_json(dic, f):
-    output_file = open(f, 'w', encoding='utf-8')
-    json.dump(dic, output_file)
+    with open(f, 'w', encoding='utf-8') as output_file:
+        json.dump(dic, output_file)
 
 
 def append_as_json(dic, f):
-    output_file = open(f, 'a', encoding='utf-8')
-    json.dump(dic, output_file)
-    output_file.write("\n")
+    with open(f, 'a', encoding='utf-8') as output_file:
+        json.dump(dic, output_file)
+        output_file.write("\n")
 
 
 def hash_input_vectorized_(pn_mat, weight_mat, percent_hash):
@@ -115,7 +153,54 @@ def hash_input_vectorized_(pn_mat, weight_mat, percent_hash):
     return hashed_kenyon, kc_use, kc_sorted_ids
 
 
+def wta_dense(kc_mat, k):
+    """WTA on a dense array of KC activations: the CSR matrix of the values of each row
+    that are at least its kth largest one (as wta_vectorized, with k a number of KCs)."""
+    kth_vals = np.partition(kc_mat, -k, axis=1)[:, -k]
+    winners = kc_mat >= kth_vals[:, None]
+    winners &= kc_mat != 0
+    flat = np.flatnonzero(winners)
+    indptr = np.concatenate([[0], np.cumsum(winners.sum(axis=1))])
+    return csr_matrix((kc_mat.ravel()[flat], flat % kc_mat.shape[1], indptr), shape=kc_mat.shape)
+
+
+def dense_projection_blocks(weight_mat, block_bytes=2**26):
+    """The transposed projection (PN x KC) as dense float32 blocks of KCs."""
+    weight_mat = csr_matrix(weight_mat)
+    step = max(1, block_bytes // (4 * weight_mat.shape[1]))
+    for b in range(0, weight_mat.shape[0], step):
+        yield weight_mat[b: b+step].T.toarray().astype(np.float32)
+
+
+def hash_dense_(dataset_mat, weight_mat, percent_hash, chunk_size=2000, n_threads=None):
+    """
+    hash_dataset_ for dense inputs (UMAP or PCA outputs, scaled document vectors...):
+    the KC activations of each chunk of documents are a float32 GEMM with the
+    projection made dense (block by block of KCs for large layers), and the WTA
+    builds the CSR hashes straight from the partitioned rows. n_threads limits the number of BLAS threads
+    (e.g. to 1 when several flies are hashed in parallel threads).
+    """
+    dataset_mat = np.asarray(dataset_mat, dtype=np.float32)
+    m, n = dataset_mat.shape[0], weight_mat.shape[0]
+    k = int(percent_hash * n / 100)
+    cached = 4 * n * dataset_mat.shape[1] <= 2**28  #keep the dense projection if it is small enough
+    blocks = list(dense_projection_blocks(weight_mat)) if cached else None
+    kc_use = np.zeros(n)
+    parts = []
+    with threadpool_limits(limits=n_threads, user_api='blas'):
+        for i in range(0, m, chunk_size):
+            chunk = dataset_mat[i: i+chunk_size]
+            kc_mat = np.hstack([chunk.dot(w) for w in (blocks or dense_projection_blocks(weight_mat))])
+            kc_use += kc_mat.sum(axis=0, dtype=np.float64)
+            parts.append(wta_dense(kc_mat, k))
+    kc_use = kc_use / sum(kc_use)
+    kc_sorted_ids = np.argsort(kc_use)[:-kc_use.shape[0]-1:-1] #Give sorted list from most to least used KCs
+    return vstack(parts, format='csr'), kc_use, kc_sorted_ids
+
+
 def hash_dataset_(dataset_mat, weight_mat, percent_hash):
+    if not issparse(dataset_mat):
+        return hash_dense_(dataset_mat, weight_mat, percent_hash)
     dataset_mat = csr_matrix(dataset_mat)
     hs, kc_use, kc_sorted_ids = hash_input_vectorized_(dataset_mat, weight_mat, percent_hash)
     # hs = (hs > 0).astype(np.int_)
@@ -0,0 +1,260 @@
+"""Asynchronous parallel hyper-parameter search: batch Bayesian optimization
+on top of bayes_opt, and successive halving over data subsamples (ASHA).
+Several points are evaluated at the same time in a pool of workers, and every
+(full-fidelity) observation is appended to a history file in the format of
+bayes_opt's JSONLogger, so that a search can be resumed, or another one
+warm-started, with load_logs.
+"""
+
+import os
+import json
+import time
+import random
+import multiprocessing
+import numpy as np
+from scipy.sparse import issparse
+from datetime import datetime
+from os.path import exists
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from bayes_opt import BayesianOptimization, UtilityFunction
+from bayes_opt.util import load_logs
+
+
+class BatchBayesianOptimization:
+    """
+    Up to num_workers points are evaluated by f(**params) at the same time, in forked
+    processes (or threads if processes is False). Whenever workers are free, new points
+    are proposed with the constant liar strategy: the points still being evaluated are
+    registered with a pessimistic fake target (the worst one observed so far) in a copy
+    of the optimizer, so that each suggestion moves away from the pending ones.
+    f can return the target, or a (target, info) pair; on_result(params, target, info)
+    is then called in the main process as each result comes in.
+    history is the file the observations are appended to; if it exists, the search
+    resumes from it. warm_start is a list of logs of other searches to start from.
+    """
+    def __init__(self, f, pbounds, num_workers, history=None, warm_start=None, on_result=None,
+                 random_state=None, kappa=2.576, xi=0.0, processes=True):
+        self.f = f
+        self.pbounds = pbounds
+        self.num_workers = num_workers
+        self.history = history
+        self.on_result = on_result
+        self.processes = processes
+        self.random_state = np.random.RandomState(random_state)
+        self.optimizer = BayesianOptimization(f=None, pbounds=pbounds, random_state=self.random_state, verbose=0)
+        self.utility = UtilityFunction(kind='ucb', kappa=kappa, xi=xi)
+        self.start_time = self.last_time = time.time()
+
+        logs = [log for log in (warm_start or []) + [history] if log and exists(log)]
+        if logs:
+            load_logs(self.optimizer, logs=logs)
+            print("Optimizer is now aware of {} points.".format(len(self.optimizer.space)))
+        if history:
+            open(history, 'a').close()
+
+    @property
+    def max(self):
+        return self.optimizer.max
+
+    @property
+    def res(self):
+        return self.optimizer.res
+
+    def _random_point(self):
+        return self.optimizer.space.array_to_params(self.optimizer.space.random_sample())
+
+    def suggest(self, pending, n):
+        """n new points to evaluate, given the list of points being evaluated."""
+        if len(self.optimizer.space) == 0:
+            return [self._random_point() for _ in range(n)]
+        liar = BayesianOptimization(f=None, pbounds=self.pbounds, random_state=self.random_state, verbose=0)
+        for params, target in zip(self.optimizer.space.params, self.optimizer.space.target):
+            liar.register(params, target)
+        lie = np.min(self.optimizer.space.target)
+        for params in pending:
+            _register_new(liar, params, lie)
+        points = []
+        for _ in range(n):
+            params = liar.suggest(self.utility)
+            if not _register_new(liar, params, lie): #already pending, explore instead
+                params = self._random_point()
+                _register_new(liar, params, lie)
+            points.append(params)
+        return points
+
+    def register(self, params, result):
+        target, info = result if isinstance(result, tuple) else (result, None)
+        if not _register_new(self.optimizer, params, target):
+            return
+        if self.history:
+            self.last_time = _append_history(self.history, params, target, self.start_time, self.last_time)
+        if self.on_result is not None:
+            self.on_result(params, target, info)
+
+    def maximize(self, init_points=5, n_iter=25, extra_kwargs=None, stop_fn=None):
+        """
+        Evaluate init_points random points, then n_iter suggested ones. extra_kwargs(),
+        if given, returns more keyword arguments for f when a point is dispatched (e.g.
+        the best target so far). Once stop_fn() is true, no new point is dispatched.
+        Return the best observation.
+        """
+        pending = {}
+        with _executor(self.num_workers, self.processes) as executor:
+            while True:
+                free = self.num_workers - len(pending)
+                if free and (init_points or n_iter) and not (stop_fn is not None and stop_fn()):
+                    num_random = min(free, init_points)
+                    num_suggested = min(free - num_random, n_iter)
+                    init_points, n_iter = init_points - num_random, n_iter - num_suggested
+                    points = [self._random_point() for _ in range(num_random)]
+                    if num_suggested:
+                        points += self.suggest(list(pending.values()), num_suggested)
+                    for params in points:
+                        kwargs = extra_kwargs() if extra_kwargs is not None else {}
+                        pending[executor.submit(self.f, **params, **kwargs)] = params
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.register(pending.pop(future), future.result())
+        return self.max
+
+
+class AsyncSuccessiveHalving:
+    """
+    Asynchronous successive halving (ASHA): configurations drawn at random in pbounds
+    are first evaluated by f(fraction=min_fraction, **params), i.e. on a small subsample
+    of the data. Whenever a worker is free, a configuration in the top 1/eta of its rung
+    that has not been promoted yet goes up to the next rung, evaluated on eta times more
+    data, up to the full data; if there is none, a new configuration is started. Poor
+    configurations are thus dropped after a cheap evaluation, without waiting for a
+    rung to fill up.
+    f and on_result are as for BatchBayesianOptimization, except that on_result also
+    gets the fraction. Only full-data results go to history, so that a Bayesian
+    optimization can be warm-started from it.
+    """
+    def __init__(self, f, pbounds, num_workers, min_fraction=1/9, eta=3, history=None, on_result=None,
+                 random_state=None, processes=True):
+        self.f = f
+        self.pbounds = pbounds
+        self.num_workers = num_workers
+        self.eta = eta
+        self.history = history
+        self.on_result = on_result
+        self.processes = processes
+        self.random_state = np.random.RandomState(random_state)
+        self.fractions = [min_fraction * eta ** k for k in range(int(np.ceil(np.log(1 / min_fraction) / np.log(eta) - 1e-9)))]
+        self.fractions.append(1.0)
+        self.configs = []
+        self.rungs = [{} for _ in self.fractions] #config index -> target
+        self.promoted = [set() for _ in self.fractions]
+        self.res = []
+        self.start_time = self.last_time = time.time()
+        if history:
+            open(history, 'a').close()
+
+    @property
+    def max(self):
+        """Best observation at the highest fidelity reached."""
+        for k in reversed(range(len(self.fractions))):
+            if self.rungs[k]:
+                best = max(self.rungs[k], key=self.rungs[k].get)
+                return {'target': self.rungs[k][best], 'params': self.configs[best], 'fraction': self.fractions[k]}
+        return {}
+
+    def _promotion(self):
+        """A (configuration, rung) to evaluate next, from the top rungs down, or None."""
+        for k in reversed(range(len(self.fractions) - 1)):
+            ranked = sorted(self.rungs[k], key=self.rungs[k].get, reverse=True)
+            for c in ranked[:len(ranked) // self.eta]:
+                if c not in self.promoted[k]:
+                    self.promoted[k].add(c)
+                    return c, k + 1
+        return None
+
+    def _new_config(self):
+        self.configs.append({key: self.random_state.uniform(low, high)
+                             for key, (low, high) in sorted(self.pbounds.items())})
+        return len(self.configs) - 1, 0
+
+    def register(self, config, rung, result):
+        target, info = result if isinstance(result, tuple) else (result, None)
+        params, fraction = self.configs[config], self.fractions[rung]
+        self.rungs[rung][config] = target
+        self.res.append({'target': target, 'params': params, 'fraction': fraction})
+        if self.history and rung == len(self.fractions) - 1:
+            self.last_time = _append_history(self.history, params, target, self.start_time, self.last_time)
+        if self.on_result is not None:
+            self.on_result(params, target, info, fraction)
+
+    def maximize(self, num_configs=100, extra_kwargs=None, stop_fn=None):
+        """
+        Start num_configs configurations, and run the promotions they earn. extra_kwargs
+        and stop_fn are as for BatchBayesianOptimization. Return the best observation.
+        """
+        pending = {}
+        with _executor(self.num_workers, self.processes) as executor:
+            while True:
+                while len(pending) < self.num_workers and not (stop_fn is not None and stop_fn()):
+                    job = self._promotion()
+                    if job is None and len(self.configs) < num_configs:
+                        job = self._new_config()
+                    if job is None:
+                        break
+                    config, rung = job
+                    kwargs = extra_kwargs() if extra_kwargs is not None else {}
+                    future = executor.submit(self.f, fraction=self.fractions[rung], **self.configs[config], **kwargs)
+                    pending[future] = job
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.register(*pending.pop(future), future.result())
+        return self.max
+
+
+def subsample(data, labels, fraction, random_state=0):
+    """The rows of a fixed random permutation of data (and their labels) that make up the
+    first fraction of it. Subsamples of growing fractions are nested, and the same for
+    all configurations, so that their scores on a fraction are comparable."""
+    if fraction >= 1:
+        return data, labels
+    order = np.random.RandomState(random_state).permutation(data.shape[0])
+    idx = np.sort(order[:max(1, int(fraction * data.shape[0]))])
+    labels = labels[idx] if isinstance(labels, np.ndarray) else [labels[i] for i in idx]
+    return (data.tocsr() if issparse(data) else data)[idx], labels
+
+
+def _executor(num_workers, processes):
+    if processes:
+        return ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('fork'),
+                                   initializer=_reseed)
+    return ThreadPoolExecutor(max_workers=num_workers)
+
+
+def _append_history(path, params, target, start_time, last_time):
+    """Append an observation to path, as bayes_opt's JSONLogger does, and return its time."""
+    now = time.time()
+    with open(path, 'a') as f:
+        f.write(json.dumps({'target': float(target), 'params': {k: float(v) for k, v in params.items()},
+                            'datetime': {'datetime': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                         'elapsed': now - start_time, 'delta': now - last_time}}) + "\n")
+    return now
+
+
+def _reseed():
+    """Forked workers inherit the random state of the parent: without reseeding,
+    they would all draw the same projections."""
+    seed = int.from_bytes(os.urandom(4), 'little')
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def _register_new(optimizer, params, target):
+    """Register an observation, unless the point is already known."""
+    try:
+        optimizer.register(params, target)
+        return True
+    except KeyError:
+        return False
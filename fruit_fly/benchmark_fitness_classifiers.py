@@ -0,0 +1,112 @@
+"""Compare the cheap fitness classifiers with liblinear on random flies
+Usage:
+  benchmark_fitness_classifiers.py --train_path=<filename> [--num_flies=<n>] [--num_mutants=<n>]
+  benchmark_fitness_classifiers.py (-h | --help)
+  benchmark_fitness_classifiers.py --version
+Options:
+  -h --help                       Show this screen.
+  --version                       Show version.
+  --train_path=<filename>         Name of file to train (processed by sentencepiece)
+  --num_flies=<n>                 Number of random flies to rank [default: 30].
+  --num_mutants=<n>               Number of mutated children used to test warm-starting [default: 10].
+"""
+
+import time
+import numpy as np
+import sentencepiece as spm
+from docopt import docopt
+from scipy.stats import spearmanr
+from scipy.sparse import lil_matrix
+from sklearn.feature_extraction.text import CountVectorizer
+
+from hyperparam_search import read_n_encode_dataset
+from classify import train_model, warm_start_coefs, update_warm_start, FITNESS_CLASSIFIERS
+from hash import read_vocab
+from utils import hash_dataset_
+
+MIN_WTA, MAX_WTA = 1, 30
+MIN_KC, MAX_KC = 1000, 10000
+MIN_PROJ, MAX_PROJ = 5, 20
+top_word = 700
+C = 100
+num_iter = 2000
+
+
+def random_fly():
+    kc_size = np.random.randint(low=MIN_KC, high=MAX_KC)
+    wta = np.random.uniform(low=MIN_WTA, high=MAX_WTA)
+    projection = lil_matrix((kc_size, PN_SIZE))
+    for i in range(kc_size):
+        projection[i, np.random.randint(PN_SIZE, size=np.random.randint(low=MIN_PROJ, high=MAX_PROJ))] = 1
+    return projection, wta
+
+
+def mutate_rows(projection, mutate_prob_proj=0.04):
+    projection = lil_matrix(projection, copy=True)
+    row_mutate = np.random.choice(projection.shape[0], int(projection.shape[0] * mutate_prob_proj))
+    for i in row_mutate:
+        projection[i] = 0
+        projection[i, np.random.randint(0, PN_SIZE, np.random.randint(low=MIN_PROJ, high=MAX_PROJ))] = 1
+    return projection, row_mutate
+
+
+def hash_fly(projection, wta):
+    hash_train = hash_dataset_(dataset_mat=train_set, weight_mat=projection, percent_hash=wta, top_words=top_word)
+    hash_val = hash_dataset_(dataset_mat=val_set, weight_mat=projection, percent_hash=wta, top_words=top_word)
+    return hash_train, hash_val
+
+
+def fit(hashes, classifier, init=None):
+    start_time = time.time()
+    score, lm = train_model(m_train=hashes[0], classes_train=train_label, m_val=hashes[1], classes_val=val_label,
+                            C=C, num_iter=num_iter, classifier=classifier, init=init)
+    return score, lm, time.time() - start_time
+
+
+def rank_flies(num_flies):
+    """Score the same random flies with every classifier, and compare with the liblinear ranking."""
+    flies = [random_fly() for _ in range(num_flies)]
+    hashes = [hash_fly(*fly) for fly in flies]
+    scores = {}
+    for classifier in FITNESS_CLASSIFIERS:
+        results = [fit(h, classifier) for h in hashes]
+        scores[classifier] = [r[0] for r in results]
+        rho = spearmanr(scores['liblinear'], scores[classifier]).correlation
+        print(f"{classifier:>10}: mean acc {np.mean(scores[classifier]):.4f}, "
+              f"mean fit time {np.mean([r[2] for r in results]):.3f}s, spearman vs liblinear {rho:.3f}")
+    return flies, hashes
+
+
+def warm_start(flies, hashes, num_mutants):
+    """Fit mutated children from scratch and warm-started from their parent's coefficients."""
+    for classifier in FITNESS_CLASSIFIERS:
+        if warm_start_coefs(fit(hashes[0], classifier)[1], classifier) is None:
+            continue
+        cold, warm = [], []
+        for (projection, wta), parent_hashes in list(zip(flies, hashes))[:num_mutants]:
+            parent_coefs = warm_start_coefs(fit(parent_hashes, classifier)[1], classifier)
+            child_projection, row_mutate = mutate_rows(projection)
+            child_hashes = hash_fly(child_projection, wta)
+            cold.append(fit(child_hashes, classifier))
+            init = update_warm_start(parent_coefs, row_mutate, child_projection.shape[0])
+            warm.append(fit(child_hashes, classifier, init=init))
+        print(f"{classifier:>10}: cold start acc {np.mean([r[0] for r in cold]):.4f} in {np.mean([r[2] for r in cold]):.3f}s, "
+              f"warm start acc {np.mean([r[0] for r in warm]):.4f} in {np.mean([r[2] for r in warm]):.3f}s")
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='Benchmark of fitness classifiers, ver 0.1')
+    train_path = args['--train_path']
+    sp = spm.SentencePieceProcessor()
+    sp.load('../spmcc.model')
+    vocab, reverse_vocab, logprobs = read_vocab()
+    vectorizer = CountVectorizer(vocabulary=vocab, lowercase=False, token_pattern='[^ ]+')
+    PN_SIZE = len(vocab)
+
+    train_set, train_label = read_n_encode_dataset(train_path, vectorizer, logprobs)
+    val_set, val_label = read_n_encode_dataset(train_path.replace('train', 'val'), vectorizer, logprobs)
+
+    print("Ranking random flies...")
+    flies, hashes = rank_flies(int(args['--num_flies']))
+    print("Warm-starting mutated children...")
+    warm_start(flies, hashes, int(args['--num_mutants']))
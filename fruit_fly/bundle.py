@@ -0,0 +1,105 @@
+"""Self-contained deployment bundle of a fly: one file holding the sentencepiece
+model, the vocabulary with its precomputed logprob weights, the KC x PN projection
+(CSR) and the hashing parameters. Arrays are stored raw and aligned, so that the
+bundle is loaded by memory-mapping it, without parsing or copying the large parts,
+and processes hashing with the same bundle share its pages. Every section carries
+a sha256 checksum, checked on load.
+
+Layout: 8 bytes of magic, the length of the JSON header (8 bytes, little endian),
+the header, then the sections, each at an offset multiple of 64.
+"""
+
+import json
+import mmap
+import hashlib
+import numpy as np
+import sentencepiece as spm
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import CountVectorizer
+
+MAGIC = b'FLYBNDL1'
+ALIGN = 64
+
+
+def save_bundle(path, projection, params, spm_model, vocab, logprobs):
+    """
+    Write a bundle. projection is the KC x PN matrix, params a dict of JSON-serializable
+    hashing parameters (it must have 'wta' and 'top_words'), spm_model the bytes of the
+    sentencepiece model, vocab the list of pieces in the order of the PN layer, and
+    logprobs their weights.
+    """
+    projection = csr_matrix(projection).sorted_indices()
+    sections = {
+        'spm_model': np.frombuffer(spm_model, dtype=np.uint8),
+        'vocab': np.frombuffer('\n'.join(vocab).encode('utf-8'), dtype=np.uint8),
+        'logprobs': np.asarray(logprobs, dtype=np.float64),
+        'projection.data': projection.data,
+        'projection.indices': projection.indices,
+        'projection.indptr': projection.indptr,
+    }
+    params = dict(params, kc_size=projection.shape[0], pn_size=projection.shape[1])
+    header = {'params': params, 'sections': {}}
+    offset = 0
+    for name, array in sections.items():
+        sections[name] = array = np.ascontiguousarray(array)
+        header['sections'][name] = {'offset': offset, 'nbytes': array.nbytes, 'dtype': array.dtype.str,
+                                    'sha256': hashlib.sha256(array).hexdigest()}
+        offset += _aligned(array.nbytes)
+    header = json.dumps(header).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(MAGIC + len(header).to_bytes(8, 'little') + header)
+        for array in sections.values():
+            f.write(bytes(_aligned(f.tell()) - f.tell()))
+            f.write(array.tobytes())
+
+
+def _aligned(size):
+    return -(-size // ALIGN) * ALIGN
+
+
+class FlyBundle:
+    """
+    A loaded bundle: the hashing parameters as attributes (kc_size, wta, top_words...),
+    projection (read-only CSR on the mapped file), logprobs, vocab and reverse_vocab
+    (as given by hash.read_vocab) and sp, the sentencepiece processor.
+    """
+    def __init__(self, path, verify=True):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a fly bundle')
+        header_size = int.from_bytes(self._mmap[len(MAGIC): len(MAGIC) + 8], 'little')
+        header = json.loads(self._mmap[len(MAGIC) + 8: len(MAGIC) + 8 + header_size])
+        start = _aligned(len(MAGIC) + 8 + header_size)
+        arrays = {}
+        for name, s in header['sections'].items():
+            if start + s['offset'] + s['nbytes'] > len(self._mmap):
+                raise ValueError(f'{path} is truncated')
+            dtype = np.dtype(s['dtype'])
+            arrays[name] = np.frombuffer(self._mmap, dtype=dtype, count=s['nbytes'] // dtype.itemsize,
+                                         offset=start + s['offset'])
+            if verify and hashlib.sha256(arrays[name]).hexdigest() != s['sha256']:
+                raise ValueError(f'{path} is corrupted (checksum of {name})')
+        self.params = header['params']
+        vars(self).update(self.params)
+        self.projection = csr_matrix((arrays['projection.data'], arrays['projection.indices'],
+                                      arrays['projection.indptr']), shape=(self.kc_size, self.pn_size), copy=False)
+        self.projection.has_sorted_indices = True
+        self.logprobs = arrays['logprobs']
+        pieces = arrays['vocab'].tobytes().decode('utf-8').split('\n')
+        self.vocab = {wp: i for i, wp in enumerate(pieces)}
+        self.reverse_vocab = dict(enumerate(pieces))
+        self.sp = spm.SentencePieceProcessor()
+        self.sp.LoadFromSerializedProto(arrays['spm_model'].tobytes())
+
+    def encode(self, docs):
+        """Weighted PN activations (CSR) of a list of raw documents."""
+        vectorizer = CountVectorizer(vocabulary=self.vocab, lowercase=False, token_pattern='[^ ]+')
+        X = vectorizer.fit_transform([" ".join(self.sp.encode_as_pieces(doc)) for doc in docs])
+        return csr_matrix(X).multiply(self.logprobs).tocsr()
+
+
+def load_bundle(path, verify=True):
+    """Memory-map a bundle written by save_bundle. verify checks the sha256 of every
+    section, which reads the whole file once."""
+    return FlyBundle(path, verify)
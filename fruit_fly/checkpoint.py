@@ -0,0 +1,141 @@
+"""Snapshots of the full state of the genetic algorithm (population, fitness,
+random state and generation counter), so that an evolution run can be resumed.
+A snapshot is a single compressed .npz file: the genomes of all flies are stored
+together (see genome.py), the projections of flies without a genome are concatenated
+into flat CSR arrays, and the other attributes go into one array each.
+"""
+
+import os
+import threading
+import numpy as np
+import scipy.sparse
+from scipy.sparse import csr_matrix, issparse
+
+from genome import Genome, dump_genomes, load_genomes
+
+
+def _pack_population(population, prefix):
+    arrays = {prefix + 'size': len(population)}
+    states = [fly.__getstate__() for fly in population] #without what is regenerated from the genome
+    attrs = list(states[0])
+    arrays[prefix + 'attrs'] = np.array(attrs)
+    for attr in attrs:
+        values = [state[attr] for state in states]
+        key = prefix + attr
+        if isinstance(values[0], Genome):
+            arrays[key + '.genomes'] = dump_genomes(values)
+        elif issparse(values[0]):
+            mats = [csr_matrix(v) for v in values]
+            arrays[key + '.format'] = values[0].format
+            arrays[key + '.shape'] = np.array([m.shape for m in mats])
+            arrays[key + '.data'] = np.concatenate([m.data for m in mats])
+            arrays[key + '.indices'] = np.concatenate([m.indices for m in mats])
+            arrays[key + '.indptr'] = np.concatenate([m.indptr for m in mats])
+        elif attr == 'coefs': #warm-start weights, one (coef, intercept) or None per dataset
+            arrays[key + '.len'] = np.array([len(c) for c in values])
+            for i, coefs in enumerate(values):
+                for d, c in enumerate(coefs):
+                    if c is not None:
+                        arrays[f'{key}.{i}.{d}.coef'], arrays[f'{key}.{i}.{d}.intercept'] = c
+        else:
+            arrays[key] = np.array(values)
+    return arrays
+
+
+def _unpack_population(arrays, prefix, fly_class):
+    size = int(arrays[prefix + 'size'])
+    population = [fly_class.__new__(fly_class) for _ in range(size)] #no __init__, which draws random numbers
+    states = [{} for _ in range(size)]
+    for attr in arrays[prefix + 'attrs']:
+        attr = str(attr)
+        key = prefix + attr
+        if key + '.genomes' in arrays:
+            for state, genome in zip(states, load_genomes(arrays[key + '.genomes'])):
+                state[attr] = genome
+        elif key + '.shape' in arrays:
+            shapes = arrays[key + '.shape']
+            to_format = getattr(scipy.sparse, str(arrays[key + '.format']) + '_matrix')
+            data, indices, indptr = arrays[key + '.data'], arrays[key + '.indices'], arrays[key + '.indptr']
+            start, ptr = 0, 0
+            for state, shape in zip(states, shapes):
+                rows = indptr[ptr: ptr + shape[0] + 1]
+                nnz = rows[-1]
+                mat = csr_matrix((data[start: start + nnz], indices[start: start + nnz], rows), shape=tuple(shape))
+                state[attr] = to_format(mat)
+                start, ptr = start + nnz, ptr + shape[0] + 1
+        elif key + '.len' in arrays:
+            for i, (state, n) in enumerate(zip(states, arrays[key + '.len'])):
+                state[attr] = [(arrays[f'{key}.{i}.{d}.coef'], arrays[f'{key}.{i}.{d}.intercept'])
+                               if f'{key}.{i}.{d}.coef' in arrays else None for d in range(n)]
+        else:
+            for state, value in zip(states, arrays[key]):
+                state[attr] = value.tolist()
+    for fly, state in zip(population, states):
+        if hasattr(fly, '__setstate__'): #e.g. regenerates the projections from the genome
+            fly.__setstate__(state)
+        else:
+            vars(fly).update(state)
+    return population
+
+
+class Checkpointer:
+    """
+    Write GA snapshots to path without stalling the evolution: the population is
+    copied into flat arrays in the calling thread, then compressed and written by a
+    background thread. The snapshot goes to a temporary file that atomically replaces
+    the previous one, so a crash never leaves a half-written checkpoint behind.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.thread = None
+
+    def save(self, population, generation, other_flies=None, **extra):
+        """Snapshot the population after generation, together with the random state.
+        other_flies maps names to lists of flies to keep (e.g. the best fly so far),
+        extra holds the other values needed to resume (log file, running stats...)."""
+        arrays = _snapshot(population, generation, other_flies, extra)
+        self.wait() #one write at a time
+        self.thread = threading.Thread(target=self._write, args=(arrays,))
+        self.thread.start()
+
+    def _write(self, arrays):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def _snapshot(population, generation, other_flies, extra):
+    rng_name, rng_keys, rng_pos, rng_has_gauss, rng_gauss = np.random.get_state()
+    arrays = {'generation': generation, 'rng_name': rng_name, 'rng_keys': rng_keys, 'rng_pos': rng_pos,
+              'rng_has_gauss': rng_has_gauss, 'rng_gauss': rng_gauss,
+              'other_flies': np.array(list(other_flies or {}), dtype=str), 'extra': np.array(list(extra), dtype=str)}
+    arrays.update(_pack_population(population, 'pop.'))
+    for name, flies in (other_flies or {}).items():
+        arrays.update(_pack_population(flies, name + '.'))
+    for name, value in extra.items():
+        arrays['extra.' + name] = np.asarray(value)
+    return arrays
+
+
+def load_checkpoint(path, fly_class):
+    """
+    Restore a snapshot written by Checkpointer, including the global numpy random
+    state. Return the generation it was taken after, the population, the other
+    flies and the extra values, in the types they were saved with.
+    """
+    with np.load(path) as npz:
+        arrays = dict(npz)
+    np.random.set_state((str(arrays['rng_name']), arrays['rng_keys'], int(arrays['rng_pos']),
+                         int(arrays['rng_has_gauss']), float(arrays['rng_gauss'])))
+    population = _unpack_population(arrays, 'pop.', fly_class)
+    other_flies = {str(name): _unpack_population(arrays, name + '.', fly_class) for name in arrays['other_flies']}
+    extra = {str(name): arrays['extra.' + name].tolist() for name in arrays['extra']}
+    return int(arrays['generation']), population, other_flies, extra
@@ -1,6 +1,6 @@
 """Fruit fly classification of wikipedia meta-categories
 Usage:
-  classify_wiki.py --flypath=<foldername> --C=<n> --num_iter=<n>
+  classify_wiki.py --flypath=<foldername> --C=<n> --num_iter=<n> [--save=<path>]
   classify_wiki.py (-h | --help)
   classify_wiki.py --version
 Options:
@@ -9,6 +9,7 @@ Options:
   --flypath=<foldername>          Name of folder where best performing fly is located
   --C=<n>                         C parameter
   --num_iter=<n>                  Number of iterations
+  --save=<path>                   Save the classifier in bit-packed form, to label pods with hash_pod.py (optional)
 """
 
 from evolve_flies import Fly
@@ -20,6 +21,8 @@ from hash import read_vocab
 from utils import hash_dataset_
 from docopt import docopt
 from classify import train_model
+from packed_classifier import PackedLinearClassifier, pack_hashes
+import time
 
 
 def evaluate(train_set_list, projection, wta, top_word):
@@ -28,11 +31,18 @@ def evaluate(train_set_list, projection, wta, top_word):
     hash_val = hash_dataset_(dataset_mat=val_set_list, weight_mat=projection,
                              percent_hash=wta, top_words=top_word)
     print("Running classification...")
-    val_score, _ = train_model(m_train=hash_train, classes_train=train_label_list,
-                               m_val=hash_val, classes_val=val_label_list,
-                               C=C, num_iter=num_iter)
+    val_score, lm = train_model(m_train=hash_train, classes_train=train_label_list,
+                                m_val=hash_val, classes_val=val_label_list,
+                                C=C, num_iter=num_iter)
     print(val_score)
 
+    packed_lm = PackedLinearClassifier.from_sklearn(lm)
+    packed_val = pack_hashes(hash_val)
+    start_time = time.time()
+    packed_score = packed_lm.score(packed_val, val_label_list)
+    print("Bit-packed classifier:", packed_score, "-", int(packed_val.shape[0] / (time.time() - start_time)), "docs/s")
+    return packed_lm
+
 
 if __name__ == '__main__':
     args = docopt(__doc__, version='Ideal Words 0.1')
@@ -55,7 +65,10 @@ if __name__ == '__main__':
     train_set_list, train_label_list = read_n_encode_dataset('../wikipedia_categories/wiki_cats/wiki_cats_train.sp', vectorizer, logprobs)
     val_set_list, val_label_list = read_n_encode_dataset('../wikipedia_categories/wiki_cats/wiki_cats_val.sp', vectorizer, logprobs)
 
-    evaluate(train_set_list, projection, wta, top_word)
+    packed_lm = evaluate(train_set_list, projection, wta, top_word)
+    if args["--save"]:
+        with open(args["--save"], 'wb') as f:
+            pickle.dump(packed_lm, f)
 
 
 
@@ -1,20 +1,30 @@
 """Genetic Algorithm for fruit-fly projection
 Usage:
-  evolve_growing_flies.py
+  evolve_growing_flies.py [--islands=<n>] [--migration=<n>] [--steady_state] [--select_once] [--checkpoint=<path> [--checkpoint_every=<n>] [--resume]] [--cpu_budget=<s>] [--wall_budget=<s>]
   evolve_growing_flies.py (-h | --help)
   evolve_growing_flies.py --version
 Options:
   -h --help                       Show this screen.
   --version                       Show version.
+  --islands=<n>                   Number of sub-populations evolved in parallel processes [default: 1].
+  --migration=<n>                 With islands, number of generations between migrations of the best flies [default: 5].
+  --steady_state                  Breed and evaluate one child at a time as soon as a thread is free, instead of generation by generation.
+  --select_once                   Select the parents once per generation rather than for every pair (faster on large populations).
+  --checkpoint=<path>             Save the full state of the GA in this file (.npz) as it evolves.
+  --checkpoint_every=<n>          Number of generations between checkpoints [default: 1].
+  --resume                        Continue from the checkpoint, if it exists.
+  --cpu_budget=<s>                Stop once fitness evaluations have used this many CPU-seconds.
+  --wall_budget=<s>               Stop once the run has lasted this many seconds.
 """
 
+import os
 import pickle
 import numpy as np
 import joblib
 import multiprocessing
 import sentencepiece as spm
 from sklearn.feature_extraction.text import CountVectorizer
-from scipy.sparse import hstack, vstack, lil_matrix, coo_matrix
+from scipy.sparse import coo_matrix
 from docopt import docopt
 import time
 from datetime import datetime
@@ -23,22 +33,41 @@ from copy import deepcopy
 from hyperparam_search import read_n_encode_dataset
 from classify import train_model
 from hash import read_vocab
-from utils import hash_dataset_, append_as_json, get_stats
+from utils import hash_dataset_, append_as_json, get_stats, select_parents, MetricsSink
+from parallel_ga import run_islands, steady_state
+from checkpoint import Checkpointer, load_checkpoint
+from genome import Genome
+from timer import ComputeMeter
 
 class Fly:
     def __init__(self):
         self.kc_size = np.random.randint(low=MIN_KC, high=MAX_KC)
         self.wta = np.random.uniform(low=MIN_WTA, high=MAX_WTA)
-        weight_mat = np.zeros((self.kc_size, PN_SIZE))
-        for i in range(self.kc_size):
-            num_proj = np.random.randint(low=MIN_PROJ, high=MAX_PROJ)
-            for j in np.random.randint(PN_SIZE, size=num_proj):
-                weight_mat[i, j] = 1
-        self.projection = lil_matrix(weight_mat)
+        self.genome, self.projection = Genome.random(self.kc_size, PN_SIZE, MIN_PROJ, MAX_PROJ)
         self.val_scores = [0, 0, 0]
         self.kc_score = 1 / np.log10(int(self.kc_size * self.wta / 100))
         self.is_evaluated = False
 
+    def __getstate__(self):
+        # pickled flies only carry their genome, the projection matrix is regenerated from it
+        state = dict(vars(self))
+        del state['projection']
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        if 'genome' not in state:  #saved before flies had a genome: the matrix becomes its root
+            self.genome = Genome.snapshot(self.projection)
+            del self.projection  #regenerated as CSR
+        if not hasattr(self, 'projection'):
+            self.projection = self.genome.projections()
+
+    def __deepcopy__(self, memo):
+        # copies made while breeding keep their matrix (the genome itself is shared)
+        fly = Fly.__new__(Fly)
+        vars(fly).update(deepcopy(vars(self), memo))
+        return fly
+
     def get_fitness(self):
         if not self.is_evaluated:
             return 0
@@ -70,6 +99,13 @@ def init_pop(pop_size: int):
     return population
 
 
+def evaluate_measured(fly: Fly):
+    """Evaluate a fly, charging the CPU and wall time it takes to the compute meter of the run."""
+    with compute.measure() as cost:
+        result = fly.evaluate()
+    return result, cost
+
+
 def eval_pop(population: list):
     """
     Calculate the fitness of every chromosome
@@ -77,42 +113,13 @@ def eval_pop(population: list):
     """
     def _eval_individual(fly: Fly):
         if not fly.is_evaluated:
-            print("SCORE, TIME FOR EVAL:",fly.evaluate())
+            print("SCORE, TIME FOR EVAL, COMPUTE:",*evaluate_measured(fly))
         else:
             pass
     joblib.Parallel(n_jobs=max_thread, prefer="threads")(
         joblib.delayed(_eval_individual)(fly) for fly in population)
 
 
-def select_elite_tournament(fitness_list: list, select_percent: float):
-    """
-    Tournament + elitism selection.
-    Return the index of genes that has been selected.
-    """
-    selected = set()
-    num_select = round(select_percent * len(fitness_list)) - 2
-    if num_select < 2:
-        num_select = 2  # mother, father
-
-    fitness2idx = {k: v for v, k in enumerate(fitness_list)}
-    elite_chroms = 2
-    if num_select < elite_chroms:
-        elite_chroms = num_select
-    elites = sorted(fitness_list, reverse=True)[:elite_chroms]
-    for eli in elites:
-        selected.add(fitness2idx[eli])
-
-    while len(selected) < num_select:
-        first_cand, second_cand = np.random.choice(range(len(fitness_list)), 2)
-        if fitness_list[first_cand] > fitness_list[second_cand]:
-            if first_cand not in selected:
-                selected.add(first_cand)
-        else:
-            if second_cand not in selected:
-                selected.add(second_cand)
-    return list(selected)
-
-
 def crossover(parent1: Fly, parent2: Fly):
     """
     Crossover two flies
@@ -131,19 +138,17 @@ def crossover(parent1: Fly, parent2: Fly):
     # first, crossover projection matrices
     # truncate
     if parent1.kc_size > parent2.kc_size:
-        random_indices = np.random.choice(parent1.kc_size, size=int(parent2.kc_size), replace=False)
-        child1.projection = parent1.projection[random_indices, :]
+        child1.genome, child1.projection = parent1.genome.select(parent1.projection, int(parent2.kc_size))
         child1.kc_size = child1.projection.shape[0]
     else:
-        random_indices = np.random.choice(parent2.kc_size, size=int(parent1.kc_size), replace=False)
-        child2.projection = parent2.projection[random_indices, :]
+        child2.genome, child2.projection = parent2.genome.select(parent2.projection, int(parent1.kc_size))
         child2.kc_size = child2.projection.shape[0]
     # swap
     col_idx = int(child1.projection.shape[1]/2)
-    new_proj_1 = hstack([child1.projection[:, :col_idx], child2.projection[:, col_idx:]])
-    new_proj_2 = hstack([child1.projection[:, col_idx:], child2.projection[:, :col_idx]])
-    
-    child1.projection, child2.projection = lil_matrix(new_proj_1), lil_matrix(new_proj_2)
+    genome_1, new_proj_1 = child1.genome.cross(child1.projection, child2.genome, child2.projection, col_idx)
+    genome_2, new_proj_2 = child2.genome.cross(child2.projection, child1.genome, child1.projection, col_idx, swap=True)
+    child1.genome, child1.projection = genome_1, new_proj_1
+    child2.genome, child2.projection = genome_2, new_proj_2
 
     # then, crossover wta
     wta_low, wta_high = sorted([child1.wta, child2.wta])
@@ -171,24 +176,13 @@ def mutate(individual: Fly, mutate_prob_proj: float, mutate_scale_wta: float):
     mutated_indiv.is_evaluated = False
 
     # first, mutate the projection
-    row_mutate = np.random.choice(individual.kc_size, int(individual.kc_size * mutate_prob_proj))
-    for i in row_mutate:
-        new_row = np.zeros(PN_SIZE)
-        num_proj = np.random.randint(low=MIN_PROJ, high=MAX_PROJ)
-        new_row[np.random.randint(0, PN_SIZE, num_proj)] = 1
-        mutated_indiv.projection[i] = new_row
-        mutated_indiv.projection = lil_matrix(mutated_indiv.projection)
+    mutated_indiv.genome, mutated_indiv.projection, row_mutate = individual.genome.mutate(
+        individual.projection, int(individual.kc_size * mutate_prob_proj), MIN_PROJ, MAX_PROJ)
         
     # add a few new rows
     num_new_row = np.random.randint(low=10, high=30)
-    new_mat = np.zeros((num_new_row, PN_SIZE))
-    for i in range(num_new_row):
-        num_proj = np.random.randint(low=MIN_PROJ, high=MAX_PROJ)
-        for j in np.random.randint(PN_SIZE, size=num_proj):
-            new_mat[i, j] = 1
-    # concat the old part with the new part
-    mutated_indiv.projection = vstack([mutated_indiv.projection, lil_matrix(new_mat)])
-    mutated_indiv.projection = lil_matrix(mutated_indiv.projection)
+    mutated_indiv.genome, mutated_indiv.projection = mutated_indiv.genome.grow(
+        mutated_indiv.projection, num_new_row, MIN_PROJ, MAX_PROJ)
 
     # then, mutate the wta
     new_wta = np.random.normal(loc=individual.wta, scale=mutate_scale_wta)
@@ -201,16 +195,11 @@ def mutate(individual: Fly, mutate_prob_proj: float, mutate_scale_wta: float):
     return mutated_indiv
 
 def evolve(population: list, select_percent: float,
-           crossover_prob: float, mutate_prob_proj: float, mutate_scale_wta: float):
+           crossover_prob: float, mutate_prob_proj: float, mutate_scale_wta: float, select_once: bool = False):
     """
     Create next generation by selecting, crossing-over and mutating.
     """
-    def _select_crossover_mutate():
-        # select
-        selected = select_elite_tournament(fitness_list, select_percent)
-        mother_choice = np.random.choice(selected)
-        selected.remove(mother_choice)
-        father_choice = np.random.choice(selected)
+    def _crossover_mutate(mother_choice, father_choice):
         mother = population[mother_choice]
         father = population[father_choice]
         
@@ -233,12 +222,14 @@ def evolve(population: list, select_percent: float,
         print("CROSSOVER - MOTHER:",mother_choice, mother.kc_size, "FATHER:",father_choice, father.kc_size, "MUTATION - CHILDREN KC SIZES",child1.kc_size,child2.kc_size)
         return child1, child2
 
-    fitness_list = [individual.get_fitness() for individual in population]
+    fitness_list = np.array([individual.get_fitness() for individual in population])
     print("FITNESS LIST:",fitness_list)
     generation_fitnesses.append(sum(fitness_list) / len(fitness_list))
 
-    children_list = joblib.Parallel(n_jobs=max_thread, prefer="threads")(
-        joblib.delayed(_select_crossover_mutate)() for _ in range(len(population) // 2))
+    parents = select_parents(fitness_list, 2, select_percent, len(population) // 2, once=select_once)
+
+    # breed sequentially: the random draws then come in a fixed order, so that runs resumed from a checkpoint are reproducible
+    children_list = [_crossover_mutate(mother_choice, father_choice) for mother_choice, father_choice in parents]
     new_population = []
     for pair in children_list:
         new_population.append(pair[0]) 
@@ -250,46 +241,129 @@ def evolve(population: list, select_percent: float,
 
 
 def genetic_alg(pop_size: int, crossover_prob: float, select_percent: float,
-                mutate_prob_proj: float, mutate_scale_wta: float):
+                mutate_prob_proj: float, mutate_scale_wta: float, islands: int = 1, migration_interval: int = 5, steady: bool = False, select_once: bool = False,
+                checkpoint: str = None, checkpoint_every: int = 1, resume: bool = False):
     """
     Genetic Algorithms, main function.
     """
-    # create log
-    log_file = './models/evolution/' + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + '.json'
-    best_fly_file = './models/evolution/' + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + '.fly'
-    append_as_json({'pop_size': pop_size, 'max_generation': MAX_GENERATION, 'crossover_prob': crossover_prob,
-                    'select_percent': select_percent, 'mutate_prob_proj': mutate_prob_proj,
-                    'mutate_scale_wta': mutate_scale_wta}, log_file)
-    append_as_json({'min_wta': MIN_WTA, 'max_wta': MAX_WTA,
-                    'min_kc': MIN_KC, 'max_kc': MAX_KC, 'min_proj': MIN_PROJ, 'max_proj': MAX_PROJ,
-                    'top_word': top_word, 'C': C, 'num_iter': num_iter}, log_file)
-
-    # generate the first random population
-    print(f'generate the first generation of {pop_size} individuals')
-    start_time = time.time()
-    population = init_pop(pop_size)
-    print('time to generate the first generation: {}'.format(time.time() - start_time))
+    global max_thread  # shared between islands, see below
+    if checkpoint and (steady or islands > 1):
+        raise ValueError('Checkpoints are only supported by the generational GA')
+    resume = resume and os.path.exists(checkpoint)
+    if resume:
+        last_gen, population, _, extra = load_checkpoint(checkpoint, Fly)
+        log_file, mutate_prob_proj = extra['log_file'], extra['mutate_prob_proj']
+        compute.restore({k: extra.get('compute_' + k, 0) for k in ('cpu', 'wall', 'evaluations', 'elapsed')})  #0 in checkpoints older than the meter
+        print(f'resuming from {checkpoint}, after generation {last_gen}')
+    else:
+        last_gen = -1
+        # create log
+        log_file = './models/evolution/' + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + '.json'
+        best_fly_file = './models/evolution/' + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + '.fly'
+        append_as_json({'pop_size': pop_size, 'max_generation': MAX_GENERATION, 'crossover_prob': crossover_prob,
+                        'select_percent': select_percent, 'mutate_prob_proj': mutate_prob_proj,
+                        'mutate_scale_wta': mutate_scale_wta}, log_file)
+        append_as_json({'min_wta': MIN_WTA, 'max_wta': MAX_WTA,
+                        'min_kc': MIN_KC, 'max_kc': MAX_KC, 'min_proj': MIN_PROJ, 'max_proj': MAX_PROJ,
+                        'top_word': top_word, 'C': C, 'num_iter': num_iter}, log_file)
+
+    metrics = MetricsSink(log_file)  # one handle, flushed in the background
+
+    if steady:
+        def _breed(mother, father):
+            child = crossover(mother, father)[0] if np.random.random() < crossover_prob else mother
+            child = mutate(child, mutate_prob_proj, mutate_scale_wta)
+            child.kc_size = child.projection.shape[0]
+            return child
+
+        last_log = [time.time()]
+        def _log(population, step):
+            stats = get_stats(population)
+            stats.update(compute.totals())
+            stats['gen'] = step
+            stats['time'] = time.time() - last_log[0]
+            last_log[0] = time.time()
+            metrics.append(stats)
+            print(stats)
+
+        print(f'steady-state evolution of {pop_size} individuals')
+        population = init_pop(pop_size)
+        eval_pop(population)
+        _log(population, 0)
+        population = steady_state(population, num_children=pop_size * (MAX_GENERATION - 1), breed_fn=_breed,
+                                  evaluate_fn=evaluate_measured, log_fn=_log, num_workers=max_thread,
+                                  stop_fn=compute.exhausted)
+        metrics.close()
+        return
+
+    if islands > 1:
+        last_log = {}
+        def _log(population, g, island):
+            stats = get_stats(population)
+            stats.update(compute.totals())
+            stats['gen'] = g
+            stats['island'] = island
+            stats['time'] = time.time() - last_log.get(island, start_time)
+            last_log[island] = time.time()
+            metrics.append(stats)
+            print(stats)
+
+        all_threads = max_thread
+        max_thread = max(1, all_threads // islands)  # share the threads between islands
+        print(f'evolving {islands} islands of {pop_size // islands} individuals')
+        compute.share(multiprocessing.get_context('fork'))  # one budget for all the islands
+        start_time = time.time()
+        best_flies = run_islands(num_islands=islands, pop_size=pop_size, num_generations=MAX_GENERATION,
+                                 init_fn=init_pop, eval_fn=eval_pop, log_fn=_log,
+                                 migration_interval=migration_interval, stop_fn=compute.exhausted,
+                                 evolve_fn=lambda population: evolve(population, select_percent, crossover_prob,
+                                                                     mutate_prob_proj, mutate_scale_wta, select_once)[0])
+        max_thread = all_threads
+        if compute.exhausted():
+            print('compute budget exhausted', compute.totals())
+        metrics.close()
+        print('best fitness per island:', [fly.get_fitness() for fly in best_flies])
+        return
+
+    if not resume:
+        # generate the first random population
+        print(f'generate the first generation of {pop_size} individuals')
+        start_time = time.time()
+        population = init_pop(pop_size)
+        print('time to generate the first generation: {}'.format(time.time() - start_time))
     fitness_list = [individual.get_fitness() for individual in population]
+    checkpointer = Checkpointer(checkpoint) if checkpoint else None
 
     print('evolving')
     # total_improvement = []
     # last_fitness = 0
-    for g in range(MAX_GENERATION):
+    for g in range(last_gen + 1, MAX_GENERATION):
         print("\n\nGENERATION",g)
         start_time = time.time()
         # new generation, including selection, crossover, mutation
         if g > 0:  # do not process this step in the 1st generation, since every fitness = 0
             population, mutate_prob_proj = evolve(population, select_percent,
-                                crossover_prob, mutate_prob_proj, mutate_scale_wta)
+                                crossover_prob, mutate_prob_proj, mutate_scale_wta, select_once)
 
         # evaluate the population
         eval_pop(population)
         stats = get_stats(population)
+        stats.update(compute.totals())
         stats['gen'] = g
         stats['time'] = time.time() - start_time
 
-        append_as_json(stats, log_file)
+        metrics.append(stats)
         print(stats)
+        if checkpointer and ((g + 1) % checkpoint_every == 0 or g == MAX_GENERATION - 1 or compute.exhausted()):
+            metrics.flush()  # the log must not lag behind the checkpoint
+            checkpointer.save(population, g, log_file=log_file, mutate_prob_proj=mutate_prob_proj,
+                              **{'compute_' + k: v for k, v in compute.totals().items()})
+        if compute.exhausted():
+            print('compute budget exhausted after generation', g, compute.totals())
+            break
+    if checkpointer:
+        checkpointer.wait()
+    metrics.close()
 
 
 if __name__ == '__main__':
@@ -302,6 +376,8 @@ if __name__ == '__main__':
     top_word = 250
     C = 100
     num_iter = 50  # wikipedia and wos only need 50 steps
+    compute = ComputeMeter(cpu_budget=args['--cpu_budget'] and float(args['--cpu_budget']),
+                           wall_budget=args['--wall_budget'] and float(args['--wall_budget']), per_thread=True)
     max_thread = int(multiprocessing.cpu_count() * 0.25)
     sp = spm.SentencePieceProcessor()
     sp.load('../spmcc.model')
@@ -322,4 +398,7 @@ if __name__ == '__main__':
     train_set_list[2], train_label_list[2] = read_n_encode_dataset('../datasets/20news-bydate/20news-bydate-train.sp', vectorizer, logprobs)
     val_set_list[2], val_label_list[2] = read_n_encode_dataset('../datasets/20news-bydate/20news-bydate-val.sp', vectorizer, logprobs)
 
-    genetic_alg(pop_size=10, crossover_prob=0.8, select_percent=0.4, mutate_prob_proj=0.1, mutate_scale_wta=2)
+    genetic_alg(pop_size=10, crossover_prob=0.8, select_percent=0.4, mutate_prob_proj=0.1, mutate_scale_wta=2,
+                islands=int(args['--islands']), migration_interval=int(args['--migration']),
+                steady=args['--steady_state'], select_once=args['--select_once'], checkpoint=args['--checkpoint'],
+                checkpoint_every=int(args['--checkpoint_every']), resume=args['--resume'])
@@ -1,22 +1,36 @@
 """Export fly for deployment
 
 Usage:
-  export_fly_for_deployment.py --fly=<path> --dpath=<path>
+  export_fly_for_deployment.py --fly=<path> --dpath=<path> [--spm=<path>] [--top_words=<n>]
+                               [--prune_corpus=<path> [--min_activity=<f>] [--k=<n>]]
   export_fly_for_deployment.py (-h | --help)
   export_fly_for_deployment.py --version
 Options:
   -h --help                 Show this screen.
   --version                 Show version.
-  --fly=<path>              Path to selected fly model.
+  --fly=<path>              Path to selected fly model (or to a fly.m exported by an earlier version).
   --dpath=<path>            Path to deployment folder.
+  --spm=<path>              Sentencepiece model the fly was evolved with [default: ../spm/spmcc.model].
+  --top_words=<n>           Number of words kept in a document before hashing [default: 250].
+  --prune_corpus=<path>     Reference corpus (.sp file) on which to find and remove the KCs that are never active.
+  --min_activity=<f>        Also remove the KCs active in at most this fraction of the corpus documents [default: 0].
+  --k=<n>                   k of the prec@k reported before and after pruning [default: 20].
 
 """
 
 from docopt import docopt
+import time
 import pickle
 import numpy as np
 from os.path import join
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import CountVectorizer
 from evolve_flies import Fly
+from hash import read_vocab
+from hyperparam_search import read_n_encode_dataset
+from utils import hash_dataset_
+from eval import prec_at_k
+from bundle import save_bundle
 
 class DeployedFly:
     def __init__(self):
@@ -29,10 +43,58 @@ def export(fly):
     dfly = DeployedFly()
     dfly.kc_size = fly.kc_size
     dfly.wta = fly.wta
-    dfly.projection = fly.projection
+    # a fly.m exported with its genome left its projection out
+    dfly.projection = fly.projection if hasattr(fly, 'projection') else fly.genome.projections()
     dfly.val_scores = fly.val_scores
     return dfly
 
+def prune(dfly, corpus_path, top_words, min_activity, k):
+    """
+    Remove the KCs active in at most min_activity of the documents of a reference
+    corpus (by default, those never active), renumbering the others. The WTA is
+    rescaled so that as many KCs win as before: with min_activity=0, the hashes of
+    the corpus are unchanged, minus their always-zero bits. Return a report of the
+    hash size, hashing speed and prec@k on the corpus, before and after.
+    """
+    vocab, _, logprobs = read_vocab()
+    vectorizer = CountVectorizer(vocabulary=vocab, lowercase=False, token_pattern='[^ ]+')
+    X, labels = read_n_encode_dataset(corpus_path, vectorizer, logprobs)
+
+    def _measure(projection, wta):
+        start = time.time()
+        hs = hash_dataset_(X, projection, wta, top_words)
+        docs_per_s = X.shape[0] / (time.time() - start)
+        return hs, {'kc_size': projection.shape[0], 'nnz': int(projection.nnz), 'wta': float(wta),
+                    'active_kcs': float(hs.sum(axis=1).mean()), 'docs_per_s': docs_per_s,
+                    'prec_at_k': float(prec_at_k(hs, labels, k, metric="hamming"))}
+
+    projection = csr_matrix(dfly.projection)
+    hs, before = _measure(projection, dfly.wta)
+    activity = np.asarray(hs.mean(axis=0)).ravel()
+    keep = np.flatnonzero(activity > min_activity)
+    num_winners = int(dfly.wta * projection.shape[0] / 100)
+    dfly.projection = projection[keep]
+    dfly.kc_size = len(keep)
+    dfly.wta = min(100., 100 * (num_winners + .5) / len(keep))  #same number of winners as before
+    _, after = _measure(dfly.projection, dfly.wta)
+
+    print(f'Pruned {before["kc_size"] - after["kc_size"]} of {before["kc_size"]} KCs '
+          f'({len(labels)} documents of {corpus_path}, min activity {min_activity})')
+    for key in before:
+        print(f'  {key}: {before[key]:.4g} -> {after[key]:.4g}')
+    return {'corpus': corpus_path, 'min_activity': min_activity, 'k': k, 'before': before, 'after': after}
+
+def save_deployment_bundle(dfly, path, spm_model, top_words, pruning=None):
+    """Write the fly as a single bundle, with the sentencepiece model and the vocabulary
+    weights it needs to hash documents (see bundle.py)."""
+    vocab, reverse_vocab, logprobs = read_vocab()
+    with open(spm_model, 'rb') as f:
+        spm_bytes = f.read()
+    params = {'wta': float(dfly.wta), 'top_words': top_words, 'val_scores': [float(s) for s in dfly.val_scores]}
+    if pruning:
+        params['pruning'] = pruning
+    save_bundle(path, dfly.projection, params, spm_bytes, [reverse_vocab[i] for i in range(len(vocab))], logprobs)
+
 args = docopt(__doc__, version='Hashing a document, ver 0.1')
 deployment_path = args['--dpath']
 fly_model = args['--fly']
@@ -41,6 +103,10 @@ with open(fly_model, 'rb') as f:  # modified the name of the fruit-fly here
     fly_model = pickle.load(f)
 
 deployment_fly = export(fly_model)
+top_words = int(args['--top_words'])
+
+pruning = None
+if args['--prune_corpus']:
+    pruning = prune(deployment_fly, args['--prune_corpus'], top_words, float(args['--min_activity']), int(args['--k']))
 
-with open(join(deployment_path,"fly.m"), "wb") as f:
-    pickle.dump(deployment_fly, f)
+save_deployment_bundle(deployment_fly, join(deployment_path, "fly.bundle"), args['--spm'], top_words, pruning)
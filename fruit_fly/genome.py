@@ -0,0 +1,231 @@
+"""Seed-based description of the projections of a fly: the random seed and sizes
+the initial matrix was drawn with, followed by the log of the edits (mutations,
+crossovers...) that led to the current matrix, each with its own seed. Any matrix
+can be regenerated exactly from its genome, which pickles to a few hundred bytes
+for a fresh fly. As the log grows with the number of ancestors, a node whose log
+would take more room than its matrix (or too many edits to replay) is replaced by
+a snapshot of the matrix, from which its descendants are replayed: a genome never
+takes more room than the CSR arrays of its matrix (and snapshots leave out the
+values of binary matrices).
+"""
+
+import pickle
+import numpy as np
+from scipy.sparse import csr_matrix, hstack, vstack
+
+from projections import random_projections, permutation_projections, replace_rows
+
+EDIT_BYTES = 64  #rough size of a pickled edit
+MAX_EDITS = 64  #edits replayed at most from the nearest snapshots
+
+
+class Genome:
+    """
+    A node of the genealogy of a projection matrix: edit is a tuple (name, seed, *args)
+    applied to the projections of parent (None for the first node, which draws the
+    initial matrix), and other is the genome of the second parent of a crossover.
+    Genomes are immutable, so relatives share their common nodes. The editing methods
+    take the current projections as well, and return the new genome together with the
+    projections it stands for, so that breeding never has to replay the log.
+    _size and _edits bound the bytes and the number of edits of the log from above
+    (the ancestors shared by both parents of a crossover are counted twice).
+    """
+    __slots__ = ('parent', 'edit', 'other', '_projections', '_size', '_edits')
+
+    def __init__(self, parent, edit, other=None):
+        self.parent = parent
+        self.edit = edit
+        self.other = other
+        self._projections = None
+        deps = [dep for dep in (parent, other) if dep is not None]
+        if edit[0] == 'snapshot':
+            self._size, self._edits = sum(a.nbytes for a in edit[2:5] if a is not None), 0
+        else:
+            self._size = EDIT_BYTES + sum(dep._size for dep in deps)
+            self._edits = 1 + sum(dep._edits for dep in deps)
+
+    @classmethod
+    def random(cls, kc_size, pn_size, min_proj, max_proj=None):
+        """Genome and projections of random_projections(kc_size, pn_size, min_proj, max_proj)."""
+        genome = cls(None, _new_edit('random', kc_size, pn_size, min_proj, max_proj))
+        return genome, _apply(genome.edit)[0]
+
+    @classmethod
+    def permutation(cls, kc_size, pn_size, proj_size):
+        """Genome and projections of permutation_projections(kc_size, pn_size, proj_size)."""
+        genome = cls(None, _new_edit('permutation', kc_size, pn_size, proj_size))
+        return genome, _apply(genome.edit)[0]
+
+    @classmethod
+    def snapshot(cls, projections):
+        """Genome holding a copy of the projections themselves (e.g. for a matrix
+        that was not drawn by a genome, or to cut a long log)."""
+        projections = csr_matrix(projections, copy=True)
+        data = None if np.all(projections.data == 1) else projections.data
+        return cls(None, ('snapshot', None, data, projections.indices, projections.indptr,
+                          projections.shape, projections.dtype.str))
+
+    def mutate(self, projections, num_rows, min_proj, max_proj=None):
+        """Replace num_rows rows, drawn with replacement, by new random rows (see
+        random_projections). Return the genome, the projections and the rows replaced."""
+        return self._edited(projections, _new_edit('mutate', num_rows, min_proj, max_proj))
+
+    def grow(self, projections, num_rows, min_proj, max_proj=None):
+        """Append num_rows new random rows. Return the genome and the projections."""
+        return self._edited(projections, _new_edit('grow', num_rows, min_proj, max_proj))[:2]
+
+    def select(self, projections, num_rows):
+        """Keep num_rows rows drawn without replacement. Return the genome and the projections."""
+        return self._edited(projections, _new_edit('select', num_rows))[:2]
+
+    def cross(self, projections, other, other_projections, col, swap=False):
+        """Crossover with the fly of genome other: the columns before col of projections
+        next to the columns from col of other_projections, or, if swap, the columns from
+        col of other_projections next to the columns before col of projections (the two
+        must have as many rows). Return the genome and the projections."""
+        edit = ('cross', None, int(col), bool(swap))
+        return self._edited(projections, edit, other, other_projections)[:2]
+
+    def _edited(self, projections, edit, other=None, other_projections=None):
+        projections, rows = _apply(edit, projections, other_projections)
+        genome = Genome(self, edit, other)
+        if genome._edits > MAX_EDITS or genome._size > _nbytes(projections):
+            genome = Genome.snapshot(projections)
+        return genome, projections, rows
+
+    def projections(self):
+        """Regenerate the projections by replaying the log."""
+        projections, self._projections = self._projections, None
+        return projections if projections is not None else replay([self])[0]
+
+    def __reduce__(self):
+        # flat list of nodes: no recursion through long genealogies
+        return _unpickle, _pack([self])
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _new_edit(name, *args):
+    # seeds come from the global random state, so that seeded and resumed runs give the same genomes
+    seed = int(np.random.randint(2 ** 31))
+    return (name, seed) + tuple(a.item() if isinstance(a, np.generic) else a for a in args)
+
+
+def _nbytes(projections):
+    return projections.data.nbytes + projections.indices.nbytes + projections.indptr.nbytes
+
+
+def _apply(edit, projections=None, other=None):
+    """Projections after the edit, and the rows it drew (if any)."""
+    name, seed, args = edit[0], edit[1], edit[2:]
+    if name == 'snapshot':
+        data, indices, indptr, shape, dtype = args
+        if data is None:
+            data = np.ones(len(indices), dtype=dtype)
+        return csr_matrix((data.copy(), indices.copy(), indptr.copy()), shape=shape), None
+    rng = np.random.RandomState(seed)
+    if name == 'random':
+        return random_projections(*args, random_state=rng), None
+    if name == 'permutation':
+        return permutation_projections(*args, random_state=rng), None
+    if name == 'mutate':
+        num_rows, min_proj, max_proj = args
+        rows = rng.choice(projections.shape[0], num_rows)
+        new_rows = random_projections(num_rows, projections.shape[1], min_proj, max_proj, random_state=rng)
+        return replace_rows(projections, rows, new_rows), rows
+    if name == 'grow':
+        num_rows, min_proj, max_proj = args
+        new_rows = random_projections(num_rows, projections.shape[1], min_proj, max_proj, random_state=rng)
+        return vstack([projections, new_rows], format='csr'), None
+    if name == 'select':
+        rows = rng.choice(projections.shape[0], size=args[0], replace=False)
+        return projections[rows, :], rows
+    if name == 'cross':
+        col, swap = args
+        if swap:
+            return hstack([other[:, col:], projections[:, :col]], format='csr'), None
+        return hstack([projections[:, :col], other[:, col:]], format='csr'), None
+    raise ValueError('Unknown edit: ' + str(name))
+
+
+def _nodes(genomes):
+    """All the nodes the genomes derive from, each one after those it derives from."""
+    order, seen = [], set()
+    stack = [(genome, False) for genome in reversed(genomes)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+            continue
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.append((node, True))
+        stack.extend((dep, False) for dep in (node.other, node.parent) if dep is not None and id(dep) not in seen)
+    return order
+
+
+def replay(genomes):
+    """
+    Regenerate the projections of a list of genomes. The nodes they share (common
+    ancestors, crossover partners) are replayed once, and their projections are only
+    kept in memory until their last use.
+    """
+    order = _nodes(genomes)
+    uses = {}
+    for node in order:
+        for dep in (node.parent, node.other):
+            if dep is not None:
+                uses[id(dep)] = uses.get(id(dep), 0) + 1
+    for genome in genomes:
+        uses[id(genome)] = uses.get(id(genome), 0) + 1  #never released
+    done = {}
+    for node in order:
+        parent = None if node.parent is None else done[id(node.parent)]
+        other = None if node.other is None else done[id(node.other)]
+        done[id(node)] = _apply(node.edit, parent, other)[0]
+        for dep in (node.parent, node.other):
+            if dep is not None:
+                uses[id(dep)] -= 1
+                if not uses[id(dep)]:
+                    del done[id(dep)]
+    return [done[id(genome)] for genome in genomes]
+
+
+def _pack(genomes):
+    """(flat list of (parent index, edit, other index) nodes, indices of the genomes)"""
+    nodes = _nodes(genomes)
+    index = {id(node): i for i, node in enumerate(nodes)}
+    flat = [(-1 if node.parent is None else index[id(node.parent)], node.edit,
+             -1 if node.other is None else index[id(node.other)]) for node in nodes]
+    return flat, [index[id(genome)] for genome in genomes]
+
+
+def _unpack(flat, roots):
+    nodes = []
+    for parent, edit, other in flat:
+        nodes.append(Genome(nodes[parent] if parent >= 0 else None, edit, nodes[other] if other >= 0 else None))
+    return [nodes[i] for i in roots]
+
+
+def _unpickle(flat, roots):
+    return _unpack(flat, roots)[0]
+
+
+def dump_genomes(genomes):
+    """The genomes of a population as an array of bytes, with their common nodes stored once."""
+    return np.frombuffer(pickle.dumps(_pack(genomes), protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+
+
+def load_genomes(array):
+    """Genomes saved by dump_genomes. Their projections are replayed together, which is
+    much faster than one by one when they are related, and handed out by the first call
+    to projections()."""
+    genomes = _unpack(*pickle.loads(array.tobytes()))
+    for genome, projections in zip(genomes, replay(genomes)):
+        genome._projections = projections
+    return genomes
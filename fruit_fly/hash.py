@@ -25,7 +25,7 @@ import pathlib
 from timer import Timer
 from docopt import docopt
 import sentencepiece as spm
-from scipy.sparse import coo_matrix, csr_matrix, vstack
+from scipy.sparse import coo_matrix, csr_matrix, vstack, issparse, load_npz
 from sklearn.feature_extraction.text import CountVectorizer
 
 # makes segmenter instance and loads the model file (m.model)
@@ -53,22 +53,32 @@ def read_vocab():
     return vocab, reverse_vocab, logprobs
 
 
+def load_projections(path, PN_size=None):
+    """KC x PN projection matrix (CSR) from a .npz file written by mkprojections, or from
+    an older text file with the PNs of one KC per line."""
+    if path.endswith('.npz'):
+        projections = load_npz(path).tocsr()
+    else:
+        with open(path) as f:
+            rows = [l.split() for l in f]
+        indptr = np.concatenate([[0], np.cumsum([len(r) for r in rows])])
+        indices = np.array([int(n) for r in rows for n in r], dtype=np.int32)
+        projections = csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr))
+    if PN_size is not None and projections.shape[1] != PN_size:
+        projections = csr_matrix((projections.data, projections.indices, projections.indptr),
+                                 shape=(projections.shape[0], PN_size))
+    return projections
+
+
 def read_projections(d):
-    c = 0
-    projections = {}
+    projections = load_projections(d)
+    projection_functions = {c: projections.indices[projections.indptr[c]:projections.indptr[c + 1]]
+                            for c in range(projections.shape[0])}
     pn_to_kc = {}
-    with open(d) as f:
-        for l in f:
-            l=l.rstrip('\n')
-            p = np.array([int(n) for n in l.split()])
-            projections[c]=p
-            for pn in p:
-                if pn in pn_to_kc:
-                    pn_to_kc[pn].append(c)
-                else:
-                    pn_to_kc[pn] = [c]
-            c+=1
-    return projections, pn_to_kc
+    by_pn = projections.tocsc()
+    for pn in np.flatnonzero(np.diff(by_pn.indptr)):
+        pn_to_kc[pn] = list(by_pn.indices[by_pn.indptr[pn]:by_pn.indptr[pn + 1]])
+    return projection_functions, pn_to_kc
 
 
 def show_projections(hashed_kenyon, reverse_vocab):
@@ -86,14 +96,8 @@ def show_projections(hashed_kenyon, reverse_vocab):
     print("BEST PNS", sorted(important_words, key=important_words.get, reverse=True)[:proj_size])
 
 
-def projection_vectorized(projection_mat, projection_functions):
-    KC_size = len(projection_functions)
-    PN_size = projection_mat.shape[1]
-    weight_mat = np.zeros((KC_size, PN_size))
-    for kc_idx, pn_list in projection_functions.items():
-        weight_mat[kc_idx][pn_list] = 1
-    weight_mat = coo_matrix(weight_mat.T)
-    return projection_mat.dot(weight_mat)
+def projection_vectorized(projection_mat, projections):
+    return projection_mat.dot(projections.T)
 
 
 def wta_vectorized(feature_mat, k, percent=True):
@@ -114,8 +118,8 @@ def wta_vectorized(feature_mat, k, percent=True):
     return feature_mat
 
 
-def hash_input_vectorized(projection_mat, percent_hash, projection_functions):
-    kc_mat = projection_vectorized(projection_mat, projection_functions)
+def hash_input_vectorized(projection_mat, percent_hash, projections):
+    kc_mat = projection_vectorized(projection_mat, projections)
     m, n = kc_mat.shape
     wta_csr = csr_matrix(np.zeros(n))
     for i in range(0, m, 2000):
@@ -126,17 +130,17 @@ def hash_input_vectorized(projection_mat, percent_hash, projection_functions):
 
 
 def hash_dataset(dataset_mat, projection_path, percent_hash, top_words):
-    # read projection file
-    projection_functions, pn_to_kc = read_projections(projection_path)
+    # projection file, or the projection matrix itself when generated in the same run
+    m, n = dataset_mat.shape
+    projections = projection_path if issparse(projection_path) else load_projections(projection_path, n)
 
     # hash
-    m, n = dataset_mat.shape
     dataset_mat = csr_matrix(dataset_mat)
     wta_csr = csr_matrix(np.zeros(n))
     for i in range(0, m, 2000):
         part = wta_vectorized(dataset_mat[i: i+2000].toarray(), k=top_words, percent=False)
         wta_csr = vstack([wta_csr, csr_matrix(part, shape=part.shape)])
-    hs = hash_input_vectorized(wta_csr[1:], percent_hash, projection_functions)
+    hs = hash_input_vectorized(wta_csr[1:], percent_hash, projections)
     hs = (hs > 0).astype(np.int_)
 
     return hs
@@ -20,12 +20,13 @@ from evolve_flies import Fly
 from hyperparam_search import read_n_encode_dataset
 from classify import train_model
 from hash import read_vocab
-from utils import hash_dataset_
+from utils import hash_dataset_, pod_summary
 from scipy import sparse
 from scipy.sparse import csr_matrix, vstack
 import pathlib
 from docopt import docopt
 import glob
+from os.path import exists
 import re
 from collections import defaultdict
 from hash import wta, return_keywords
@@ -97,11 +98,15 @@ def hash_documents(f_dataset, best_fly):
       keyws = pickle.load(open(hs_file.replace(".hs", ".kwords"), 'rb'))
       keyws = np.append(keyws, np.array(dic_labs[lab]['keywords']))
       pickle.dump(keyws, open(hs_file.replace(".hs", ".kwords"), 'wb'))
+      sum_file = hs_file.replace(".hs", ".sum")
+      summary = pickle.load(open(sum_file, 'rb')) if exists(sum_file) else pod_summary(hs_mat)
+      pickle.dump(pod_summary(hashes, summary), open(sum_file, 'wb'))
     else:
       pickle.dump(hashes, open(hs_file, 'wb'))
       pickle.dump(np.array(dic_labs[lab]['ids']), open(hs_file.replace(".hs", ".ids"), 'wb'))
       pickle.dump(np.array(dic_labs[lab]['urls']), open(hs_file.replace(".hs", ".url"), 'wb'))
       pickle.dump(np.array(dic_labs[lab]['keywords']), open(hs_file.replace(".hs", ".kwords"), 'wb'))
+      pickle.dump(pod_summary(hashes), open(hs_file.replace(".hs", ".sum"), 'wb'))
     if e % 20 == 0:
       print(f'{e} categories saved with hashes...')
 
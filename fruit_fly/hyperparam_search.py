@@ -1,6 +1,7 @@
 """Hyper-parameter search by Bayesian optimization
 Usage:
-  hyperparam_search.py --train_path=<filename> [--continue_log=<filename>]
+  hyperparam_search.py --train_path=<filename> [--continue_log=<filename> | --asha [--min_fraction=<f>] [--eta=<n>]]
+                       [--batch=<n>] [--cpu_budget=<s>] [--wall_budget=<s>]
   hyperparam_search.py (-h | --help)
   hyperparam_search.py --version
 Options:
@@ -8,6 +9,12 @@ Options:
   --version                       Show version.
   --train_path=<filename>         Name of file to train (processed by sentencepeice)
   [--continue_log=<filename>]     Name of the json log file that we want the Bayesian optimization continues
+  --asha                          Successive halving over training subsamples instead of Bayesian optimization.
+  --min_fraction=<f>              Fraction of the data new configurations are evaluated on [default: 0.111].
+  --eta=<n>                       Only the top 1/eta of each fraction is evaluated on eta times more data [default: 3].
+  --batch=<n>                     Number of points evaluated in parallel [default: 1].
+  --cpu_budget=<s>                Stop once evaluations have used this many CPU-seconds.
+  --wall_budget=<s>               Stop once the search has lasted this many seconds.
 """
 
 
@@ -24,23 +31,30 @@ from docopt import docopt
 from sklearn.feature_extraction.text import CountVectorizer
 from scipy.sparse import csr_matrix
 
-from mkprojections import create_projections
+from mkprojections import save_projections
+from projections import permutation_projections
 from hash import read_vocab, hash_dataset
 from classify import train_model
-
-from bayes_opt import BayesianOptimization
-from bayes_opt.logger import JSONLogger
-from bayes_opt.event import Events
-from bayes_opt.util import load_logs
+from timer import ComputeMeter
+from utils import append_as_json
+from batch_bo import BatchBayesianOptimization, AsyncSuccessiveHalving, subsample
 
 
 def generate_projs(PN_size, KC_size, proj_size, dataset_name):
     d = "models/projection/"+dataset_name+"/kc"+str(KC_size)+"-p"+str(proj_size)
-    if not os.path.isdir(d):
-        os.mkdir(d)
+    os.makedirs(d, exist_ok=True)
     trial = len(os.listdir(d))
-    model_file = create_projections(PN_size, KC_size, proj_size, d, trial)
-    return model_file
+    while True:  # reserve the trial number, other workers may be creating projections too
+        try:
+            open(os.path.join(d, "spmcc_" + str(trial) + ".projs.npz"), 'x').close()
+            break
+        except FileExistsError:
+            trial += 1
+    # the projections are saved for later runs, and used in memory in this one
+    model_file = os.path.join(d, "spmcc_" + str(trial) + ".projs.npz")
+    projections = permutation_projections(KC_size, PN_size, proj_size)
+    save_projections(model_file, projections)
+    return model_file, projections
 
 
 def read_n_encode_dataset(path, vectorizer, logprobs):
@@ -69,47 +83,58 @@ def read_n_encode_dataset(path, vectorizer, logprobs):
 
 
 def fruitfly_pipeline(top_word, KC_size, proj_size, percent_hash,
-                      C, num_iter, num_trial):
-    def _hash_n_train(model_file):
+                      C, num_iter, num_trial, fraction=1.0):
+    # low fidelity evaluations (successive halving) only see a subsample of the documents
+    train, train_y = subsample(train_set, train_label, fraction)
+    val, val_y = subsample(val_set, val_label, fraction)
+
+    def _hash_n_train(projections):
         # print('hashing dataset')
-        hash_train = hash_dataset(dataset_mat=train_set, projection_path=model_file,
+        hash_train = hash_dataset(dataset_mat=train, projection_path=projections,
                                   percent_hash=percent_hash, top_words=top_word)
-        hash_val = hash_dataset(dataset_mat=val_set, projection_path=model_file,
+        hash_val = hash_dataset(dataset_mat=val, projection_path=projections,
                                 percent_hash=percent_hash, top_words=top_word)
         # print('training and evaluating')
-        val_score, model = train_model(m_train=hash_train, classes_train=train_label,
-                                       m_val=hash_val, classes_val=val_label,
+        val_score, model = train_model(m_train=hash_train, classes_train=train_y,
+                                       m_val=hash_val, classes_val=val_y,
                                        C=C, num_iter=num_iter)
         return val_score, model
 
     print('creating projections')
-    model_files = [generate_projs(PN_size, KC_size, proj_size, dataset_name) for _ in range(num_trial)]
+    if fraction < 1:  # low fidelity runs are never saved, neither are their projections
+        projection_list = [permutation_projections(KC_size, PN_size, proj_size) for _ in range(num_trial)]
+    else:
+        model_files, projection_list = zip(*[generate_projs(PN_size, KC_size, proj_size, dataset_name)
+                                             for _ in range(num_trial)])
 
     print('training')
     score_list, model_list = [], []
     score_model_list = joblib.Parallel(n_jobs=max_thread, prefer="threads")(
-        joblib.delayed(_hash_n_train)(model_file) for model_file in model_files)
+        joblib.delayed(_hash_n_train)(projections) for projections in projection_list)
     score_list += [i[0] for i in score_model_list]
     model_list += [i[1] for i in score_model_list]
 
+    # average the validation acc
+    avg_score = np.mean(score_list)
+    std_score = np.std(score_list)
+    print('average score:', avg_score)
+    if fraction < 1:
+        return avg_score
+
     # select the max performance
     max_idx = np.argmax(score_list)
     trial = model_files[max_idx].split('.')[0].split('_')[1]
     save_name = 'kc' + str(KC_size) + '_proj' + str(proj_size) + '_trial' + str(trial) +\
                 '_top' + str(top_word) + '_wta' + str(percent_hash) + '_C' + str(C) + \
                 '_iter' + str(num_iter) + '_score' + str(score_list[max_idx])[2:]  # remove 0.
-    global max_val_score
+    # the best model so far is the one on disk, whichever worker process saved it
+    saved = list(pathlib.Path(f'./models/classification/{dataset_name}_{now}').glob('*.sav'))
+    max_val_score = max([float('0.' + f.stem.split('_score')[1]) for f in saved], default=-1)
     if score_list[max_idx] > max_val_score:
-        max_val_score = score_list[max_idx]
-        for f in pathlib.Path(f'./models/classification/{dataset_name}_{now}').glob('*.sav'):
-            f.unlink()
+        for f in saved:
+            f.unlink(missing_ok=True)
         joblib.dump(model_list[max_idx], f'./models/classification/{dataset_name}_{now}/{save_name}.sav')
 
-    # average the validation acc
-    avg_score = np.mean(score_list)
-    std_score = np.std(score_list)
-    print('average score:', avg_score)
-
     # write the std
     with open(f'./log/logs_{dataset_name}.tsv', 'a') as f:
         f.writelines('\t'.join(str(i) for i in [KC_size, proj_size, top_word,
@@ -119,38 +144,54 @@ def fruitfly_pipeline(top_word, KC_size, proj_size, percent_hash,
     return avg_score
 
 
-def optimize_fruitfly(continue_log):
-    def _classify(topword, KC_size, proj_size, percent_hash, C):
-        topword = round(topword)
-        KC_size = round(KC_size)
-        proj_size = round(proj_size)
-        percent_hash = round(percent_hash)
-        C = round(C)
-        num_trial = 3
-        num_iter = 50
-        if dataset_name == '20news':
-            num_iter = 2000  # 50 wos wiki, 2000 20news
-        print(f'--- KC_size {KC_size}, proj_size {proj_size}, '
-              f'top_word {topword}, wta {percent_hash}, C {C} ---')
-        return fruitfly_pipeline(topword, KC_size, proj_size, percent_hash,
-                                 C, num_iter, num_trial)
-
-    optimizer = BayesianOptimization(
-        f=_classify,
-        pbounds={"topword": (10, 250), "KC_size": (3000, 9000),
-                 "proj_size": (2, 10), "percent_hash": (2, 20), "C": (1, 100)},
-        #random_state=1234,
-        verbose=2
-    )
-
-    if continue_log:
-        load_logs(optimizer, logs=[continue_log])
-        print("Optimizer is now aware of {} points.".format(len(optimizer.space)))
-    tmp_log_path = f'./log/logs_{dataset_name}_{now}.json'
-    logger = JSONLogger(path=tmp_log_path)
-    optimizer.subscribe(Events.OPTIMIZATION_STEP, logger)
+def _classify(topword, KC_size, proj_size, percent_hash, C, fraction=1.0):
+    topword = round(topword)
+    KC_size = round(KC_size)
+    proj_size = round(proj_size)
+    percent_hash = round(percent_hash)
+    C = round(C)
+    num_trial = 3
+    num_iter = 50
+    if dataset_name == '20news':
+        num_iter = 2000  # 50 wos wiki, 2000 20news
+    print(f'--- KC_size {KC_size}, proj_size {proj_size}, '
+          f'top_word {topword}, wta {percent_hash}, C {C}, fraction {fraction:.3f} ---')
+    # runs in a worker process, so the CPU time of that process is the evaluation's
+    with ComputeMeter().measure() as cost:
+        score = fruitfly_pipeline(topword, KC_size, proj_size, percent_hash,
+                                  C, num_iter, num_trial, fraction)
+    print('compute:', cost)
+    return score, cost
+
+
+def optimize_fruitfly(continue_log, batch, asha=None):
+    def _log_compute(params, score, cost, fraction=1.0):
+        compute.add(cost)
+        append_as_json({'target': score, 'params': {k: round(v) for k, v in params.items()}, 'fraction': fraction,
+                        'eval_cpu': cost['cpu'], 'eval_wall': cost['wall'], **compute.totals()}, compute_log_path)
 
-    optimizer.maximize(n_iter=200)
+    tmp_log_path = f'./log/logs_{dataset_name}_{now}.json'
+    compute_log_path = f'./log/compute_{dataset_name}_{now}.json'
+    pbounds = {"topword": (10, 250), "KC_size": (3000, 9000),
+               "proj_size": (2, 10), "percent_hash": (2, 20), "C": (1, 100)}
+
+    # no new point is started once the compute budget is spent
+    if asha:
+        optimizer = AsyncSuccessiveHalving(f=_classify, pbounds=pbounds, num_workers=batch,
+                                           history=tmp_log_path, on_result=_log_compute, **asha)
+        optimizer.maximize(num_configs=205, stop_fn=compute.exhausted)
+    else:
+        optimizer = BatchBayesianOptimization(
+            f=_classify,
+            pbounds=pbounds,
+            num_workers=batch,
+            history=tmp_log_path,
+            warm_start=[continue_log] if continue_log else None,
+            on_result=_log_compute
+        )
+        optimizer.maximize(init_points=5, n_iter=200, stop_fn=compute.exhausted)
+    if compute.exhausted():
+        print('compute budget exhausted:', compute.totals())
     print("Final result:", optimizer.max)
     with open(main_log_path, 'a') as f_main:
         with open(tmp_log_path) as f_tmp:
@@ -181,10 +222,16 @@ if __name__ == '__main__':
     print('reading dataset')
     train_set, train_label = read_n_encode_dataset(train_path, vectorizer, logprobs)
     val_set, val_label = read_n_encode_dataset(train_path.replace('train', 'val'), vectorizer, logprobs)
-    max_val_score = -1
-    max_thread = int(multiprocessing.cpu_count() * 0.7)
+    batch = int(args['--batch'])
+    max_thread = max(1, int(multiprocessing.cpu_count() * 0.7) // batch)
+    compute = ComputeMeter(cpu_budget=args['--cpu_budget'] and float(args['--cpu_budget']),
+                           wall_budget=args['--wall_budget'] and float(args['--wall_budget']))
+
+    asha = None
+    if args['--asha']:
+        asha = {'min_fraction': float(args['--min_fraction']), 'eta': int(args['--eta'])}
 
     # search
-    optimize_fruitfly(continue_log)
+    optimize_fruitfly(continue_log, batch, asha)
 
 
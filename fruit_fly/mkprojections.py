@@ -14,9 +14,11 @@ Options:
 """
 
 import os
-import random
 import numpy as np
 from docopt import docopt
+from scipy.sparse import csr_matrix, save_npz
+
+from projections import permutation_projections
 
 def read_vocab():
     c = 0
@@ -38,29 +40,16 @@ def read_vocab():
     return vocab, reverse_vocab, logprobs
 
 
+def save_projections(path, projections):
+    """Uncompressed .npz, i.e. the raw CSR arrays, which load in milliseconds."""
+    save_npz(path, csr_matrix(projections), compressed=False)
+
+
 def create_projections(PN_size, KC_size, proj_size,d, trial):
     # print("Creating",KC_size,"projections...")
-    projection_functions = {}
-    idx = list(range(PN_size))
-    potential_projections = []
-
-    while len(potential_projections) < KC_size:
-        random.shuffle(idx)
-
-        for i in range(0,len(idx),proj_size):
-            p = idx[i:i+proj_size]
-            potential_projections.append(p)
-
-    f=open(os.path.join(d,"spmcc_"+str(trial)+".projs"),'w')
-    for cell in range(KC_size):
-        p = np.array(potential_projections[cell])
-        projection_functions[cell] = p
-        pw = ""
-        for i in p:
-            pw+=str(i)+' '
-        f.write(pw[:-1]+'\n')
-    f.close()
-    return str(os.path.join(d,"spmcc_"+str(trial)+".projs")) #projection_functions
+    path = os.path.join(d, "spmcc_" + str(trial) + ".projs.npz")
+    save_projections(path, permutation_projections(KC_size, PN_size, proj_size))
+    return path
 
 
 if __name__ == '__main__':
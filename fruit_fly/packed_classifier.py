@@ -0,0 +1,59 @@
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+
+def pack_hashes(hs_mat, chunk_size=65536):
+    """Pack binary hashes (sparse or dense) into uint8 rows, 8 KCs per byte."""
+    packed = []
+    for i in range(0, hs_mat.shape[0], chunk_size):
+        part = hs_mat[i: i+chunk_size]
+        part = part.toarray() if issparse(part) else np.asarray(part)
+        packed.append(np.packbits(part > 0, axis=1))
+    return np.vstack(packed)
+
+
+class PackedLinearClassifier:
+    """Linear classifier over bit-packed binary hashes.
+    The weights are regrouped into one lookup table per byte position: entry
+    [b, v] holds the sum of the weights of the KCs set in byte value v. Scoring a
+    packed document is then one table lookup per non-zero byte."""
+    def __init__(self, coef, intercept, classes):
+        self.classes_ = np.asarray(classes)
+        self.n_bits = coef.shape[1]
+        self.intercept = np.asarray(intercept, dtype=np.float32)
+        n_bytes = (self.n_bits + 7) // 8
+        padded = np.zeros((coef.shape[0], n_bytes * 8), dtype=np.float32)
+        padded[:, :self.n_bits] = coef
+        #bit patterns of all byte values, most significant bit first (as np.packbits)
+        bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(np.float32)
+        self.tables = np.einsum('vj,cbj->bvc', bits, padded.reshape(coef.shape[0], n_bytes, 8))
+
+    @classmethod
+    def from_sklearn(cls, lm):
+        return cls(lm.coef_, lm.intercept_, lm.classes_)
+
+    def decision_function(self, packed, chunk_size=65536):
+        n_bytes, _, n_classes = self.tables.shape
+        if packed.shape[1] != n_bytes:
+            raise ValueError(f"Hashes of {packed.shape[1] * 8} bits, but the classifier was trained on {self.n_bits} KCs")
+        flat_tables = self.tables.reshape(n_bytes * 256, n_classes)
+        scores = np.empty((packed.shape[0], n_classes), dtype=np.float32)
+        for i in range(0, packed.shape[0], chunk_size):
+            part = np.ascontiguousarray(packed[i: i+chunk_size])
+            #one lookup per non-zero byte: gather the table rows and sum them per document
+            nz = np.flatnonzero(part)
+            codes = (nz % n_bytes).astype(np.int32) * 256 + part.ravel()[nz]
+            indptr = np.concatenate([[0], np.cumsum(np.count_nonzero(part, axis=1))])
+            lookups = csr_matrix((np.ones(len(nz), dtype=np.float32), codes, indptr),
+                                 shape=(part.shape[0], n_bytes * 256))
+            scores[i: i+chunk_size] = lookups.dot(flat_tables) + self.intercept
+        return scores
+
+    def predict(self, packed):
+        scores = self.decision_function(packed)
+        if scores.shape[1] == 1: #binary classifier
+            return self.classes_[(scores[:, 0] > 0).astype(np.int_)]
+        return self.classes_[np.argmax(scores, axis=1)]
+
+    def score(self, packed, classes):
+        return np.mean(self.predict(packed) == np.asarray(classes))
@@ -0,0 +1,49 @@
+"""Plot the best fitness reached against the compute used, for evolution and hyper-parameter search logs
+Usage:
+  plot_compute.py <log>... [--x=<cpu|wall|elapsed>] [--out=<filename>]
+  plot_compute.py (-h | --help)
+  plot_compute.py --version
+Options:
+  -h --help                       Show this screen.
+  --version                       Show version.
+  <log>                           JSON log of evolve_flies.py, evolve_growing_flies.py, evolve_on_budget.py (models/evolution/*.json)
+                                  or hyperparam_search.py (log/compute_*.json).
+  --x=<cpu|wall|elapsed>          Compute on the x axis: CPU-seconds or wall-seconds of the fitness evaluations, or duration of the run [default: cpu].
+  --out=<filename>                Name of the figure [default: fitness_vs_compute.png].
+"""
+
+import json
+import numpy as np
+from os.path import basename
+from docopt import docopt
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+
+def read_curve(log_file, x_key):
+    """Best score so far against cumulative compute, from the records of a log that
+    have compute stats: generation stats (best_fitness) or search steps (target)."""
+    xs, ys = [], []
+    with open(log_file) as f:
+        for line in f:
+            record = json.loads(line)
+            if x_key not in record:
+                continue #hyper-parameters of the run
+            xs.append(record[x_key])
+            ys.append(record['best_fitness'] if 'best_fitness' in record else record['target'])
+    return np.array(xs), np.maximum.accumulate(ys) if ys else np.array(ys)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='Fitness versus compute, ver 0.1')
+    x_key = args['--x']
+    for log_file in args['<log>']:
+        xs, ys = read_curve(log_file, x_key)
+        print(f'{log_file}: best {ys[-1] if len(ys) else None} after {xs[-1] if len(xs) else 0:.1f} {x_key}-seconds')
+        plt.step(xs, ys, where='post', label=basename(log_file))
+    plt.xlabel({'cpu': 'CPU-seconds of fitness evaluation', 'wall': 'wall-seconds of fitness evaluation',
+                'elapsed': 'duration of the run (s)'}[x_key])
+    plt.ylabel('best fitness so far')
+    plt.legend(fontsize=8)
+    plt.savefig(args['--out'])
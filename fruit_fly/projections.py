@@ -0,0 +1,80 @@
+"""Random projections from the PN layer to the KC layer, built directly as
+KC x PN CSR matrices: all the random PN indices of all KCs are drawn in one go,
+and memory is proportional to the number of connections, never to KC x PN.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack, random as sparse_random
+
+
+def _csr(indices, lengths, pn_size, data=None):
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    if data is None:
+        data = np.ones(len(indices), dtype=np.float32)
+    return csr_matrix((data, indices.astype(np.int32), indptr), shape=(len(lengths), pn_size))
+
+
+def random_projections(kc_size, pn_size, min_proj, max_proj=None, random_state=None):
+    """Each KC is connected to a number of PNs drawn uniformly in [min_proj, max_proj)
+    (exactly min_proj if max_proj is None). The PNs are drawn with replacement, so a
+    KC can end up with fewer distinct ones, as in the GA flies.
+    random_state is a np.random.RandomState to draw from instead of the global one."""
+    rng = np.random.mtrand._rand if random_state is None else random_state
+    if max_proj is None:
+        lengths = np.full(kc_size, min_proj)
+    else:
+        lengths = rng.randint(low=min_proj, high=max_proj, size=kc_size)
+    projections = _csr(rng.randint(pn_size, size=lengths.sum()), lengths, pn_size)
+    projections.sum_duplicates()
+    projections.data[:] = 1
+    return projections
+
+
+def permutation_projections(kc_size, pn_size, proj_size, signed=False, blocks=None, random_state=None):
+    """KCs take proj_size consecutive PNs of a random permutation of the PN layer (the
+    last KC of a permutation gets what remains), and a new permutation is drawn when
+    one runs out, so that all PNs are used before any is used twice.
+    signed gives each connection a random weight of -1 or 1 instead of 1. blocks is a
+    list of arrays of PN indices (e.g. by decreasing variance) that are permuted
+    separately and then concatenated, so that the first block is used first.
+    The indices of each row are kept in the order they were drawn in. random_state is
+    as for random_projections."""
+    rng = np.random.mtrand._rand if random_state is None else random_state
+    if blocks is None:
+        blocks = [np.arange(pn_size)]
+    perm_size = sum(len(b) for b in blocks)
+    kcs_per_perm = -(-perm_size // proj_size)
+    n_perms = -(-kc_size // kcs_per_perm)
+    lengths = np.full(kcs_per_perm, proj_size)
+    lengths[-1] = perm_size - proj_size * (kcs_per_perm - 1)
+    lengths = np.tile(lengths, n_perms)[:kc_size]
+    perms = np.hstack([np.asarray(b)[rng.rand(n_perms, len(b)).argsort(axis=1)] for b in blocks])
+    indices = perms.ravel()[:lengths.sum()]
+    data = np.where(rng.rand(len(indices)) < 0.5, 1, -1).astype(np.float32) if signed else None
+    return _csr(indices, lengths, pn_size, data)
+
+
+def stored_projections(kc_size, pn_size, proj_store):
+    """KC i takes the PNs of proj_store[i % len(proj_store)]."""
+    rows = [proj_store[i % len(proj_store)] for i in range(kc_size)]
+    lengths = np.fromiter((len(p) for p in rows), dtype=np.int64, count=kc_size)
+    return _csr(np.concatenate(rows), lengths, pn_size)
+
+
+def achlioptas_projections(kc_size, pn_size, scale=3, rescale=False):
+    """Sparse random projection of Achlioptas: each weight is -1 or 1 with probability
+    1/(2*scale) each, 0 otherwise, multiplied by sqrt(scale/kc_size) if rescale."""
+    value = np.sqrt(scale / kc_size) if rescale else 1
+    return sparse_random(kc_size, pn_size, density=1 / scale, format='csr', dtype=np.float32,
+                         random_state=np.random.mtrand._rand,
+                         data_rvs=lambda n: np.where(np.random.rand(n) < 0.5, value, -value))
+
+
+def replace_rows(projections, rows, new_rows):
+    """Copy of projections in which the given rows are replaced by those of new_rows,
+    in order (if a row is given twice, its last replacement is kept)."""
+    projections = csr_matrix(projections)
+    source = np.arange(projections.shape[0])
+    source[np.asarray(rows, dtype=np.int64)] = projections.shape[0] + np.arange(len(rows))
+    return vstack([projections, new_rows], format='csr')[source]
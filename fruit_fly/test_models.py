@@ -26,11 +26,11 @@ from hyperparam_search import read_n_encode_dataset, generate_projs
 
 
 def evaluate(top_word, KC_size, proj_size, percent_hash, C, num_iter, num_trial):
-    def _hash_n_train(model_file):
+    def _hash_n_train(projections):
         # print('hashing dataset')
-        hash_train = hash_dataset(dataset_mat=train_set, projection_path=model_file,
+        hash_train = hash_dataset(dataset_mat=train_set, projection_path=projections,
                                   percent_hash=percent_hash, top_words=top_word)
-        hash_test = hash_dataset(dataset_mat=test_set, projection_path=model_file,
+        hash_test = hash_dataset(dataset_mat=test_set, projection_path=projections,
                                  percent_hash=percent_hash, top_words=top_word)
         # print('training and evaluating')
         test_score, model = train_model(m_train=hash_train, classes_train=train_label,
@@ -39,10 +39,10 @@ def evaluate(top_word, KC_size, proj_size, percent_hash, C, num_iter, num_trial)
         return test_score
 
     print('creating projections')
-    model_files = [generate_projs(PN_size, KC_size, proj_size, dataset_name) for _ in range(num_trial)]
+    projection_list = [generate_projs(PN_size, KC_size, proj_size, dataset_name)[1] for _ in range(num_trial)]
     print('training')
     score_list = joblib.Parallel(n_jobs=max_thread, prefer="threads")(
-        joblib.delayed(_hash_n_train)(model_file) for model_file in model_files)
+        joblib.delayed(_hash_n_train)(projections) for projections in projection_list)
 
     avg_score = np.mean(score_list)
     print('average score:', avg_score)
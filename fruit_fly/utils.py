@@ -1,5 +1,7 @@
+import os
 import json
 import pickle
+import threading
 import numpy as np
 from scipy.sparse import csr_matrix, vstack
 
@@ -12,14 +14,66 @@ from bayes_opt.event import Events
 
 
 def write_as_json(dic, f):
-    output_file = open(f, 'w', encoding='utf-8')
-    json.dump(dic, output_file)
+    with open(f, 'w', encoding='utf-8') as output_file:
+        json.dump(dic, output_file)
 
 
 def append_as_json(dic, f):
-    output_file = open(f, 'a', encoding='utf-8')
-    json.dump(dic, output_file)
-    output_file.write("\n")
+    with open(f, 'a', encoding='utf-8') as output_file:
+        json.dump(dic, output_file)
+        output_file.write("\n")
+
+
+class MetricsSink:
+    """
+    Append-only JSON-lines log for stats written every generation. Records are
+    buffered in memory and written by a background thread every flush_interval
+    seconds, through a single file handle kept open until close(). In forked
+    processes (islands), records are appended straight away instead, since the
+    writer thread only exists in the parent.
+    """
+    def __init__(self, path, flush_interval=5.0):
+        self.pid = os.getpid()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def append(self, record):
+        if os.getpid() != self.pid:
+            append_as_json(record, self.path)
+            return
+        with self.lock:
+            self.buffer.append(record)
+
+    def flush(self):
+        with self.lock:
+            records, self.buffer = self.buffer, []
+            if records:
+                self.file.write(''.join(json.dumps(r) + "\n" for r in records))
+                self.file.flush()
+
+    def _run(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.thread.join()
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 def hash_input_vectorized_(pn_mat, weight_mat, percent_hash):
@@ -45,35 +99,110 @@ def hash_dataset_(dataset_mat, weight_mat, percent_hash, top_words):
     return hs
 
 
+def pod_summary(hs_mat, summary=None):
+    """Compute the routing summary of a pod, or update an existing one with
+    newly hashed documents. The summary holds the number of documents, the KC
+    activation histogram and a centroid code made of the most frequently
+    activated KCs (as many as the average number of active KCs per document)."""
+    hs_mat = csr_matrix(hs_mat)
+    if summary is None:
+        summary = {'n_docs': 0, 'n_active': 0, 'kc_hist': np.zeros(hs_mat.shape[1], dtype=np.int64)}
+    summary['n_docs'] += hs_mat.shape[0]
+    summary['n_active'] += hs_mat.count_nonzero()
+    summary['kc_hist'] += np.asarray((hs_mat > 0).sum(axis=0)).ravel()
+    k = max(1, int(round(summary['n_active'] / max(1, summary['n_docs']))))
+    summary['centroid'] = np.sort(np.argpartition(summary['kc_hist'], -k)[-k:])
+    return summary
+
+
+def population_state(pop: list):
+    """
+    Per-fly state of a population as flat arrays: fitness, KC and PN layer sizes, WTA and
+    number of PN-KC connections.
+    """
+    n = len(pop)
+    state = {
+        'fitness': np.fromiter((individual.get_fitness() for individual in pop), dtype=np.float64, count=n),
+        'kc_size': np.fromiter((individual.projection.shape[0] for individual in pop), dtype=np.int64, count=n),
+        'pn_size': np.fromiter((individual.projection.shape[1] for individual in pop), dtype=np.int64, count=n),
+        'wta': np.fromiter((individual.wta for individual in pop), dtype=np.float64, count=n),
+        'connections': np.fromiter((individual.projection.count_nonzero() for individual in pop), dtype=np.int64, count=n),
+    }
+    return state
+
+
+def select_elite_tournament(fitness, elite: int, select_percent: float, tournament_size: int = 2):
+    """
+    Tournament + elitism selection, on an array of fitness values.
+    The elite flies are always selected, the rest of the selection is filled with the
+    winners of random tournaments, drawn in batches.
+    Return the indices of the selected flies.
+    """
+    fitness = np.asarray(fitness, dtype=np.float64)
+    n = len(fitness)
+    num_select = min(n, max(2, round(select_percent * n) - 2))  # at least mother and father
+    selected = np.zeros(n, dtype=bool)
+    num_elite = min(elite, num_select)
+    if num_elite > 0:
+        selected[np.argpartition(-fitness, num_elite - 1)[:num_elite]] = True
+
+    while selected.sum() < num_select:
+        needed = num_select - selected.sum()
+        candidates = np.random.randint(n, size=(2 * needed, tournament_size))
+        winners = candidates[np.arange(len(candidates)), np.argmax(fitness[candidates], axis=1)]
+        winners = winners[~selected[winners]]
+        _, first = np.unique(winners, return_index=True)  # keep the first win of each fly, in order
+        selected[winners[np.sort(first)][:needed]] = True
+    return np.flatnonzero(selected)
+
+
+def select_parents(fitness, elite: int, select_percent: float, num_pairs: int, once: bool = False):
+    """
+    Indices of the mother and (different) father of num_pairs pairs, drawn from the flies
+    selected by select_elite_tournament. The selection is made anew for every pair, or
+    with once=True, a single time for the whole generation, which is much faster on large
+    populations but breeds every pair from the same pool.
+    """
+    if once:
+        selected = select_elite_tournament(fitness, elite, select_percent)
+        mothers = np.random.randint(len(selected), size=num_pairs)
+        fathers = np.random.randint(len(selected) - 1, size=num_pairs)
+        fathers += fathers >= mothers
+        return list(zip(selected[mothers], selected[fathers]))
+    parents = []
+    for _ in range(num_pairs):
+        selected = select_elite_tournament(fitness, elite, select_percent)
+        mother, father = np.random.choice(selected, 2, replace=False)
+        parents.append((mother, father))
+    return parents
+
+
+BEST_SCORES_FILE = './models/evolution/best_scores.json'
+
+
 def get_stats(pop: list):
     """
     Get the average stats of a population
     Compare and get the best fly on multiple criteria
     """
     stats = {}
-    count_nonzero, num_col, num_row, wta, kc_score, val_score, fitness = [], [], [], [], [], [], []
-    for individual in pop:
-        num_row.append(individual.projection.shape[0])
-        num_col.append(individual.projection.shape[1])
-        count_nonzero.append(individual.projection.count_nonzero() /
-                             (individual.projection.shape[0] * individual.projection.shape[1]))
-        wta.append(individual.wta)
-        kc_score.append(individual.kc_score)
-        val_score.append(individual.val_scores)
-        fitness.append(individual.get_fitness())
-    val_score = np.array(val_score)
+    state = population_state(pop)
+    fitness = state['fitness']
+    kc_score = np.array([individual.kc_score for individual in pop])
+    val_score = np.array([individual.val_scores for individual in pop])
 
     # population stats
     stats['fitness'] = np.mean(fitness)
-    stats['non_zero'] = np.mean(count_nonzero)
+    stats['best_fitness'] = np.max(fitness)
+    stats['non_zero'] = np.mean(state['connections'] / (state['kc_size'] * state['pn_size']))
     stats['val_score'] = np.mean(val_score, axis=0).tolist()
-    stats['kc_size'] = np.mean(num_row)
-    stats['wta'] = np.mean(wta)
+    stats['kc_size'] = np.mean(state['kc_size'])
+    stats['wta'] = np.mean(state['wta'])
     stats['kc_score'] = np.mean(kc_score)
 
     # get best individual
-    with open('./models/evolution/best_scores.json') as f:
-        best_scores = json.load(f)
+    best_scores = _load_best_scores()
+    best_before = dict(best_scores)
     # best fitness
     if max(fitness) > best_scores['fitness']:
         best_scores['fitness'] = max(fitness)
@@ -105,13 +234,32 @@ def get_stats(pop: list):
         best_scores['val_20news'] = max(val_score[:, 2])
         with open('./models/evolution/best_val_20news', "wb") as f:
             pickle.dump(pop[np.argmax(val_score[:, 2])], f)
-    # update best json
-    with open('./models/evolution/best_scores.json', 'w') as f:
-        json.dump(best_scores, f)
+    # update best json, only when a record was broken
+    if best_scores != best_before:
+        _save_best_scores(best_scores)
 
     return stats
 
 
+_best_scores_cache = {'mtime': None, 'scores': None}
+
+
+def _load_best_scores():
+    """best_scores.json, re-read only if another process (e.g. an island) has changed it."""
+    mtime = os.stat(BEST_SCORES_FILE).st_mtime_ns
+    if mtime != _best_scores_cache['mtime']:
+        with open(BEST_SCORES_FILE) as f:
+            _best_scores_cache['scores'] = json.load(f)
+        _best_scores_cache['mtime'] = mtime
+    return _best_scores_cache['scores']
+
+
+def _save_best_scores(best_scores):
+    write_as_json(best_scores, BEST_SCORES_FILE)
+    _best_scores_cache['scores'] = best_scores
+    _best_scores_cache['mtime'] = os.stat(BEST_SCORES_FILE).st_mtime_ns
+
+
 def bayesian_optimization():
     def _evolve_bayes(pop_size: int, crossover_prob: float, select_percent: float,
                       mutate_prob_proj: float, mutate_scale_wta: float):
@@ -1,13 +1,15 @@
 """Hash base pod with selected fly
 
 Usage:
-  hash_pod.py --fly=<path>
+  hash_pod.py --fly=<path> [--levels=<l>] [--classifier=<path>]
   hash_pod.py (-h | --help)
   hash_pod.py --version
 Options:
   -h --help                 Show this screen.
   --version                 Show version.
-  --fly=<path>              Path to selected (deployed) fly model.
+  --fly=<path>              Path to selected (deployed) fly: a bundle from fruit_fly/export_fly_for_deployment.py, or an older fly.m.
+  --levels=<l>              Comma-separated WTA percentages for coarse codes, e.g. 1,5 (optional).
+  --classifier=<path>       Bit-packed metacategory classifier saved by fruit_fly/classify_wiki.py, to label the documents (optional).
 
 """
 
@@ -16,12 +18,14 @@ import numpy as np
 import sentencepiece as spm
 from sklearn.feature_extraction.text import CountVectorizer
 from utils import read_vocab, wta, return_keywords
-from utils import hash_dataset_
+from utils import hash_dataset_, hash_dataset_nested_, pod_summary
+from packed_classifier import pack_hashes
+from bundle import load_bundle, MAGIC
 from scipy import sparse
 from scipy.sparse import csr_matrix, vstack
 import pathlib
 from docopt import docopt
-from os.path import join
+from os.path import join, exists
 import glob
 import re
 
@@ -32,17 +36,40 @@ class DeployedFly:
         self.projection = None
         self.val_scores = []
 
+def load_fly(path):
+  '''Deployed fly, with what it needs to encode documents (sp, vocab, reverse_vocab, logprobs
+  and top_words). Bundles carry all of it; older pickled flies use the spm model and
+  vocabulary of the repository.'''
+  with open(path, 'rb') as f:
+    if f.read(len(MAGIC)) == MAGIC:
+      return load_bundle(path)
+  with open(path, 'rb') as f:
+    try:
+      fly = pickle.load(f)
+    except ModuleNotFoundError as e:  #flies exported with their genome need fruit_fly/genome.py
+      if e.name != 'genome':
+        raise
+      fly = None
+  if not hasattr(fly, 'projection'):
+    raise ValueError(f'{path} was exported without its projection matrix (genome only): '
+                     're-export it with fruit_fly/export_fly_for_deployment.py')
+  fly.sp = spm.SentencePieceProcessor()
+  fly.sp.load('../../spm/spmcc.model')
+  fly.vocab, fly.reverse_vocab, fly.logprobs = read_vocab()
+  fly.top_words = 250
+  return fly
+
+
 def read_categories(metacat_dir):
     categories=glob.glob(metacat_dir+"/*")
     return categories
 
 
-def hash_documents(f_dataset, best_fly):
+def hash_documents(f_dataset, best_fly, levels=None, classifier=None):
   print("Processing",f_dataset)
-  top_words = 250
-  sp = spm.SentencePieceProcessor()
-  sp.load('../../spmcc.model')
-  vocab, reverse_vocab, logprobs = read_vocab()
+  top_words = best_fly.top_words
+  sp = best_fly.sp
+  vocab, reverse_vocab, logprobs = best_fly.vocab, best_fly.reverse_vocab, best_fly.logprobs
   vectorizer = CountVectorizer(vocabulary=vocab, lowercase=False, token_pattern='[^ ]+')
   new_ids = [] 
   new_labels = [] 
@@ -81,12 +108,28 @@ def hash_documents(f_dataset, best_fly):
         doc=""
         continue
 
-  new_hs_mat = hash_dataset_(dataset_mat=vstack(hashes), weight_mat=best_fly.projection,
+  if levels:
+    #coarse codes first, the last level is the fly's own hash
+    nested_hs = hash_dataset_nested_(dataset_mat=vstack(hashes), weight_mat=best_fly.projection,
+                     levels=levels+[best_fly.wta], top_words=top_words)
+    new_nhs, new_hs_mat = nested_hs[:-1], nested_hs[-1]
+  else:
+    new_hs_mat = hash_dataset_(dataset_mat=vstack(hashes), weight_mat=best_fly.projection,
                      percent_hash=best_fly.wta, top_words=top_words)
   lab = new_labels[0] #all labels should be the same
+  if classifier:
+    new_preds = list(classifier.predict(pack_hashes(new_hs_mat)))
 
   hs_file='./hashes/'+lab+".hs"
   if hs_file in glob.glob('./hashes/*.hs'):
+      #the coarse codes must cover all the documents of the pod, at the same levels
+      nhs_file = hs_file.replace(".hs", ".nhs")
+      nhs = pickle.load(open(nhs_file, 'rb')) if exists(nhs_file) else None
+      pod_levels = nhs['levels'] if nhs else None
+      if pod_levels != levels:
+        raise ValueError(f'{hs_file} was hashed with levels {pod_levels}, not {levels}: '
+                         'append with the same --levels, or delete the pod and hash it again')
+
       hs_mat = pickle.load(open(hs_file, 'rb'))
       hs_matrix = vstack([hs_mat, new_hs_mat])
       pickle.dump(hs_matrix, open(hs_file, 'wb'))
@@ -111,28 +154,51 @@ def hash_documents(f_dataset, best_fly):
       keyws = keyws + new_keywords
       pickle.dump(keyws, open(hs_file.replace(".hs", ".kwords"), 'wb'))
       print(len(keyws),len(new_keywords))
+
+      sum_file = hs_file.replace(".hs", ".sum")
+      summary = pickle.load(open(sum_file, 'rb')) if exists(sum_file) else pod_summary(hs_mat)
+      pickle.dump(pod_summary(new_hs_mat, summary), open(sum_file, 'wb'))
+
+      pred_file = hs_file.replace(".hs", ".pred")
+      if classifier and exists(pred_file):
+        preds = pickle.load(open(pred_file, 'rb'))
+        pickle.dump(preds + new_preds, open(pred_file, 'wb'))
+
+      if levels:
+        nhs['codes'] = [vstack([old, new]) for old, new in zip(nhs['codes'], new_nhs)]
+        pickle.dump(nhs, open(nhs_file, 'wb'))
   else:
       pickle.dump(new_hs_mat, open(hs_file, 'wb'))
       pickle.dump(new_ids, open(hs_file.replace(".hs", ".ids"), 'wb'))
       pickle.dump(new_labels, open(hs_file.replace(".hs", ".cls"), 'wb'))
       pickle.dump(new_urls, open(hs_file.replace(".hs", ".url"), 'wb'))
       pickle.dump(new_keywords, open(hs_file.replace(".hs", ".kwords"), 'wb'))
+      pickle.dump(pod_summary(new_hs_mat), open(hs_file.replace(".hs", ".sum"), 'wb'))
+      if classifier:
+        pickle.dump(new_preds, open(hs_file.replace(".hs", ".pred"), 'wb'))
+      if levels:
+        pickle.dump({'levels': levels, 'codes': new_nhs}, open(hs_file.replace(".hs", ".nhs"), 'wb'))
 
 
 if __name__ == '__main__':
     args = docopt(__doc__, version='Hashing a base pod, ver 0.1')
 
     fly_model = args['--fly']
+    levels = [float(l) for l in args['--levels'].split(',')] if args['--levels'] else None
     pathlib.Path('./hashes').mkdir(parents=True, exist_ok=True)
 
     metacat = input("Please enter a category name: ").replace(' ','_')
     metacat_dir = "./data/categories/"+metacat
     cats = read_categories(metacat_dir)
 
-    with open(fly_model, 'rb') as f: 
-      fly_model = pickle.load(f)
+    fly_model = load_fly(fly_model)
+
+    classifier = None
+    if args['--classifier']:
+      with open(args['--classifier'], 'rb') as f:
+        classifier = pickle.load(f)
 
     for cat in cats:
-        hash_documents(join(cat,"linear.txt"), fly_model)
+        hash_documents(join(cat,"linear.txt"), fly_model, levels, classifier)
 
     print("Hashing complete!")
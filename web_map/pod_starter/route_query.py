@@ -0,0 +1,91 @@
+"""Search the hashed pods with a query, only looking into the most relevant pods
+
+Usage:
+  route_query.py --fly=<path> --query=<str> [--pods=<n>] [--metric=<str>] [--k=<n>] [--shortlist=<n>]
+  route_query.py (-h | --help)
+  route_query.py --version
+Options:
+  -h --help                 Show this screen.
+  --version                 Show version.
+  --fly=<path>              Path to selected (deployed) fly: a bundle from fruit_fly/export_fly_for_deployment.py, or an older fly.m.
+  --query=<str>             The query text.
+  --pods=<n>                Number of pods to search. More pods means better recall but slower search [default: 3].
+  --metric=<str>            Pod ranking, either hamming (query vs pod centroid) or hist (KC histogram) [default: hamming].
+  --k=<n>                   Number of results to return [default: 10].
+  --shortlist=<n>           In pods hashed with --levels, number of candidates kept by the coarsest code before reranking [default: 200].
+
+"""
+
+import pickle
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from utils import hash_dataset_, hash_dataset_nested_, pod_summary, route_pods
+from scipy.sparse import csr_matrix
+from docopt import docopt
+from os.path import exists, basename
+from hash_pod import DeployedFly, load_fly
+import glob
+
+
+def read_summaries():
+  summaries = {}
+  for hs_file in glob.glob('./hashes/*.hs'):
+    sum_file = hs_file.replace(".hs", ".sum")
+    if exists(sum_file):
+      summary = pickle.load(open(sum_file, 'rb'))
+    else: #pod hashed before summaries were introduced
+      summary = pod_summary(pickle.load(open(hs_file, 'rb')))
+      pickle.dump(summary, open(sum_file, 'wb'))
+    summaries[basename(hs_file).replace(".hs", "")] = summary
+  return summaries
+
+
+def encode_query(query, fly):
+  vectorizer = CountVectorizer(vocabulary=fly.vocab, lowercase=False, token_pattern='[^ ]+')
+  ll = fly.sp.encode_as_pieces(query)
+  return csr_matrix(vectorizer.fit_transform([" ".join(ll)])).multiply(fly.logprobs)
+
+
+def shortlist_candidates(query_vec, fly, pod, num_docs, shortlist):
+  '''Filter the documents of a pod on the coarsest nested code, if the pod has one'''
+  nhs_file = './hashes/'+pod+".nhs"
+  if not exists(nhs_file):
+    return np.arange(num_docs)
+  nhs = pickle.load(open(nhs_file, 'rb'))
+  if nhs['codes'][0].shape[0] != num_docs or num_docs <= shortlist: #stale or small pod
+    return np.arange(num_docs)
+  query_codes = hash_dataset_nested_(dataset_mat=query_vec, weight_mat=fly.projection,
+                                     levels=nhs['levels']+[fly.wta], top_words=fly.top_words)
+  overlap = np.asarray(nhs['codes'][0].dot(query_codes[0].T).todense()).ravel()
+  return np.argpartition(-overlap, shortlist)[:shortlist]
+
+
+def search_pods(query_vec, query_hs, fly, pods, k, shortlist):
+  results = []
+  for pod in pods:
+    hs_mat = csr_matrix(pickle.load(open('./hashes/'+pod+".hs", 'rb')))
+    urls = pickle.load(open('./hashes/'+pod+".url", 'rb'))
+    candidates = shortlist_candidates(query_vec, fly, pod, hs_mat.shape[0], shortlist)
+    hs_mat = hs_mat[candidates]
+    #Hamming similarity between binary vectors: shared ones plus shared zeros
+    overlap = np.asarray(hs_mat.dot(query_hs.T).todense()).ravel()
+    mismatch = np.asarray(hs_mat.sum(axis=1)).ravel() + query_hs.sum() - 2 * overlap
+    sims = 1 - mismatch / hs_mat.shape[1]
+    for i in np.argsort(-sims)[:k]:
+      results.append((sims[i], pod, urls[candidates[i]]))
+  return sorted(results, key=lambda r: r[0], reverse=True)[:k]
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__, version='Routing a query through pods, ver 0.1')
+
+    fly_model = load_fly(args['--fly'])
+
+    query_vec = encode_query(args['--query'], fly_model)
+    query_hs = hash_dataset_(dataset_mat=query_vec, weight_mat=fly_model.projection,
+                             percent_hash=fly_model.wta, top_words=fly_model.top_words)
+    summaries = read_summaries()
+    pods = route_pods(query_hs, summaries, int(args['--pods']), metric=args['--metric'])
+    print("Searching pods:", pods)
+    for sim, pod, url in search_pods(query_vec, query_hs, fly_model, pods, int(args['--k']), int(args['--shortlist'])):
+      print(round(sim, 4), pod, url)
@@ -46,6 +46,20 @@ def wta_vectorized(feature_mat, k, percent=True):
     feature_mat[is_smaller_than_kth] = 0
     return feature_mat
 
+def wta_nested(feature_mat, levels, percent=True):
+    """Nested winner-take-all: a single partial sort of each row gives the
+    top-k masks for all the k in levels (e.g. 1%, 5% and the fly's wta)."""
+    m, n = feature_mat.shape
+    if percent:
+        levels = [int(k * n / 100) for k in levels]
+    levels = [max(1, int(k)) for k in levels]
+    # get (unsorted) indices of the largest top-k, then sort only those values
+    topk_indices = np.argpartition(feature_mat, -max(levels), axis=1)[:, -max(levels):]
+    rows, _ = np.indices(topk_indices.shape)
+    topk_vals = -np.sort(-feature_mat[rows, topk_indices], axis=1)
+    # keep values larger or equal to the k-th value, as wta_vectorized does
+    return [(feature_mat >= topk_vals[:, k-1][:, None]) & (feature_mat > 0) for k in levels]
+
 def return_keywords(vec):
     keywords = []
     vs = np.argsort(vec)
@@ -74,3 +88,51 @@ def hash_dataset_(dataset_mat, weight_mat, percent_hash, top_words):
     hs = (hs > 0).astype(np.int_)
     return hs
 
+
+def hash_dataset_nested_(dataset_mat, weight_mat, levels, top_words):
+    """Same as hash_dataset_, but returns one binary hash matrix per WTA level."""
+    m, n = dataset_mat.shape
+    dataset_mat = csr_matrix(dataset_mat)
+    wta_csr = csr_matrix(np.zeros(n))
+    for i in range(0, m, 2000):
+        part = wta_vectorized(dataset_mat[i: i+2000].toarray(), k=top_words, percent=False)
+        wta_csr = vstack([wta_csr, csr_matrix(part, shape=part.shape)])
+    kc_mat = wta_csr[1:].dot(weight_mat.T)
+    parts = [[] for _ in levels]
+    for i in range(0, m, 2000):
+        masks = wta_nested(kc_mat[i: i+2000].toarray(), levels)
+        for l, mask in enumerate(masks):
+            parts[l].append(csr_matrix(mask.astype(np.int_)))
+    return [vstack(p).tocsr() for p in parts]
+
+def pod_summary(hs_mat, summary=None):
+    """Compute the routing summary of a pod, or update an existing one with
+    newly hashed documents. The summary holds the number of documents, the KC
+    activation histogram and a centroid code made of the most frequently
+    activated KCs (as many as the average number of active KCs per document)."""
+    hs_mat = csr_matrix(hs_mat)
+    if summary is None:
+        summary = {'n_docs': 0, 'n_active': 0, 'kc_hist': np.zeros(hs_mat.shape[1], dtype=np.int64)}
+    summary['n_docs'] += hs_mat.shape[0]
+    summary['n_active'] += hs_mat.count_nonzero()
+    summary['kc_hist'] += np.asarray((hs_mat > 0).sum(axis=0)).ravel()
+    k = max(1, int(round(summary['n_active'] / max(1, summary['n_docs']))))
+    summary['centroid'] = np.sort(np.argpartition(summary['kc_hist'], -k)[-k:])
+    return summary
+
+def route_pods(query_hs, summaries, num_pods, metric="hamming"):
+    """Rank pods by affinity to a query hash and return the names of the top num_pods.
+    hamming: Hamming distance between the query code and the pod centroid code.
+    hist: average activation frequency, in the pod, of the KCs active in the query."""
+    query_kcs = np.nonzero(np.asarray(csr_matrix(query_hs).todense()).ravel())[0]
+    names = list(summaries.keys())
+    scores = []
+    for name in names:
+        summary = summaries[name]
+        if metric == "hamming":
+            overlap = np.intersect1d(query_kcs, summary['centroid']).shape[0]
+            scores.append(-(query_kcs.shape[0] + summary['centroid'].shape[0] - 2 * overlap))
+        else:
+            scores.append(np.mean(summary['kc_hist'][query_kcs] / summary['n_docs']))
+    ranking = np.argsort(scores)[::-1]
+    return [names[i] for i in ranking[:num_pods]]
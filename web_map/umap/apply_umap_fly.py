@@ -35,9 +35,10 @@ from sklearn.metrics import pairwise_distances
 from collections import Counter
 from nltk.corpus import stopwords
 
-from scipy.sparse import csr_matrix
-from scipy.sparse import vstack
-from utils import read_vocab, hash_dataset_, read_n_encode_dataset, encode_docs
+from scipy.sparse import csr_matrix, issparse
+from threadpoolctl import threadpool_limits
+from utils import read_vocab, hash_dataset_, read_n_encode_dataset, encode_docs, SparseMinMaxScaler, transform_in_chunks
+from eval import prec_at_k
 import matplotlib.pyplot as plt
 from fly import Fly
 
@@ -160,10 +161,10 @@ def generate_cluster_labels(verbose=False):
 def train_umap(logprob_power=7, umap_nns=16, umap_min_dist=0.0, umap_components=31):
     print('--- Training UMAP ---')
     train_set, train_titles, train_labels = read_n_encode_dataset(dataset, vectorizer, logprobs, logprob_power)
-    train_set = train_set.todense()[:50000]
+    train_set = csr_matrix(train_set)[:50000]
     train_labels = train_labels[:50000]
-    scaler = preprocessing.MinMaxScaler().fit(train_set)
-    train_set = scaler.transform(train_set)
+    scaler = SparseMinMaxScaler().fit(train_set)
+    train_set = scaler.densify(scaler.transform(train_set)) #only the 50k rows UMAP is trained on are dense
     umap_model = umap.UMAP(n_neighbors=umap_nns, min_dist=umap_min_dist, n_components=umap_components, metric='hellinger', random_state=32).fit(train_set)
 
     dfile = dataset.split('/')[-1].replace('.sp','.umap')
@@ -177,17 +178,11 @@ def train_umap(logprob_power=7, umap_nns=16, umap_min_dist=0.0, umap_components=
 def apply_umap(umap_model, dataset, save=True):
     print('\n---Applying UMAP to ',dataset)
     data_set, data_titles, data_labels = read_n_encode_dataset(dataset, vectorizer, logprobs, logprob_power)
-    scaler = preprocessing.MinMaxScaler().fit(data_set.todense())
-    data_set = scaler.transform(data_set.todense())
-    m = csr_matrix(umap_model.transform(data_set[:20000,:]))
-
-    for i in range(20000,data_set.shape[0],20000):
-        print("Reducing",i,"to",i+20000)
-        m2=csr_matrix(umap_model.transform(data_set[i:i+20000,:]))
-        #print(m.shape,m2.shape)
-        m = vstack((m,m2))
-        #print("New m shape:",m.shape)
-    data_set = np.nan_to_num(m)
+    #Scaled on the sparse matrix, made dense 20k rows at a time for UMAP
+    scaler = SparseMinMaxScaler().fit(data_set)
+    data_set = scaler.transform(data_set)
+    m = transform_in_chunks(umap_model, data_set, scaler.densify, chunk_size=20000)
+    data_set = csr_matrix(np.nan_to_num(m))
     
     if save:
         dfile = dataset.replace('.sp','.umap.m')
@@ -232,16 +227,7 @@ def umap_prec_at_k(spf, k):
         for i in idx:
             idx2cl[i] = cl
     umap_labels = [idx2cl[i] for i in range(len(idx2cl))]
-    cosines = 1-pairwise_distances(train_set.todense(), metric="cosine")
-    scores = []
-    for i in range(len(cosines)):
-        i_sim = np.array(cosines[i])
-        i_label = umap_labels[i]
-        ranking = np.argsort(-i_sim)
-        neighbours = [umap_labels[n] for n in ranking][1:k+1] #don't count first neighbour which is itself
-        score = sum([1 if n == i_label else 0 for n in neighbours]) / k
-        scores.append(score)
-    return np.mean(scores)
+    return prec_at_k(m=train_set, classes=umap_labels, k=k, metric="cosine")
 
 def sanity_check(hashed_data, titles, cats):
     hammings = 1-pairwise_distances(hashed_data.todense(), metric="hamming")
@@ -253,9 +239,14 @@ def sanity_check(hashed_data, titles, cats):
         for n in neighbours:
             print(n)
 
+def load_umap_matrix(path):
+    '''UMAP outputs are dense: they are hashed on the dense path of hash_dataset_'''
+    m = joblib.load(path)
+    return m.toarray() if issparse(m) else np.asarray(m)
+
 def train_fly(dataset, kc_size, wta, proj_size, k, cluster_labels, num_trial):
     train_set, train_titles, train_labels = read_n_encode_dataset(dataset, vectorizer, logprobs, logprob_power)
-    umap_mat = joblib.load(dataset.replace('.sp','.umap.m'))
+    umap_mat = load_umap_matrix(dataset.replace('.sp','.umap.m'))
     cl2idx = pickle.load(open(dataset.replace('sp','cl2idx.pkl'),'rb'))
     idx2cl = {}
     for cl,idx in cl2idx.items():
@@ -272,7 +263,8 @@ def train_fly(dataset, kc_size, wta, proj_size, k, cluster_labels, num_trial):
     fly_list = [Fly(pn_size, kc_size, wta, proj_size, top_words, init_method, eval_method, proj_store, hyperparameters) for _ in range(num_trial)]
     '''Compute precision at k using cluster IDs from Birch model'''
     #score, hashed_data = fly.evaluate(umap_mat,umap_mat,umap_labels,umap_labels)
-    with Parallel(n_jobs=max_thread, prefer="threads") as parallel:
+    #one BLAS thread per fly, the flies are hashed in parallel
+    with Parallel(n_jobs=max_thread, prefer="threads") as parallel, threadpool_limits(limits=1, user_api='blas'):
         delayed_funcs = [delayed(lambda x:x.evaluate(umap_mat,umap_mat,umap_labels,umap_labels))(fly) for fly in fly_list]
         scores = parallel(delayed_funcs)
     score_list = np.array([p[0] for p in scores])
@@ -283,7 +275,7 @@ def train_fly(dataset, kc_size, wta, proj_size, k, cluster_labels, num_trial):
 
 def apply_fly(spf,fly_path):
     data_set, data_titles, data_labels = read_n_encode_dataset(spf, vectorizer, logprobs, logprob_power)
-    umap_mat = joblib.load(spf.replace('.sp','.umap.m'))
+    umap_mat = load_umap_matrix(spf.replace('.sp','.umap.m'))
     cl2idx = pickle.load(open(spf.replace('sp','cl2idx.pkl'),'rb'))
     idx2cl = {}
     for cl,idx in cl2idx.items():
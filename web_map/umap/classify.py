@@ -15,6 +15,7 @@ from docopt import docopt
 import numpy as np
 from sklearn import linear_model
 import pickle
+from scipy.sparse import csr_matrix
 
 #print(device)
 #random.seed(77)
@@ -50,10 +51,10 @@ def train_model(m_train,classes_train,m_val,classes_val,C,num_iter):
 def prepare_data(tr_file):
     dev_file = tr_file.replace("train","val")
     # print("Reading dataset...")
-    m_train = pickle.load(open(tr_file,'rb')).todense()
+    m_train = csr_matrix(pickle.load(open(tr_file,'rb')))
     #print(m_train)
     #m_train = preprocessing.normalize(m_train, norm='l1')
-    m_val = pickle.load(open(dev_file,'rb')).todense()
+    m_val = csr_matrix(pickle.load(open(dev_file,'rb')))
     #print(m_val)
     #m_val = preprocessing.normalize(m_val, norm='l1')
 
@@ -9,6 +9,7 @@ from scipy.sparse import hstack, vstack, lil_matrix, coo_matrix
 from classify import train_model
 from sklearn.metrics import pairwise_distances
 from fly_utils import read_vocab, hash_dataset_
+from eval import prec_at_k, kc_use_sorted
 
 class Fly:
     def __init__(self, pn_size=None, kc_size=None, wta=None, proj_size=None, top_words=None, init_method=None, eval_method=None, proj_store=None, hyperparameters=None):
@@ -156,27 +157,9 @@ class Fly:
         #print("KC USE:",np.sort(self.kc_use)[::-1][:20])
         return self.val_score, hash_val
 
-    def compute_nearest_neighbours(self,hammings,labels,i,num_nns):
-        i_sim = np.array(hammings[i])
-        i_label = labels[i]
-        ranking = np.argsort(-i_sim)
-        neighbours = [labels[n] for n in ranking][1:num_nns+1] #don't count first neighbour which is itself
-        score = sum([1 if n == i_label else 0 for n in neighbours]) / num_nns
-        #print(i,i_label,neighbours,score)
-        return score,neighbours
-
     def prec_at_k(self,m_val=None,classes_val=None,k=None):
-        hammings = 1-pairwise_distances(m_val.todense(), metric="hamming")
-        kc_hash_use = np.zeros(m_val.shape[1])
-        scores = []
-        for i in range(hammings.shape[0]):
-            score, neighbours = self.compute_nearest_neighbours(hammings,classes_val,i,k)
-            for idx in m_val[i].indices:
-                kc_hash_use[idx]+=1
-            scores.append(score)
-        kc_hash_use = kc_hash_use / sum(kc_hash_use)
-        kc_sorted_hash_use = np.argsort(kc_hash_use)[:-kc_hash_use.shape[0]-1:-1] #Give sorted list from most to least used KCs
-        return np.mean(scores), kc_sorted_hash_use
+        score = prec_at_k(m=m_val, classes=classes_val, k=k, metric="hamming")
+        return score, kc_use_sorted(m_val)
 
     def print_projections(self):
         words = ''
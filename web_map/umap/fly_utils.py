@@ -2,8 +2,9 @@ import re
 import json
 import pickle
 import numpy as np
-from scipy.sparse import csr_matrix, vstack
+from scipy.sparse import csr_matrix, vstack, issparse
 from sklearn.metrics import pairwise_distances
+from threadpoolctl import threadpool_limits
 from os.path import exists
 from hash import read_projections, projection_vectorized, wta_vectorized
 
@@ -68,7 +69,58 @@ def hash_input_vectorized_(pn_mat, weight_mat, percent_hash):
     return hashed_kenyon, kc_use, kc_sorted_ids
 
 
+def wta_dense(kc_mat, k):
+    """WTA on a dense array of KC activations: the CSR matrix of the values of each row
+    that are at least its kth largest one (as wta_vectorized, with k a number of KCs)."""
+    kth_vals = np.partition(kc_mat, -k, axis=1)[:, -k]
+    winners = kc_mat >= kth_vals[:, None]
+    winners &= kc_mat != 0
+    flat = np.flatnonzero(winners)
+    indptr = np.concatenate([[0], np.cumsum(winners.sum(axis=1))])
+    return csr_matrix((kc_mat.ravel()[flat], flat % kc_mat.shape[1], indptr), shape=kc_mat.shape)
+
+
+def dense_projection_blocks(weight_mat, block_bytes=2**26):
+    """The transposed projection (PN x KC) as dense float32 blocks of KCs."""
+    weight_mat = csr_matrix(weight_mat)
+    step = max(1, block_bytes // (4 * weight_mat.shape[1]))
+    for b in range(0, weight_mat.shape[0], step):
+        yield weight_mat[b: b+step].T.toarray().astype(np.float32)
+
+
+def hash_dense_(dataset_mat, weight_mat, percent_hash, top_words, chunk_size=2000, n_threads=None):
+    """
+    hash_dataset_ for dense inputs (UMAP outputs): the KC activations of each chunk of
+    documents are a float32 GEMM with the projection made dense (block by block of
+    KCs for large layers), and the WTA builds the CSR hashes straight from the
+    partitioned rows. n_threads limits the number of BLAS threads (e.g. to 1 when
+    several flies are hashed in parallel threads).
+    """
+    dataset_mat = np.array(dataset_mat, dtype=np.float32)
+    m, n = dataset_mat.shape[0], weight_mat.shape[0]
+    k = int(percent_hash * n / 100)
+    cached = 4 * n * dataset_mat.shape[1] <= 2**28  #keep the dense projection if it is small enough
+    blocks = list(dense_projection_blocks(weight_mat)) if cached else None
+    kc_use = np.zeros(n)
+    parts = []
+    with threadpool_limits(limits=n_threads, user_api='blas'):
+        for i in range(0, m, chunk_size):
+            chunk = dataset_mat[i: i+chunk_size]
+            if top_words < chunk.shape[1]:
+                kth_vals = np.partition(chunk, -top_words, axis=1)[:, -top_words]
+                chunk[chunk < kth_vals[:, None]] = 0
+            kc_mat = np.hstack([chunk.dot(w) for w in (blocks or dense_projection_blocks(weight_mat))])
+            kc_use += kc_mat.sum(axis=0, dtype=np.float64)
+            parts.append(wta_dense(kc_mat, k))
+    kc_use = kc_use / sum(kc_use)
+    kc_sorted_ids = np.argsort(kc_use)[:-kc_use.shape[0]-1:-1] #Give sorted list from most to least used KCs
+    hs = (vstack(parts, format='csr') > 0).astype(np.int_)
+    return hs, kc_use, kc_sorted_ids
+
+
 def hash_dataset_(dataset_mat, weight_mat, percent_hash, top_words):
+    if not issparse(dataset_mat):
+        return hash_dense_(dataset_mat, weight_mat, percent_hash, top_words)
     m, n = dataset_mat.shape
     dataset_mat = csr_matrix(dataset_mat)
     wta_csr = csr_matrix(np.zeros(n))
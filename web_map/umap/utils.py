@@ -99,15 +99,44 @@ def read_n_encode_dataset(path, vectorizer, logprobs, power):
     return X, title_list, label_list
 
 
+class SparseMinMaxScaler:
+    """
+    sklearn's MinMaxScaler for CSR matrices of nonnegative features. Scaling is a
+    multiplication of the columns, which keeps the matrix sparse; the shift (-min *
+    scale) is 0 for every feature that is 0 in some training document, and is only
+    added to the rows made dense by densify (see transform_in_chunks).
+    """
+    def fit(self, X):
+        data_min = X.min(axis=0).toarray().ravel()
+        data_range = X.max(axis=0).toarray().ravel() - data_min
+        data_range[data_range == 0] = 1
+        self.scale_ = 1 / data_range
+        self.min_ = -data_min * self.scale_
+        return self
+
+    def transform(self, X):
+        return csr_matrix(csr_matrix(X).multiply(self.scale_))
+
+    def densify(self, X):
+        return X.toarray() + self.min_
+
+
+def transform_in_chunks(reducer, X, densify=None, chunk_size=20000):
+    """reducer.transform on a CSR matrix, made dense (with densify, if given) one chunk
+    of rows at a time."""
+    densify = densify or (lambda m: m.toarray())
+    return np.vstack([reducer.transform(densify(X[i: i+chunk_size])) for i in range(0, X.shape[0], chunk_size)])
+
+
 def write_as_json(dic, f):
-    output_file = open(f, 'w', encoding='utf-8')
-    json.dump(dic, output_file)
+    with open(f, 'w', encoding='utf-8') as output_file:
+        json.dump(dic, output_file)
 
 
 def append_as_json(dic, f):
-    output_file = open(f, 'a', encoding='utf-8')
-    json.dump(dic, output_file)
-    output_file.write("\n")
+    with open(f, 'a', encoding='utf-8') as output_file:
+        json.dump(dic, output_file)
+        output_file.write("\n")
 
 
 def hash_input_vectorized_(pn_mat, weight_mat, percent_hash):